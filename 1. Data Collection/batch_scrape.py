@@ -0,0 +1,147 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from filing_store import find_store
+from ledger import Ledger
+from scrap_filings_items import TenKScraper, find_filings_paths
+from section_index import HeadingIndex
+
+
+def filing_keys(path):
+    """(year, cik, accession) of a path like ./data/10-K/<year>/<cik>/<accession>/filing-details.html"""
+    parts = os.path.normpath(path).split(os.sep)
+    return parts[-4], parts[-3], parts[-2]
+
+
+def scrape_chunk(paths, sections):
+    """
+    Scrape all section pairs of a chunk of filings, runs in a worker process
+
+    returns one record per filing with its sections as text, the time it took and the failure reason if any
+    """
+    scrapers = [TenKScraper(start, end) for start, end in sections]
+    records = []
+    for path in paths:
+        year, cik, accession = filing_keys(path)
+        record = {"year": year, "cik": cik, "accession": accession, "path": path, "error": None}
+        start = time.perf_counter()
+        try:
+            index = HeadingIndex.from_file(path)
+            missing = []
+            for scraper in scrapers:
+                items = scraper.scrape(path, index)
+                record[scraper.range] = items.decode('utf8') if items is not None else None
+                if items is None:
+                    missing.append(scraper.range)
+            if missing:
+                record["error"] = "no matched sections: " + ", ".join(missing)
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            record["failed"] = True
+        record["seconds"] = time.perf_counter() - start
+        records.append(record)
+    return records
+
+
+def chunk_schema(sections):
+    """
+    Schema of every chunk: inferred per chunk, a column with only None values (e.g. no filing
+    of the chunk failed) would be of type null and the chunks could not be read together
+    """
+    text = ["year", "cik", "accession", "path"] + [TenKScraper(s, e).range for s, e in sections]
+    return pa.schema([(name, pa.string()) for name in text] + [("seconds", pa.float64()), ("error", pa.string())])
+
+
+def write_chunk(records, sections, out_dir, chunk_id):
+    """Append the records of one chunk to the Parquet dataset partitioned by year/cik"""
+    if not records:
+        # every filing of the chunk failed, nothing to write
+        return
+    schema = chunk_schema(sections)
+    df = pd.DataFrame(records).reindex(columns=schema.names)
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    pq.write_to_dataset(table, out_dir, partition_cols=["year", "cik"],
+                        basename_template=f"part-{chunk_id}-{{i}}.parquet")
+
+
+def main(sections, doc_type="10-K", base_path="./data/", years=("19", "20", "21"), out_dir="./scrape_results/items",
+         workers=None, chunk_size=50):
+    """
+    Scrape all filings of the given years on a process pool and stream the results to Parquet
+
+    sections: list of tuple, section pairs, e.g. [('Item 1A', 'Item 1B'), ('Item 7', 'Item 7A')]
+
+    out_dir: str, root of the Parquet dataset (partitioned by year and cik); it also holds
+        _scraped.tsv, the checkpoint of finished accessions, and _scrape_log.tsv, the time and
+        failure reason of every filing (files starting with _ are ignored by Parquet readers)
+
+    workers: int, number of processes, default the number of cpus
+
+    chunk_size: int, filings per task, each finished chunk is written immediately
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    with Ledger(os.path.join(out_dir, "_scraped.tsv")) as ledger:
+        paths = []
+        for year in years:
+            if not os.path.exists(os.path.join(base_path, doc_type, year)) and find_store(base_path) is None:
+                print(f"No {doc_type} filings of year {year} in {base_path}, skipped.")
+                continue
+            paths += [path for path in find_filings_paths(doc_type, base_path, year)
+                      if (year, filing_keys(path)[2]) not in ledger]
+        print(f"{len(ledger)} filings already scraped, {len(paths)} to go.")
+
+        chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+        run_id = time.strftime("%Y%m%d%H%M%S")
+        log = open(os.path.join(out_dir, "_scrape_log.tsv"), "a", encoding="utf-8")
+        done, start = 0, time.perf_counter()
+
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {}
+            next_chunk = 0
+            while next_chunk < len(chunks) or pending:
+                # keep a bounded number of chunks in flight so memory does not grow with the corpus
+                while next_chunk < len(chunks) and len(pending) < 2 * workers:
+                    pending[pool.submit(scrape_chunk, chunks[next_chunk], sections)] = next_chunk
+                    next_chunk += 1
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk_id = pending.pop(future)
+                    records = future.result()
+                    write_chunk([r for r in records if not r.get("failed")], sections, out_dir, f"{run_id}-{chunk_id}")
+                    for r in records:
+                        log.write(f"{r['path']}\t{r['seconds']:.4f}\t{r['error'] or ''}\n")
+                        if not r.get("failed"):
+                            ledger.add((r["year"], r["accession"]))
+                    log.flush()
+
+                    done += len(records)
+                    elapsed = time.perf_counter() - start
+                    print(f"Scraped {done}/{len(paths)} filings ({done / elapsed:.1f} filings/s).")
+
+        log.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Scrape 10-K items of all filings in parallel')
+    parser.add_argument('--doc_type', metavar='DT', nargs='?', type=str, default='10-K', help='document type 10-K, 10-Q and so on')
+    parser.add_argument('--base_path', metavar='B', nargs='?', type=str, default='./data/', help='folder of the aggregated filings')
+    parser.add_argument('--years', metavar='Y', nargs='+', type=str, default=['19', '20', '21'], help='years to scrape')
+    parser.add_argument('--out', metavar='O', nargs='?', type=str, default='./scrape_results/items', help='folder of the Parquet dataset')
+    parser.add_argument('--workers', metavar='W', nargs='?', type=int, default=None, help='number of processes, default number of cpus')
+    parser.add_argument('--chunk_size', metavar='C', nargs='?', type=int, default=50, help='filings per task')
+
+    args = parser.parse_args()
+
+    sections = [('Item 1A', 'Item 1B'), ('Item 7', 'Item 7A')]
+    main(sections, args.doc_type, args.base_path, args.years, args.out, args.workers, args.chunk_size)
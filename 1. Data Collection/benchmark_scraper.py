@@ -0,0 +1,123 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+from section_index import HeadingIndex, PATTERNS, legacy_pattern, normalize_page
+
+
+def legacy_match(raw, section, next_section):
+    """
+    Section matching of the original TenKScraper.scrape (without the html to text step):
+    normalize the whole page, then try the 13 patterns one after the other on the whole page.
+    Returns (index of the pattern, match object), or (None, None) if no pattern matches
+    """
+    page = raw.strip()
+    page = page.replace(b'\n', b' ')
+    page = page.replace(b'\r', b'')
+    page = page.replace(b'&nbsp;', b' ')
+    page = page.replace(b'&#160;', b' ')
+    while b'  ' in page:
+        page = page.replace(b'  ', b' ')
+
+    for pattern in range(len(PATTERNS)):
+        match = re.search(legacy_pattern(pattern, section, next_section), page, flags=re.IGNORECASE)
+        if match:
+            return pattern, match
+    return None, None
+
+
+def legacy_scrape(raw, section, next_section):
+    """Raw html of the section found by the original scraper, or None"""
+    _, match = legacy_match(raw, section, next_section)
+    return match.group(1) if match else None
+
+
+def index_scrape(raw, sections):
+    """Section extraction with one normalization and one heading index for all section pairs"""
+    index = HeadingIndex(normalize_page(raw))
+    return [index.find(section, next_section) for section, next_section in sections]
+
+
+def check(paths, sections):
+    """
+    Equivalence check of the heading index: compare the raw html found by HeadingIndex.find with
+    the span matched by the 13 legacy regular expressions for every filing and section pair,
+    print every difference and return their number
+    """
+    differences = 0
+    for path in paths:
+        raw = open(path, 'rb').read()
+        for (section, next_section), result in zip(sections, index_scrape(raw, sections)):
+            pattern, match = legacy_match(raw, section, next_section)
+            expected = match.group(1) if match else None
+            if result == expected:
+                continue
+            differences += 1
+            if expected is None:
+                detail = f"no legacy pattern matches, the index finds {len(result)} bytes"
+            elif result is None:
+                detail = f"the index finds nothing, legacy p{pattern + 1} matches span {match.span(1)}"
+            else:
+                first = next((i for i, (a, b) in enumerate(zip(expected, result)) if a != b),
+                             min(len(expected), len(result)))
+                detail = (f"legacy p{pattern + 1} matches span {match.span(1)}, {len(expected)} bytes, "
+                          f"the index finds {len(result)} bytes, first difference at byte {first}")
+            print(f"{path} {section} - {next_section}: {detail}")
+
+    print(f"{len(paths)} filings, {len(sections)} section pairs, differences: {differences}")
+    return differences
+
+
+def main(paths, sections, repeat=1):
+    """
+    Time the original scraper against the heading index on saved filings and check both give the same sections
+
+    paths: list of str, paths of filing-details.html files
+
+    sections: list of tuple, section pairs to extract, e.g. [('Item 1A', 'Item 1B'), ('Item 7', 'Item 7A')]
+    """
+    pages = [open(path, 'rb').read() for path in paths]
+    size = sum(len(page) for page in pages)
+
+    legacy_time, index_time, mismatches, found = 0.0, 0.0, 0, 0
+    for _ in range(repeat):
+        for path, page in zip(paths, pages):
+            start = time.perf_counter()
+            expected = [legacy_scrape(page, section, next_section) for section, next_section in sections]
+            legacy_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            results = index_scrape(page, sections)
+            index_time += time.perf_counter() - start
+
+            found += sum(result is not None for result in results)
+            if results != expected:
+                mismatches += 1
+                print(f"Mismatch in {path}")
+
+    print(f"{len(paths)} filings ({size / 1024 / 1024:.1f} MB), {len(sections)} section pairs, {repeat} repeat(s)")
+    print(f"sections found: {found}, filings with different results: {mismatches}")
+    for name, seconds in (("original", legacy_time), ("heading index", index_time)):
+        print(f"{name:>14}: {seconds:.3f}s, {len(paths) * repeat / seconds:.1f} filings/s, "
+              f"{size * repeat / 1024 / 1024 / seconds:.1f} MB/s")
+    print(f"speedup: {legacy_time / index_time:.1f}x")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark the section extraction on saved filings')
+    parser.add_argument('--folder', metavar='F', nargs='?', type=str, default='./data/10-K/19', help='folder searched recursively for filing-details.html files')
+    parser.add_argument('--amount', metavar='A', nargs='?', type=int, default=100, help='number of filings to benchmark')
+    parser.add_argument('--repeat', metavar='R', nargs='?', type=int, default=1, help='number of repetitions')
+    parser.add_argument('--check', action='store_true', help='only compare the sections of both scrapers, exit with 1 on any difference')
+
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.folder, '**', 'filing-details.html'), recursive=True))[:args.amount]
+    sections = [('Item 1A', 'Item 1B'), ('Item 7', 'Item 7A')]
+    if args.check:
+        sys.exit(1 if check(paths, sections) else 0)
+    main(paths, sections, args.repeat)
@@ -0,0 +1,182 @@
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# install the dependency of parquet files
+# pip install pyarrow
+
+# columns of the financial statement sub.txt files kept in the index
+# reference: https://www.sec.gov/dera/data/financial-statement-data-sets
+INDEX_COLUMNS = ["adsh", "cik", "name", "sic", "form", "period", "fy", "filed"]
+
+
+def merge_ranges(ranges):
+    """
+    Sort and merge overlapping (start, end) ranges (both ends inclusive), returns two arrays of starts and ends
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    merged = np.array(merged, dtype=np.int64).reshape(-1, 2)
+    return merged[:, 0], merged[:, 1]
+
+
+def in_ranges(values, ranges):
+    """
+    Vectorized membership test of values in any of the (start, end) ranges, returns a boolean array
+    """
+    starts, ends = merge_ranges(ranges)
+    values = np.asarray(values)
+    if len(starts) == 0:
+        return np.zeros(len(values), dtype=bool)
+    # index of the last range starting at or before each value
+    idx = np.searchsorted(starts, values, side="right") - 1
+    return (idx >= 0) & (values <= ends[np.clip(idx, 0, None)])
+
+
+def accession_from_path(path):
+    """
+    The accession number (adsh) of a filing path like ./data/10-K/20/<cik>/<accession>/filing-details.html
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    return parts[-2] if parts[-1].endswith(".html") or parts[-1].endswith(".txt") else parts[-1]
+
+
+def cik_from_path(path):
+    """
+    The cik of a filing path: the closest all-digit folder above the accession folder
+    (.../<cik>/<accession>/... or .../sec-edgar-filings/<cik>/10-K/<accession>/...)
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    accession = accession_from_path(path)
+    end = len(parts) - 1 - parts[::-1].index(accession) if accession in parts else len(parts)
+    for part in reversed(parts[:end]):
+        if part.isdigit():
+            return int(part)
+    return None
+
+
+class CikIndex:
+    """
+    Columnar index of the quarterly EDGAR sub.txt files (one Parquet file per quarter).
+
+    The sub.txt files are parsed once; update() only ingests quarter folders which are new
+    or changed since the last run, afterwards sector selection and cik/adsh lookups are
+    in-memory queries on a compact frame.
+    """
+
+    def __init__(self, index_dir="./cik_index"):
+        self.index_dir = index_dir
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        self.manifest = json.load(open(self.manifest_path)) if os.path.exists(self.manifest_path) else {}
+        self._frame = None
+
+    @staticmethod
+    def find_quarters(root="."):
+        """List quarter folders (2019q1, 2019q2, ...) under root which contain a sub.txt"""
+        paths = glob.glob(os.path.join(root, "[12][0-9][0-9][0-9]q[1-4]", "sub.txt"))
+        return sorted(os.path.dirname(p) for p in paths)
+
+    def update(self, sub_paths=None, root="."):
+        """
+        Ingest new or changed quarter folders
+
+        sub_paths: list of str, quarter folders containing sub.txt, default all folders found under root
+
+        returns the list of quarters which were (re)ingested
+        """
+        sub_paths = self.find_quarters(root) if sub_paths is None else sub_paths
+        ingested = []
+        for path in sub_paths:
+            source = os.path.join(path, "sub.txt")
+            stat = os.stat(source)
+            quarter = os.path.basename(os.path.normpath(path))
+            signature = {"size": stat.st_size, "mtime": stat.st_mtime}
+            if self.manifest.get(quarter) == signature:
+                continue
+
+            df = pd.read_csv(source, sep="\t", usecols=INDEX_COLUMNS, dtype={"adsh": str, "name": str, "form": str},
+                             low_memory=False)
+            df["cik"] = df.cik.astype(np.int64)
+            df["sic"] = df.sic.fillna(-1).astype(np.int32)
+            df["period"] = df.period.fillna(-1).astype(np.int64)
+            df["fy"] = df.fy.fillna(-1).astype(np.int32)
+            df["filed"] = df.filed.fillna(-1).astype(np.int64)
+            df["form"] = df.form.astype("category")
+            df["quarter"] = quarter
+            df.to_parquet(os.path.join(self.index_dir, quarter + ".parquet"), index=False)
+
+            self.manifest[quarter] = signature
+            ingested.append(quarter)
+            print(f"Indexed {source} ({len(df)} rows).")
+
+        if ingested:
+            json.dump(self.manifest, open(self.manifest_path, "w"), indent=2)
+            self._frame = None
+        return ingested
+
+    @property
+    def frame(self):
+        """All indexed quarters as one frame, loaded once"""
+        if self._frame is None:
+            paths = [os.path.join(self.index_dir, q + ".parquet") for q in sorted(self.manifest)]
+            if not paths:
+                raise ValueError(f"Index {self.index_dir} is empty, run update() first.")
+            frame = pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+            frame["form"] = frame.form.astype("category")
+            self._frame = frame
+        return self._frame
+
+    def select_ciks(self, sectors, forms=None, quarters=None):
+        """
+        Extract all ciks according to sector code (sic) ranges, e.g. [(2000, 3999), (7000, 8999)]
+
+        forms: list of str, keep only these forms (10-K, 10-Q, ...), default all
+
+        quarters: list of str, keep only these quarters (2019q1, ...), default all
+        """
+        df = self.frame
+        mask = in_ranges(df.sic.to_numpy(), sectors)
+        if forms is not None:
+            mask &= df.form.isin(forms).to_numpy()
+        if quarters is not None:
+            mask &= df.quarter.isin([os.path.basename(os.path.normpath(q)) for q in quarters]).to_numpy()
+        return np.unique(df.cik.to_numpy()[mask]).tolist()
+
+    def companies(self):
+        """
+        One row per filing (adsh) with cik, company name and sic, indexed by adsh, for joining
+        scraped filings or predictions to companies
+        """
+        return self.frame.drop_duplicates("adsh", keep="last").set_index("adsh")[["cik", "name", "sic", "form", "fy", "period"]]
+
+    def lookup_ciks(self, ciks):
+        """Latest company name and sic of each cik"""
+        df = self.frame.sort_values("filed").drop_duplicates("cik", keep="last").set_index("cik")
+        return df.reindex(ciks)[["name", "sic"]]
+
+    def lookup_paths(self, paths):
+        """Company rows of filing paths, matched on the accession folder of each path"""
+        return self.companies().reindex([accession_from_path(p) for p in paths])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Build or update the cik index of the sub.txt files')
+    parser.add_argument('--root', metavar='R', nargs='?', type=str, default='./', help='folder containing the quarter folders (2019q1, ...)')
+    parser.add_argument('--index', metavar='I', nargs='?', type=str, default='./cik_index', help='folder to save the index')
+
+    args = parser.parse_args()
+
+    index = CikIndex(args.index)
+    index.update(root=args.root)
+    print(f"{len(index.frame)} filings of {index.frame.cik.nunique()} ciks indexed.")
@@ -0,0 +1,256 @@
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ledger import Ledger
+
+# EDGAR asks automated tools to stay under 10 requests per second and to send a
+# descriptive User-Agent, reference: https://www.sec.gov/os/accessing-edgar-data
+SUBMISSIONS_URL = "https://data.sec.gov/submissions/CIK{cik}.json"
+ARCHIVES_URL = "https://www.sec.gov/Archives/edgar/data/{cik_int}/{accession_nodash}/{document}"
+DEFAULT_USER_AGENT = "Corporate Strategies Research research@example.com"
+
+# HTTP status codes which are worth retrying, everything else (404, 403...) is final
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by all workers, so the whole pool stays
+    under `rate` requests per second with bursts of at most `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThroughputMonitor:
+    """
+    Collect download counters from all workers and print them periodically:
+    CIKs/min, bytes/s, retries and failures since the start of the run.
+    """
+
+    def __init__(self, total, interval=10.0):
+        self.total = total
+        self.interval = interval
+        self.ciks = 0
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = 0
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, ciks=0, files=0, nbytes=0, retries=0, failures=0):
+        with self._lock:
+            self.ciks += ciks
+            self.files += files
+            self.bytes += nbytes
+            self.retries += retries
+            self.failures += failures
+
+    def report(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self._start, 1e-9)
+            return (f"CIKs: {self.ciks}/{self.total} ({self.ciks / elapsed * 60:.1f}/min), "
+                    f"files: {self.files}, {self.bytes / elapsed / 1024:.1f} KB/s, "
+                    f"retries: {self.retries}, failures: {self.failures}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.report(), flush=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        print(self.report(), flush=True)
+
+
+class FetchError(Exception):
+    """Raised when a request fails permanently or runs out of retries."""
+
+
+class EdgarClient:
+    """
+    Minimal EDGAR HTTP client: every request goes through the shared token bucket and
+    is retried with exponential backoff and full jitter up to `max_retries` times.
+
+    The URL templates are parameters so the client can be pointed at a local
+    stand-in HTTP server instead of sec.gov.
+    """
+
+    def __init__(self, limiter, monitor=None, user_agent=DEFAULT_USER_AGENT, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, timeout=30.0,
+                 submissions_url=SUBMISSIONS_URL, archives_url=ARCHIVES_URL):
+        self.limiter = limiter
+        self.monitor = monitor
+        self.user_agent = user_agent
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.submissions_url = submissions_url
+        self.archives_url = archives_url
+
+    def get(self, url):
+        request = urllib.request.Request(url, headers={"User-Agent": self.user_agent})
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUS:
+                    raise FetchError(f"{url}: HTTP {e.code}") from e
+                error = e
+            except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise FetchError(f"{url}: giving up after {attempt + 1} attempts ({error})") from error
+
+            # full jitter: sleep a random time in [0, min(cap, base * 2^attempt)]
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            attempt += 1
+            if self.monitor is not None:
+                self.monitor.add(retries=1)
+            time.sleep(delay)
+
+    def recent_filings(self, cik, doc_type, amount):
+        """
+        Return (accession, primary document) pairs of the latest `amount` filings of `doc_type`.
+
+        cik: str, ten digits cik
+        """
+        data = json.loads(self.get(self.submissions_url.format(cik=cik)))
+        recent = data["filings"]["recent"]
+        filings = []
+        for form, accession, document in zip(recent["form"], recent["accessionNumber"], recent["primaryDocument"]):
+            if form == doc_type:
+                filings.append((accession, document))
+                if len(filings) == amount:
+                    break
+        return filings
+
+    def document(self, cik, accession, document):
+        return self.get(self.archives_url.format(
+            cik_int=int(cik), accession_nodash=accession.replace("-", ""), document=document))
+
+
+def _write(path, content):
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def download_cik(client, ledger, cik, doc_type, amount, target_folder, full_submission=False):
+    """
+    Download the latest filings of one cik into the sec-edgar-downloader layout:
+    <target_folder>/sec-edgar-filings/<cik>/<doc_type>/<accession>/filing-details.html
+
+    Filings already recorded in the ledger are skipped. Returns (files, bytes) downloaded.
+    """
+    files, nbytes = 0, 0
+    for accession, document in client.recent_filings(cik, doc_type, amount):
+        if (cik, doc_type, accession) in ledger:
+            continue
+
+        folder = os.path.join(target_folder, "sec-edgar-filings", cik, doc_type, accession)
+        os.makedirs(folder, exist_ok=True)
+
+        content = client.document(cik, accession, document)
+        _write(os.path.join(folder, "filing-details.html"), content)
+        files, nbytes = files + 1, nbytes + len(content)
+
+        if full_submission:
+            content = client.document(cik, accession, accession + ".txt")
+            _write(os.path.join(folder, "full-submission.txt"), content)
+            files, nbytes = files + 1, nbytes + len(content)
+
+        ledger.add((cik, doc_type, accession))
+
+    return files, nbytes
+
+
+def download_filings_concurrent(ciks, doc_type, amount, target_folder, workers=4, rate=8.0,
+                                max_retries=5, ledger_path=None, user_agent=DEFAULT_USER_AGENT,
+                                full_submission=False, report_interval=10.0, client_options=None):
+    """
+    Download filings of many ciks with a bounded thread pool sharing one rate limiter
+
+    ciks: list of int, list of cik
+
+    workers: int, number of concurrent downloads
+
+    rate: float, global ceiling of requests per second over all workers
+
+    max_retries: int, retries per request before the cik is reported as failed
+
+    ledger_path: str, file recording finished cik/doc_type/accession tuples, default
+        <target_folder>/download-ledger.tsv; the filings in it are not downloaded again
+
+    client_options: dict, extra keyword arguments of EdgarClient (e.g. url templates)
+
+    returns the list of ciks that failed
+    """
+    ledger_path = ledger_path or os.path.join(target_folder, "download-ledger.tsv")
+    ciks = ['%010d' % int(cik) for cik in ciks]
+
+    with Ledger(ledger_path) as ledger:
+        # every cik is looked up again (one submissions request): a larger amount or a filing
+        # made since the last run is downloaded, the filings in the ledger are skipped
+        todo = ciks
+        print(f"{len(ledger)} filings already downloaded, {len(todo)} ciks to check.")
+
+        monitor = ThroughputMonitor(len(todo), interval=report_interval)
+        client = EdgarClient(TokenBucket(rate), monitor, user_agent=user_agent,
+                             max_retries=max_retries, **(client_options or {}))
+
+        failed = []
+        monitor.start()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(download_cik, client, ledger, cik, doc_type, amount,
+                                       target_folder, full_submission): cik for cik in todo}
+                for future in as_completed(futures):
+                    cik = futures[future]
+                    try:
+                        files, nbytes = future.result()
+                        monitor.add(ciks=1, files=files, nbytes=nbytes)
+                    except Exception as e:
+                        print(f"CIK: {cik} failed: {e}")
+                        monitor.add(failures=1)
+                        failed.append(cik)
+        finally:
+            monitor.stop()
+
+    return failed
@@ -0,0 +1,321 @@
+"""
+Compressed, content-addressed store of the downloaded filings, instead of copies in ./data
+
+Usage:
+    python filing_store.py ingest --source ./sec-edgar-filings --store ./filings --doc_type 10-K [--workers 4]
+    python filing_store.py ls --store ./filings --doc_type 10-K --year 20 [--cik 320193]
+    python filing_store.py cat ./filings/10-K/20/320193/0000320193-20-000096/filing-details.html
+    python filing_store.py stats --store ./filings
+
+Every document of ./sec-edgar-filings/<cik>/<doc_type>/<accession>/ is read once, hashed and,
+if its content is not stored yet, compressed into a zstd frame appended to a pack file
+(<store>/packs). <store>/manifest.sqlite maps every document (cik, form, year, accession, name)
+to its blob, and every blob to its pack, offset and length. The year is the one of the
+accession number, the year folder manipulate_files.py copied the filing to.
+
+The documents keep the paths they had under ./data, with the store as base path:
+<store>/<doc_type>/<year>/<cik>/<accession>/filing-details.html. These paths only exist in the
+manifest; find_filings_paths and covid_paragraphs.find_html_files list them with a query and
+read_filing decompresses them from the memory mapped pack, so scraping and paragraph extraction
+run on the store without a copy on disk. Only the documents given to ingest are stored
+(filing-details.html by default), full-submission.txt is left out without deleting it.
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MANIFEST = "manifest.sqlite"
+
+
+def year_of_accession(accession):
+    """
+    The two digit year of an accession number like 0000320193-20-000096
+    """
+    return accession.split("-")[1]
+
+
+def source_documents(source, doc_type, documents):
+    """
+    (cik, accession, name, path) of the documents downloaded by filings_downloader.py
+    """
+    for cik in sorted(os.listdir(source)):
+        folder = os.path.join(source, cik, doc_type)
+        if cik.startswith(".") or not os.path.isdir(folder):
+            continue
+        for accession in sorted(os.listdir(folder)):
+            if accession.startswith("."):
+                continue
+            for name in documents:
+                path = os.path.join(folder, accession, name)
+                if os.path.isfile(path):
+                    yield cik, accession, name, path
+
+
+def pack_chunk(manifest, pack_path, level, documents):
+    """
+    Compress the documents of a chunk whose content is not stored yet into one pack file,
+    runs in a worker process
+
+    documents: list of (cik, accession, name, path, size, mtime_ns)
+
+    returns (documents with the sha1 of their content, blobs as (sha1, pack, offset, length, size))
+    """
+    known = sqlite3.connect(f"file:{manifest}?mode=ro", uri=True, timeout=60)
+    compressor = zstandard.ZstdCompressor(level=level)
+    pack_name = os.path.basename(pack_path)
+    rows, blobs, offset = [], {}, 0
+    with open(pack_path + ".part", "wb") as pack:
+        for document in documents:
+            with open(document[3], "rb") as f:
+                data = f.read()
+            sha = hashlib.sha1(data).hexdigest()
+            rows.append(document + (sha,))
+            if sha in blobs or known.execute("SELECT 1 FROM blobs WHERE sha = ?", (sha,)).fetchone():
+                continue
+            # one independent frame per document, so it can be decompressed on its own
+            frame = compressor.compress(data)
+            pack.write(frame)
+            blobs[sha] = (sha, pack_name, offset, len(frame), len(data))
+            offset += len(frame)
+    known.close()
+    if blobs:
+        os.replace(pack_path + ".part", pack_path)
+    else:
+        os.remove(pack_path + ".part")
+    return rows, list(blobs.values())
+
+
+class FilingStore:
+    """
+    Pack files of zstd frames and the sqlite manifest of their documents
+    """
+
+    def __init__(self, root="./filings"):
+        if zstandard is None:
+            raise ImportError("the filing store needs zstandard: pip install zstandard")
+        self.root = root
+        self.packs = os.path.join(root, "packs")
+        os.makedirs(self.packs, exist_ok=True)
+        self.manifest = os.path.join(root, MANIFEST)
+        # rollback journal, not WAL: readers leave no -wal/-shm files next to the manifest
+        self.db = sqlite3.connect(self.manifest, timeout=60)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha TEXT PRIMARY KEY, pack TEXT, offset INTEGER, length INTEGER, size INTEGER);
+            CREATE TABLE IF NOT EXISTS documents (
+                form TEXT, year TEXT, cik TEXT, accession TEXT, name TEXT, sha TEXT,
+                source_size INTEGER, source_mtime INTEGER, PRIMARY KEY (form, cik, accession, name));
+            CREATE INDEX IF NOT EXISTS documents_view ON documents (form, year, cik);
+        """)
+        self._migrate()
+        self._maps = {}
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def _migrate(self):
+        """
+        Manifests of older versions keyed documents without the cik, so a joint filing (one
+        accession in the folders of several ciks) was only kept under the last cik
+        """
+        key = [row[1] for row in sorted(self.db.execute("PRAGMA table_info(documents)"), key=lambda row: row[5])
+               if row[5]]
+        if "cik" in key:
+            return
+        with self.db:
+            self.db.executescript("""
+                ALTER TABLE documents RENAME TO documents_old;
+                DROP INDEX IF EXISTS documents_view;
+                CREATE TABLE documents (
+                    form TEXT, year TEXT, cik TEXT, accession TEXT, name TEXT, sha TEXT,
+                    source_size INTEGER, source_mtime INTEGER, PRIMARY KEY (form, cik, accession, name));
+                CREATE INDEX documents_view ON documents (form, year, cik);
+                INSERT INTO documents SELECT * FROM documents_old;
+                DROP TABLE documents_old;
+            """)
+
+    def close(self):
+        for f, mapped in self._maps.values():
+            mapped.close()
+            f.close()
+        self._maps = {}
+        self.db.close()
+
+    def ingest(self, source="./sec-edgar-filings", doc_type="10-K", documents=("filing-details.html",),
+               workers=None, chunk_size=200, level=10):
+        """
+        Add the new or changed documents of the download folder, compressed on a process pool;
+        returns the number of documents added
+        """
+        stored = {(cik, accession, name): (size, mtime) for cik, accession, name, size, mtime in self.db.execute(
+            "SELECT cik, accession, name, source_size, source_mtime FROM documents WHERE form = ?", (doc_type,))}
+        todo = []
+        for cik, accession, name, path in source_documents(source, doc_type, documents):
+            stat = os.stat(path)
+            if stored.get((cik, accession, name)) != (stat.st_size, stat.st_mtime_ns):
+                todo.append((cik, accession, name, path, stat.st_size, stat.st_mtime_ns))
+        print(f"{len(stored)} documents stored, {len(todo)} to add.")
+
+        # pack files are never rewritten, every run writes new ones
+        run_id = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        done, start = 0, time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(pack_chunk, self.manifest, os.path.join(self.packs, f"{run_id}-{i:05d}.zst"),
+                                   level, chunk) for i, chunk in enumerate(chunks)]
+            for future in futures:
+                rows, blobs = future.result()
+                with self.db:
+                    # two chunks may hold the same new content, the first blob wins
+                    self.db.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?)", blobs)
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(doc_type, year_of_accession(accession), cik, accession, name, sha, size, mtime)
+                         for cik, accession, name, path, size, mtime, sha in rows])
+                done += len(rows)
+                elapsed = time.perf_counter() - start
+                print(f"Stored {done}/{len(todo)} documents ({done / elapsed:.1f} documents/s).")
+        return len(todo)
+
+    def paths(self, doc_type=None, year=None, cik=None, accession=None, name=None):
+        """
+        Paths of the stored documents, <store>/<doc_type>/<year>/<cik>/<accession>/<name>,
+        optionally only of one doc type, year, cik...
+        """
+        conditions = [("form", doc_type), ("year", year), ("cik", cik), ("accession", accession), ("name", name)]
+        conditions = [(column, str(value)) for column, value in conditions if value is not None]
+        where = " AND ".join(f"{column} = ?" for column, _ in conditions) or "1"
+        rows = self.db.execute(f"SELECT form, year, cik, accession, name FROM documents WHERE {where} "
+                               "ORDER BY form, year, cik, accession, name", [value for _, value in conditions])
+        return [os.path.join(self.root, *row) for row in rows]
+
+    def under(self, folder, suffix=""):
+        """
+        Paths of the stored documents below a folder of the store, e.g. <store>/10-K/20
+        """
+        parts = os.path.relpath(folder, self.root).split(os.sep)
+        parts = [] if parts == ["."] else parts
+        if len(parts) > 4:
+            raise ValueError(f"{folder} is not a folder of the store")
+        paths = self.paths(*(parts + [None] * (4 - len(parts))))
+        return [p for p in paths if p.endswith(suffix)]
+
+    def _locate(self, path):
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if len(parts) != 5:
+            raise FileNotFoundError(path)
+        row = self.db.execute(
+            "SELECT pack, offset, length FROM documents JOIN blobs USING (sha) "
+            "WHERE form = ? AND year = ? AND cik = ? AND accession = ? AND name = ?", parts).fetchone()
+        if row is None:
+            raise FileNotFoundError(path)
+        return row
+
+    def _map(self, pack):
+        if pack not in self._maps:
+            f = open(os.path.join(self.packs, pack), "rb")
+            self._maps[pack] = f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[pack][1]
+
+    def read(self, path):
+        """
+        Content of a stored document as bytes, decompressed from the memory mapped pack
+        """
+        pack, offset, length = self._locate(path)
+        return self._decompressor.decompress(self._map(pack)[offset:offset + length])
+
+    def open(self, path):
+        """
+        Binary stream decompressing a stored document while it is read
+        """
+        pack, offset, length = self._locate(path)
+        # the compressed frame only, a reader on the pack file would go on into the next frame
+        return self._decompressor.stream_reader(self._map(pack)[offset:offset + length])
+
+    def stats(self):
+        documents, = self.db.execute("SELECT COUNT(*) FROM documents").fetchone()
+        blobs, size, length = self.db.execute("SELECT COUNT(*), SUM(size), SUM(length) FROM blobs").fetchone()
+        return {"documents": documents, "blobs": blobs, "bytes": size or 0, "stored_bytes": length or 0}
+
+
+# stores opened by find_store, per process since sqlite connections do not survive a fork
+_stores = {}
+
+
+def find_store(path):
+    """
+    The store a path is in (the closest folder above it with a manifest), None if none
+    """
+    folder = os.path.abspath(path)
+    while True:
+        if os.path.isfile(os.path.join(folder, MANIFEST)):
+            key = (folder, os.getpid())
+            if key not in _stores:
+                _stores[key] = FilingStore(folder)
+            return _stores[key]
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
+
+
+def read_filing(path):
+    """
+    Content of a filing as bytes, from the file at path or, if there is none, from the filing store
+    """
+    if not os.path.exists(path):
+        store = find_store(path)
+        if store is not None:
+            return store.read(os.path.abspath(path))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Compressed store of the downloaded filings')
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("ingest", help="add the downloaded filings to the store")
+    p.add_argument('--source', metavar='S', type=str, default='./sec-edgar-filings', help='folder of filings_downloader.py')
+    p.add_argument('--store', metavar='ST', type=str, default='./filings', help='folder of the store')
+    p.add_argument('--doc_type', metavar='DT', type=str, default='10-K', help='document type 10-K, 10-Q and so on')
+    p.add_argument('--documents', metavar='D', nargs='+', type=str, default=['filing-details.html'], help='document names to store')
+    p.add_argument('--workers', metavar='W', type=int, default=None, help='number of processes, default number of cpus')
+    p.add_argument('--level', metavar='L', type=int, default=10, help='zstd compression level')
+    p = commands.add_parser("ls", help="paths of the stored filings")
+    p.add_argument('--store', metavar='ST', type=str, default='./filings', help='folder of the store')
+    p.add_argument('--doc_type', metavar='DT', type=str, default=None, help='document type')
+    p.add_argument('--year', metavar='Y', type=str, default=None, help='two digit year, e.g. 20')
+    p.add_argument('--cik', metavar='C', type=str, default=None, help='company cik')
+    p = commands.add_parser("cat", help="write a stored document to stdout")
+    p.add_argument('path', type=str, help='path of the document in the store')
+    p = commands.add_parser("stats", help="size of the store")
+    p.add_argument('--store', metavar='ST', type=str, default='./filings', help='folder of the store')
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        store = FilingStore(args.store)
+        store.ingest(args.source, args.doc_type, args.documents, args.workers, level=args.level)
+        print(store.stats())
+    elif args.command == "ls":
+        for path in FilingStore(args.store).paths(args.doc_type, args.year, args.cik):
+            print(path)
+    elif args.command == "cat":
+        store = find_store(args.path)
+        if store is None:
+            sys.exit(f"{args.path} is not in a filing store")
+        with store.open(os.path.abspath(args.path)) as reader:
+            for block in iter(lambda: reader.read(1 << 20), b""):
+                sys.stdout.buffer.write(block)
+    else:
+        stats = FilingStore(args.store).stats()
+        print(f"{stats['documents']} documents, {stats['blobs']} distinct, "
+              f"{stats['bytes'] / 2**20:.1f} MB in {stats['stored_bytes'] / 2**20:.1f} MB")
@@ -1,23 +1,26 @@
 from sec_edgar_downloader import Downloader
-import pandas as pd
 import time
 import sys
 import argparse
 
+from cik_index import CikIndex
+from concurrent_downloader import download_filings_concurrent
+
 # install the dependency of sec-edgar-downloader
 # pip install -U pip install sec-edgar-downloader
 
-def filter_ciks(sectors, sub_paths=["2019q1", "2019q2", "2019q3", "2019q4", "2020q1", "2020q2", "2020q3", "2020q4", "2021q1"]):
+def filter_ciks(sectors, sub_paths=["2019q1", "2019q2", "2019q3", "2019q4", "2020q1", "2020q2", "2020q3", "2020q4", "2021q1"],
+                index_dir="./cik_index"):
     """
     Extract all ciks according to sector code (sic), for example,  manufacturing has sic code from 2000 to 2999
     reference: https://en.wikipedia.org/wiki/Standard_Industrial_Classification
+
+    The sub.txt files are parsed once into a columnar index (see cik_index.py), later calls only
+    ingest new or changed quarter folders.
     """
-    results = set()
-    for path in sub_paths:
-        df = pd.read_csv(path + "/sub.txt", sep="\t", low_memory=False)
-        for start, end in sectors:
-            results.update(df[(start <= df.sic) & (df.sic <= end)].cik)
-    return list(results)
+    index = CikIndex(index_dir)
+    index.update(sub_paths)
+    return index.select_ciks(sectors, quarters=sub_paths)
 
 
 
@@ -59,7 +62,8 @@ def download_filings(ciks, doc_type, amount, retry, target_folder, start, end):
                 time.sleep(1)
 
 
-def main(target_sectors, doc_type, amount, retry, target_folder, start, end):
+def main(target_sectors, doc_type, amount, retry, target_folder, start, end, workers=1, rate=8.0,
+         max_retries=5, ledger=None, user_agent=None, full_submission=False):
     """
     main function to download filings of given doc_type to target_folder
 
@@ -76,11 +80,25 @@ def main(target_sectors, doc_type, amount, retry, target_folder, start, end):
     start: int, start index of ciks (in case that we stop downloading, having this parameter, we could resume program at given point)
 
     end: int, end index of ciks (like start)
+
+    workers: int, number of concurrent downloads; more than 1 switches to the rate-limited
+        concurrent engine which resumes from its ledger instead of start/end
+
+    rate, max_retries, ledger, user_agent, full_submission: options of the concurrent engine,
+        see concurrent_downloader.download_filings_concurrent
     """
 
     # filter out desired ciks (ciks from given sectors)
     ciks = filter_ciks(target_sectors)
 
+    if workers > 1:
+        # the ledger records finished filings, so a resumed run skips them without start/end
+        options = {"user_agent": user_agent} if user_agent else {}
+        failed = download_filings_concurrent(ciks, doc_type, amount, target_folder, workers=workers,
+            rate=rate, max_retries=max_retries, ledger_path=ledger, full_submission=full_submission, **options)
+        print(f"{len(failed)} ciks failed, rerun to retry them.")
+        return
+
     # download filings of give type, default is 10-K
     download_filings(ciks, doc_type=doc_type, amount=amount, retry=retry, 
         target_folder=target_folder, start=start, end=end)
@@ -96,10 +114,19 @@ if __name__ == '__main__':
     parser.add_argument('--start', metavar="S", nargs='?', type=int, default=0, help="start index of ciks")
     parser.add_argument('--end', metavar="E", nargs='?', type=int, default=-1, help="end index of ciks")
 
+    parser.add_argument('--workers', metavar="W", nargs='?', type=int, default=1, help="number of concurrent downloads, more than 1 uses the concurrent engine")
+    parser.add_argument('--rate', metavar="RT", nargs='?', type=float, default=8.0, help="max requests per second over all workers")
+    parser.add_argument('--max_retries', metavar="MR", nargs='?', type=int, default=5, help="retries per request with exponential backoff")
+    parser.add_argument('--ledger', metavar="L", nargs='?', type=str, default=None, help="file recording finished downloads, default <dest>/download-ledger.tsv")
+    parser.add_argument('--user_agent', metavar="UA", nargs='?', type=str, default=None, help="User-Agent sent to EDGAR, e.g. 'Company name email'")
+    parser.add_argument('--full_submission', action='store_true', help="also download full-submission.txt in concurrent mode")
+
     args = parser.parse_args()
     
     target_sectors = [(2000, 3999), (7000, 8999)]
-    main(target_sectors, args.doc_type, args.amount, args.retry, args.dest, args.start, args.end)
+    main(target_sectors, args.doc_type, args.amount, args.retry, args.dest, args.start, args.end,
+        workers=args.workers, rate=args.rate, max_retries=args.max_retries, ledger=args.ledger,
+        user_agent=args.user_agent, full_submission=args.full_submission)
 
 
 
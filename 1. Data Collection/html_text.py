@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import json
+import os
+
+import lxml.html
+
+from filing_store import read_filing
+
+# install the dependency of the C-backed html parser
+# pip install lxml
+
+# bump when the block extraction changes, so cached blocks of older versions are not reused
+EXTRACTOR_VERSION = "2"
+
+
+def decode(data):
+    """Filings are read as utf-8, undecodable bytes are replaced instead of failing the whole file"""
+    return data.decode('utf-8', errors='replace') if isinstance(data, bytes) else data
+
+
+def html_to_text(fragment):
+    """
+    Text of an html fragment with all tags removed (what BeautifulSoup(fragment).text gives),
+    the fragment may start or end in the middle of a tag, like the sections cut out by the scraper.
+    Unlike BeautifulSoup, a tag cut off at the end of the fragment ("...text<fo") is dropped
+    instead of being kept as text, so such sections lose those few trailing characters
+    """
+    fragment = decode(fragment)
+    if not fragment.strip():
+        return fragment
+    root = lxml.html.fragment_fromstring(fragment, create_parent='div')
+    return root.text_content()
+
+
+def extract_blocks(data):
+    """
+    Parse a filing once and return its block-level paragraphs
+
+    Every block is a dict with the tag it comes from, its text and its [start, end) character
+    offsets in the text of all blocks joined by new lines. As in the paragraph notebook, all
+    <div> blocks come first and then all <p> blocks, each in document order; the text of a <div>
+    is the text directly inside its <font>/<span> children and the text of a <p> is all text
+    inside it.
+    """
+    root = lxml.html.document_fromstring(decode(data))
+    blocks = []
+    offset = 0
+    for element in list(root.iter('div')) + list(root.iter('p')):
+        if element.tag == 'div':
+            items = element.xpath('font/text()') + element.xpath('span/text()')
+            text = ''.join(item.strip() for item in items)
+        else:
+            text = element.text_content().strip()
+        if not text:
+            continue
+        blocks.append({"tag": element.tag, "text": text, "start": offset, "end": offset + len(text)})
+        offset += len(text) + 1
+    return blocks
+
+
+class BlockCache:
+    """
+    On-disk cache of extract_blocks results keyed by the sha1 of the file content, so a filing is
+    parsed once no matter how many stages (section scraping, keyword paragraphs...) read it
+    """
+
+    def __init__(self, cache_dir="./cache/blocks"):
+        self.cache_dir = cache_dir
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest + ".json.gz")
+
+    def blocks(self, input_path):
+        """Blocks of the file at input_path, parsed and cached on the first call"""
+        return self.blocks_of(read_filing(input_path))
+
+    def blocks_of(self, data):
+        """Blocks of html content given as bytes"""
+        digest = hashlib.sha1(EXTRACTOR_VERSION.encode() + data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+
+        blocks = extract_blocks(data)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".%d.part" % os.getpid()
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=3) as f:
+            json.dump(blocks, f)
+        os.replace(tmp_path, path)
+        return blocks
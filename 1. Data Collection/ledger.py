@@ -0,0 +1,59 @@
+import os
+import threading
+
+
+class Ledger:
+    """
+    Append-only record of finished work items, persisted as a tab separated file.
+
+    Each entry is a tuple of strings, e.g. (cik, doc_type, accession). The file is
+    flushed after every write, so an interrupted run loses at most the item that
+    was in flight, and a resumed run can skip everything already recorded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = set()
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line:
+                        self._entries.add(tuple(line.split('\t')))
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, entry):
+        return tuple(str(x) for x in entry) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entry):
+        """Record one finished item, ignoring items that are already recorded."""
+        entry = tuple(str(x) for x in entry)
+        with self._lock:
+            if entry in self._entries:
+                return
+            self._entries.add(entry)
+            self._file.write('\t'.join(entry) + '\n')
+            self._file.flush()
+
+    def entries(self):
+        return set(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,3 +1,4 @@
+import argparse
 import os
 import shutil
 
@@ -12,7 +13,7 @@ def aggregate_files(doc_type="10-K", save_path="./data", overwrite=False):
 
 	# check if save path exists, otherwise create a new folder
 	if not os.path.exists(save_path):
-		os.mkdir(save_path)
+		os.makedirs(save_path)
 
 	# check if save path for each year exists, otherwise create a new folder for it
 	for year in years:
@@ -80,7 +81,15 @@ def delete_filings_txt(doc_type="10-K", filings_folder="./sec-edgar-filings"):
 
 
 if __name__ == "__main__":
-	delete_filings_txt(doc_type="10-Q")
-	aggregate_files(doc_type="10-Q")
+
+	parser = argparse.ArgumentParser(description='Move the downloaded filings into one folder per year')
+	parser.add_argument('--doc_type', metavar='DT', nargs='?', type=str, default='10-Q', help='document type 10-K, 10-Q and so on')
+	parser.add_argument('--save_path', metavar='S', nargs='?', type=str, default='./data', help='folder of the aggregated filings')
+	parser.add_argument('--keep_txt', action='store_true', help='keep the full-submission.txt files')
+
+	args = parser.parse_args()
+	if not args.keep_txt:
+		delete_filings_txt(doc_type=args.doc_type)
+	aggregate_files(doc_type=args.doc_type, save_path=args.save_path)
 
 
@@ -1,9 +1,15 @@
-from bs4 import BeautifulSoup
 import os
 import re
 import pandas as pd
 
+from filing_store import find_store
+from html_text import html_to_text
+from section_index import HeadingIndex
+
 def find_filings_paths(doc_type="10-K",base_path='./data/',year="19"):
+    # base_path may be a filing store (filing_store.py), its manifest lists the filings
+    if not os.path.isdir(os.path.join(base_path,doc_type,year)) and find_store(base_path) is not None:
+        return find_store(base_path).paths(doc_type, year, name="filing-details.html")
     base_path = os.path.join(base_path,doc_type)
     list_10K_paths = []
     file_path = os.path.join(base_path,year)
@@ -38,87 +44,27 @@ class TenKScraper:
 
 
 
-    def scrape(self, input_path):
-        with open(input_path, 'rb') as input_file:
-            page = input_file.read()  # <===Read the HTML file into Python
-            # Pre-processing the html content by removing extra white space and combining then into one line.
-            page = page.strip()  # <=== remove white space at the beginning and end
-            page = page.replace(b'\n', b' ')  # <===replace the \n (new line) character with space
-            page = page.replace(b'\r', b'')  # <===replace the \r (carriage returns -if you're on windows) with space
-            page = page.replace(b'&nbsp;',
-                                b' ')  # <===replace "&nbsp;" (a special character for space in HTML) with space.
-            page = page.replace(b'&#160;',
-                                b' ')  # <===replace "&#160;" (a special character for space in HTML) with space.
-
-            while b'  ' in page:
-                page = page.replace(b'  ', b' ')  # <===remove extra space
-
-            # Using regular expression to extract texts that match a pattern
-
-            # Define pattern for regular expression.
-            # The following patterns find ITEM 1 and ITEM 1A as diplayed as subtitles
-            # (.+?) represents everything between the two subtitles
-            # If you want to extract something else, here is what you should change
-
-            # Define a list of potential patterns to find ITEM 1 and ITEM 1A as subtitles
-            p1 = bytes(r'bold;\">\s*' + self.section + r'\.(.+?)bold;\">\s*' + self.next_section + r'\.',
-                       encoding='utf-8')
-            p2 = bytes(r'b>\s*' + self.section + r'\.(.+?)b>\s*' + self.next_section + r'\.', encoding='utf-8')
-            p3 = bytes(r'' + self.section + r'\.\s*<\/b>(.+?)' + self.next_section + r'\.\s*<\/b>', encoding='utf-8')
-            p4 = bytes(r'' + self.section + r'\.\s*[^<>]+\.\s*<\/b(.+?)' + self.next_section + r'\.\s*[^<>]+\.\s*<\/b',
-                       encoding='utf-8')
-            p5 = bytes(r'b>\s*<font[^>]+>\s*' + self.section + r'\.(.+?)b>\s*<font[^>]+>\s*' + self.next_section + r'\.', encoding='utf-8')
-            p6 = bytes(r'' + self.section.upper() + r'\.\s*<\/b>(.+?)' + self.next_section.upper() + r'\.\s*<\/b>', encoding='utf-8')
-
-            p7 = bytes(r'underline;\">\s*' + self.section + r'\<\/font>(.+?)underline;\">\s*'+ self.next_section + r'\.\s*\<\/font>',encoding = 'utf-8')
-            p8 = bytes(r'underline;\">\s*' + self.section + r'\.\<\/font>(.+?)underline;\">\s*'+ self.next_section + r'\.\s*\<\/font>',encoding = 'utf-8')
-            p9 = bytes(r'<font[^>]+>\s*' + self.section + r'\:(.+?)\<font[^>]+>\s*'+self.next_section + r'\:\s*',encoding = 'utf-8')
-            p10 = bytes(r'<font[^>]+>\s*' + self.section + r'\.\<\/font>(.+?)\<font[^>]+>\s*' + self.next_section + r'\.',encoding = 'utf-8')
-            p11 = bytes(r'' + self.section + r'\.(.+?)<font[^>]+>\s*' + self.next_section + r'\.\<\/font>',encoding = 'utf-8')
-            p12 = bytes(r'b>\s*<font[^>]+>\s*' + self.section + r'(.+?)b>\s*<font[^>]+>\s*' + self.next_section + r'\s*\<\/font>', encoding='utf-8')
-            p13 = bytes(r'' + self.section + r'\.\s*[^<>]+\.\s*<\/b(.+?)b>\s*' + self.next_section + r'\.',
-                       encoding='utf-8')
-
-            regexs = (
-                p1,  # <===pattern 1: with an attribute bold before the item subtitle
-                p2,  # <===pattern 2: with a tag <b> before the item subtitle
-                p3,  # <===pattern 3: with a tag <\b> after the item subtitle
-                p4,  # <===pattern 4: with a tag <\b> after the item+description subtitle
-                p5,  # <===pattern 5: with a tag <b><font ...> before the item subtitle
-                p6,  # <===pattern 6: with a tag <\b> after the item subtitle (ITEM XX.<\b>)
-                p7,
-                p8,
-                p9,
-                p10,
-                p11,
-                p12,
-                p13,
-                )
-
-            # Now we try to see if a match can be found...
-            for regex in regexs:
-                match = re.search(regex, page,
-                                  flags=re.IGNORECASE)  # <===search for the pattern in HTML using re.search from the re package. Ignore cases.
-
-                # If a match exist....
-                if match:
-                    # Now we have the extracted content still in an HTML format
-                    # We now turn it into a beautiful soup object
-                    # so that we can remove the html tags and only keep the texts
-
-                    soup = BeautifulSoup(match.group(1),
-                                         "html.parser")  # <=== match.group(1) returns the texts inside the parentheses (.*?)
-
-                    # soup.text removes the html tags and only keep the texts
-                    rawText = soup.text.encode('utf8')  # <=== you have to change the encoding the unicodes
-
-                    break  # <=== if a match is found, we break the for loop. Otherwise the for loop continues
-
-        if match is None:
+    def scrape(self, input_path, index=None):
+        """
+        Extract the section of one filing as text (utf8 bytes), None if no heading layout matches
+
+        index: HeadingIndex of the filing, pass it to scrape several sections of the same filing
+            without re-reading and re-normalizing the html file
+        """
+        if index is None:
+            index = HeadingIndex.from_file(input_path)
+
+        # Heading candidates are matched against the layouts p1 - p13 (see section_index.PATTERNS),
+        # the first layout with both headings gives the html between the two subtitles
+        content = index.find(self.section, self.next_section)
+
+        if content is None:
             print(f'No matched sections: {self.section}, {self.next_section} found in {input_path}.')
             return None
-        else:
-            return rawText
+
+        # Now we have the extracted content still in an HTML format,
+        # the lxml parser removes the html tags and only keep the texts
+        return html_to_text(content).encode('utf8')  # <=== you have to change the encoding the unicodes
 
     @property
     def range(self):
@@ -140,9 +86,11 @@ def main(sections, amount=2):
 
     for idx, path in enumerate(paths[:amount]):
         results["paths"].append(path)
-        
+
+        # read and normalize the filing once for all section pairs
+        index = HeadingIndex.from_file(path)
         for scraper in scrapers:
-            items = scraper.scrape(path)
+            items = scraper.scrape(path, index)
             results[scraper.range].append(items)
 
         print(f"Scraping {path} - {idx + 1}/{len(paths)}.")
@@ -0,0 +1,137 @@
+import bisect
+import re
+
+from filing_store import read_filing
+
+# Heading layouts of the 10-K items, one entry per pattern p1 - p13 of the original TenKScraper.
+# Each entry is (start prefix, start suffix, end prefix, end suffix): the section is everything
+# between `start prefix + section + start suffix` and `end prefix + next section + end suffix`,
+# e.g. p1 matched bold;">Item 1A.(.+?)bold;">Item 1B.
+PATTERNS = (
+    (rb'bold;\">\s*', rb'\.', rb'bold;\">\s*', rb'\.'),                      # p1: with an attribute bold before the item subtitle
+    (rb'b>\s*', rb'\.', rb'b>\s*', rb'\.'),                                  # p2: with a tag <b> before the item subtitle
+    (rb'', rb'\.\s*<\/b>', rb'', rb'\.\s*<\/b>'),                            # p3: with a tag <\b> after the item subtitle
+    (rb'', rb'\.\s*[^<>]+\.\s*<\/b', rb'', rb'\.\s*[^<>]+\.\s*<\/b'),        # p4: with a tag <\b> after the item+description subtitle
+    (rb'b>\s*<font[^>]+>\s*', rb'\.', rb'b>\s*<font[^>]+>\s*', rb'\.'),      # p5: with a tag <b><font ...> before the item subtitle
+    (rb'', rb'\.\s*<\/b>', rb'', rb'\.\s*<\/b>'),                            # p6: with a tag <\b> after the item subtitle (ITEM XX.<\b>)
+    (rb'underline;\">\s*', rb'\<\/font>', rb'underline;\">\s*', rb'\.\s*\<\/font>'),
+    (rb'underline;\">\s*', rb'\.\<\/font>', rb'underline;\">\s*', rb'\.\s*\<\/font>'),
+    (rb'<font[^>]+>\s*', rb'\:', rb'\<font[^>]+>\s*', rb'\:\s*'),
+    (rb'<font[^>]+>\s*', rb'\.\<\/font>', rb'\<font[^>]+>\s*', rb'\.'),
+    (rb'', rb'\.', rb'<font[^>]+>\s*', rb'\.\<\/font>'),
+    (rb'b>\s*<font[^>]+>\s*', rb'', rb'b>\s*<font[^>]+>\s*', rb'\s*\<\/font>'),
+    (rb'', rb'\.\s*[^<>]+\.\s*<\/b', rb'b>\s*', rb'\.'),
+)
+
+# every heading candidate "Item N" is found by this single scan over the page
+HEADING = re.compile(rb'item (\d{1,2}[a-z]?)', flags=re.IGNORECASE)
+
+# how far before a heading its prefix (e.g. a long <font style=...> tag) is looked for. This is a
+# deviation from the legacy patterns, whose prefix match is unbounded: a heading whose prefix
+# starts more than PREFIX_WINDOW bytes before "Item N" (e.g. "b>" followed by a huge <font ...>
+# tag) is matched by them but skipped here. benchmark_scraper.py --check reports any such case.
+PREFIX_WINDOW = 4096
+
+
+def normalize_page(page):
+    """
+    Pre-processing the html content by removing extra white space and combining then into one line.
+    Same result as the replace loop of the original scraper, but linear in the page size.
+    """
+    page = page.strip()
+    page = page.replace(b'\n', b' ')
+    page = page.replace(b'\r', b'')
+    page = page.replace(b'&nbsp;', b' ')
+    page = page.replace(b'&#160;', b' ')
+    return re.sub(b' {2,}', b' ', page)
+
+
+def legacy_pattern(pattern, section, next_section):
+    """
+    The original regular expression of one heading layout, e.g. for benchmarks against the index
+
+    pattern: int, index into PATTERNS
+    """
+    start_prefix, start_suffix, end_prefix, end_suffix = PATTERNS[pattern]
+    return (start_prefix + section.encode() + start_suffix + rb'(.+?)'
+            + end_prefix + next_section.encode() + end_suffix)
+
+
+def _compile(prefixes):
+    return [(re.compile(p + rb'\Z', flags=re.IGNORECASE) if p else None) for p in prefixes]
+
+
+_START_PREFIX = _compile(p[0] for p in PATTERNS)
+_START_SUFFIX = [re.compile(p[1], flags=re.IGNORECASE) for p in PATTERNS]
+_END_PREFIX = _compile(p[2] for p in PATTERNS)
+_END_SUFFIX = [re.compile(p[3], flags=re.IGNORECASE) for p in PATTERNS]
+
+
+class HeadingIndex:
+    """
+    All "Item N" heading candidates of one normalized filing, found in a single linear scan.
+
+    find() slices a section out of the page with the same result as trying the 13 lazy
+    patterns in order on the whole page, but only looks at the heading candidates, so any
+    number of section pairs can be extracted from one index.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.candidates = [(m.start(), m.group(1).upper()) for m in HEADING.finditer(page)]
+        self._spans = {}
+
+    @classmethod
+    def from_file(cls, input_path):
+        return cls(normalize_page(read_filing(input_path)))
+
+    def _headings(self, section, pattern, end):
+        """
+        Sorted (match start, match end) of every heading of `section` in the layout of `pattern`,
+        as start heading (end=False) or as end heading (end=True)
+        """
+        key = (section, pattern, end)
+        if key in self._spans:
+            return self._spans[key]
+
+        prefix = (_END_PREFIX if end else _START_PREFIX)[pattern]
+        suffix = (_END_SUFFIX if end else _START_SUFFIX)[pattern]
+        text = section.encode().lower()
+        number = text[len(b'item '):].upper()
+
+        spans = []
+        for pos, token in self.candidates:
+            # "Item 1" is also a prefix of the headings "Item 1A", "Item 10"...
+            if not token.startswith(number) or self.page[pos:pos + len(text)].lower() != text:
+                continue
+            match = suffix.match(self.page, pos + len(text))
+            if match is None:
+                continue
+            start = pos
+            if prefix is not None:
+                window = max(0, pos - PREFIX_WINDOW)
+                before = prefix.search(self.page, window, pos)
+                if before is None:
+                    continue
+                start = before.start()
+            spans.append((start, match.end()))
+
+        spans.sort()
+        self._spans[key] = spans
+        return spans
+
+    def find(self, section, next_section):
+        """
+        Return the raw html between the headings of section and next_section (e.g. 'Item 1A', 'Item 1B'),
+        or None if no heading layout matches
+        """
+        for pattern in range(len(PATTERNS)):
+            ends = [start for start, _ in self._headings(next_section, pattern, True)]
+            if not ends:
+                continue
+            for start, content_start in self._headings(section, pattern, False):
+                # the section is non-empty, the first end heading after it closes it
+                idx = bisect.bisect_left(ends, content_start + 1)
+                if idx < len(ends):
+                    return self.page[content_start:ends[idx]]
+        return None
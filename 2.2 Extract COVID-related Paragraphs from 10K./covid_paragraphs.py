@@ -0,0 +1,186 @@
+"""Select the paragraphs of 10-K/10-Q filings which mention COVID (or any other keywords).
+
+Usage: python covid_paragraphs.py --root D:\\10-K\\10-K --years 19 20 21 --out ./paragraphs
+Writes one Parquet file per year (10K_2019.parquet, ...) with the columns of the
+notebook output (path, para_keywords) plus the matched keywords of every filing."""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1. Data Collection'))
+from filing_store import find_store, read_filing
+from html_text import BlockCache, extract_blocks
+
+try:
+    # optional, a C Aho-Corasick automaton; the compiled regex alternation is used without it
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# matched case-insensitively, so COVID/Covid/covid... are all covered by 'covid'
+KEYWORDS = ['covid', 'coronavirus', 'epidemic', 'pandemic', 'cornavirus']
+
+# paragraphs are separated by this line in para_keywords, as in the notebook output
+SEPARATOR = '\n---------------------------\n'
+
+# blocks shorter than this are headings, page numbers... and not paragraphs
+MIN_LENGTH = 20
+
+
+class KeywordMatcher:
+    """Find all keywords in a text in one pass, ignoring case"""
+
+    def __init__(self, keywords=KEYWORDS):
+        self.keywords = sorted({k.lower() for k in keywords}, key=len, reverse=True)
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._regex = re.compile('|'.join(re.escape(k) for k in self.keywords), flags=re.IGNORECASE)
+
+    def finditer(self, text):
+        """Yield (keyword, start, end) of every occurrence"""
+        if self._automaton is not None:
+            # lower() keeps the offsets of the original text for all but a few exotic characters
+            for end, keyword in self._automaton.iter(text.lower()):
+                yield keyword, end - len(keyword) + 1, end + 1
+        else:
+            for match in self._regex.finditer(text):
+                yield match.group().lower(), match.start(), match.end()
+
+
+def stitch_paragraphs(texts):
+    """
+    Join paragraphs broken by a page break: a text starting with a lower case letter continues the
+    previous one. Yields (index of the first text, paragraph) in one pass over the texts.
+    """
+    for i in range(len(texts) - 1):
+        if texts[i + 1][0].islower():
+            yield i, texts[i] + ' ' + texts[i + 1]
+        elif texts[i][0].islower():
+            continue
+        else:
+            yield i, texts[i]
+    if len(texts) >= 2 and texts[-1][0].isupper():
+        yield len(texts) - 1, texts[-1]
+
+
+def iter_keyword_paragraphs(blocks, matcher):
+    """
+    Yield the paragraphs of a filing containing any keyword
+
+    blocks: list of dict, output of html_text.extract_blocks
+
+    Every result is a dict with the paragraph text, its character offset in the filing text,
+    the sorted set of matched keywords and the (start, end) offsets of the hits in the paragraph.
+    """
+    blocks = [block for block in blocks if len(block["text"]) > MIN_LENGTH]
+    texts = [block["text"] for block in blocks]
+    for i, paragraph in stitch_paragraphs(texts):
+        hits = list(matcher.finditer(paragraph))
+        if hits:
+            yield {
+                "paragraph": paragraph,
+                "start": blocks[i]["start"],
+                "keywords": sorted({keyword for keyword, _, _ in hits}),
+                "offsets": [(start, end) for _, start, end in hits],
+            }
+
+
+# matchers of para_key by keyword tuple, so repeated calls (e.g. DataFrame.apply) compile them once
+_matchers = {}
+
+
+def para_key(path, keywords=KEYWORDS, cache=None):
+    """
+    Paragraphs of the filing at path containing any keyword, joined by SEPARATOR (notebook format)
+
+    cache: BlockCache, default None parses the filing without writing anything to disk
+    """
+    keywords = tuple(keywords)
+    if keywords not in _matchers:
+        _matchers[keywords] = KeywordMatcher(keywords)
+    blocks = cache.blocks(path) if cache is not None else extract_blocks(read_filing(path))
+    paragraphs = [p["paragraph"] for p in iter_keyword_paragraphs(blocks, _matchers[keywords])]
+    return ''.join(p + SEPARATOR for p in paragraphs)
+
+
+def find_html_files(folder):
+    """All .html files under folder, in a stable order; from the manifest if folder is in a filing store"""
+    if not os.path.isdir(folder) and find_store(folder) is not None:
+        return find_store(folder).under(folder, ".html")
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        paths += [os.path.join(root, f) for f in sorted(files) if os.path.splitext(f)[1] == ".html"]
+    return paths
+
+
+# every worker process builds its matcher and cache once
+_worker = {}
+
+
+def _init_worker(keywords, cache_dir):
+    _worker["matcher"] = KeywordMatcher(keywords)
+    _worker["cache"] = BlockCache(cache_dir)
+
+
+def _process(path):
+    try:
+        blocks = _worker["cache"].blocks(path)
+        paragraphs = list(iter_keyword_paragraphs(blocks, _worker["matcher"]))
+        error = None
+    except Exception as e:
+        paragraphs, error = [], f"{type(e).__name__}: {e}"
+    return {
+        "path": path,
+        "para_keywords": ''.join(p["paragraph"] + SEPARATOR for p in paragraphs),
+        "keywords": sorted({k for p in paragraphs for k in p["keywords"]}),
+        "n_paragraphs": len(paragraphs),
+        "error": error,
+    }
+
+
+def main(root, years, out_dir, keywords=KEYWORDS, workers=None, cache_dir="./cache/blocks", prefix="10K"):
+    """
+    Extract the keyword paragraphs of the filings of all years on a process pool
+
+    root: str, folder containing one folder of filings per year (19, 20, 21)
+
+    out_dir: str, folder of the output files <prefix>_20<year>.parquet
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(keywords, cache_dir)) as pool:
+        for year in years:
+            start = time.perf_counter()
+            paths = find_html_files(os.path.join(root, year))
+            rows = list(pool.map(_process, paths, chunksize=16))
+            df = pd.DataFrame(rows, columns=["path", "para_keywords", "keywords", "n_paragraphs", "error"])
+            df.to_parquet(os.path.join(out_dir, f"{prefix}_20{year}.parquet"), index=False)
+            print(f"{year}: {len(paths)} filings, {int((df.n_paragraphs > 0).sum())} with keywords, "
+                  f"{time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Extract keyword paragraphs from filings')
+    parser.add_argument('--root', metavar='R', nargs='?', type=str, required=True, help='folder with one folder of filings per year')
+    parser.add_argument('--years', metavar='Y', nargs='+', type=str, default=['19', '20', '21'], help='years to process')
+    parser.add_argument('--out', metavar='O', nargs='?', type=str, default='./', help='folder of the output files')
+    parser.add_argument('--keywords', metavar='K', nargs='+', type=str, default=KEYWORDS, help='keywords, matched ignoring case')
+    parser.add_argument('--workers', metavar='W', nargs='?', type=int, default=None, help='number of processes, default number of cpus')
+    parser.add_argument('--cache', metavar='C', nargs='?', type=str, default='./cache/blocks', help='folder of the parsed blocks cache')
+    parser.add_argument('--prefix', metavar='P', nargs='?', type=str, default='10K', help='prefix of the output files')
+
+    args = parser.parse_args()
+    main(args.root, args.years, args.out, args.keywords, args.workers, args.cache, args.prefix)
@@ -0,0 +1,289 @@
+"""Year-over-year paragraph diff of the filings of each company.
+
+Usage:
+    python paragraph_diff.py diff --paragraphs ./paragraphs/10K_2019.parquet ./paragraphs/10K_2020.parquet
+        [--store ./paragraphs.sqlite] [--threshold 0.9] [--rebuild]
+    python paragraph_diff.py changes --cik 320193 --year 2021 [--store ./paragraphs.sqlite]
+Every paragraph of the paragraph files of covid_paragraphs.py (or of any file
+with path and para_keywords columns) is fingerprinted with an exact hash of
+its normalized text and a 64 bit SimHash of its word shingles. It is compared
+with the paragraphs already stored for the same cik from earlier years, of
+any form (10-K/10-Q); later years in the store are ignored, so diffing the
+files again gives the same result:
+    same   the exact text was seen before
+    near   a paragraph with at least --threshold of the same words (in order,
+           difflib ratio) was seen before: minor edits
+    new    anything else
+The SimHash is stored in 8 bands of 8 bits, so near duplicate candidates are
+found with an index lookup (a shared band, a few differing bits) instead of
+comparing all pairs; only the candidates are compared word by word. "diff"
+writes, next to every input, <name>_diff.parquet (status of every paragraph) and <name>_new.parquet
+(the filings with only their new paragraphs, in the input format) for the NLP
+stages downstream; --rebuild first drops all stored paragraphs, so filings
+removed from the inputs are not matched any more. Scores of sentences seen before are kept in the same store
+(see SentenceScores), so 4run.py only scores new sentences."""
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1. Data Collection'))
+from cik_index import cik_from_path
+
+# paragraphs are separated by this line in para_keywords (covid_paragraphs.SEPARATOR)
+SEPARATOR = '\n---------------------------\n'
+
+BANDS = 8
+BAND_BITS = 64 // BANDS
+SHINGLE = 3
+# SimHash bits two near duplicate candidates may differ in
+MAX_HAMMING = 20
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Lower case words only, so spacing, punctuation and case do not count as changes"""
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+def exact_hash(text):
+    return hashlib.sha1(normalize(text).encode('utf-8')).hexdigest()[:16]
+
+
+def sentence_key(sentence):
+    """
+    Hash of the exact tokens of a sentence (a string or a token list): CAT scores depend on case,
+    punctuation tokens and word splits, which normalize() drops. The prefix keeps the keys apart
+    from the normalized hashes older versions stored.
+    """
+    tokens = sentence.split() if isinstance(sentence, str) else sentence
+    return hashlib.sha1(('tokens\0' + ' '.join(tokens)).encode('utf-8')).hexdigest()[:16]
+
+
+def simhash(text, shingle=SHINGLE):
+    """64 bit SimHash of the word shingles of text, as a signed int64 (sqlite integer)"""
+    words = normalize(text).split()
+    shingles = [' '.join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    digests = b''.join(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest() for s in shingles)
+    hashes = np.frombuffer(digests, dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    votes = 2 * bits.sum(0, dtype=np.int64) - len(hashes)
+    value = int(np.sum(np.uint64(1) << np.arange(64, dtype=np.uint64)[votes > 0], dtype=np.uint64))
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def bands(value):
+    value &= (1 << 64) - 1
+    return [(value >> (b * BAND_BITS)) & ((1 << BAND_BITS) - 1) for b in range(BANDS)]
+
+
+def hamming(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def split_paragraphs(para_keywords):
+    return [p for p in para_keywords.split(SEPARATOR) if p.strip()] if para_keywords else []
+
+
+class ParagraphStore:
+    """
+    Fingerprints of the paragraphs of every filing, by cik, in sqlite
+    """
+
+    def __init__(self, path="./paragraphs.sqlite"):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS paragraphs (
+                pid INTEGER PRIMARY KEY, cik INTEGER, year INTEGER, form TEXT, path TEXT,
+                position INTEGER, exact TEXT, simhash INTEGER, status TEXT, match INTEGER, text TEXT);
+            CREATE INDEX IF NOT EXISTS paragraphs_exact ON paragraphs (cik, exact);
+            CREATE INDEX IF NOT EXISTS paragraphs_path ON paragraphs (path);
+            CREATE INDEX IF NOT EXISTS paragraphs_year ON paragraphs (cik, year);
+            CREATE TABLE IF NOT EXISTS bands (cik INTEGER, band INTEGER, value INTEGER, pid INTEGER);
+            CREATE INDEX IF NOT EXISTS bands_lookup ON bands (cik, band, value);
+            CREATE TABLE IF NOT EXISTS sentence_scores (model TEXT, sentence TEXT, payload TEXT,
+                PRIMARY KEY (model, sentence));
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def clear(self):
+        """Drop all paragraph fingerprints; the sentence scores are kept"""
+        with self.db:
+            self.db.execute("DELETE FROM bands")
+            self.db.execute("DELETE FROM paragraphs")
+
+    def add_filing(self, path, year, form, paragraphs, threshold=0.9):
+        """
+        Compare the paragraphs of a filing with the stored ones of its cik from earlier years and store them
+
+        Returns a list of (status, pid of the matched paragraph or None), one per paragraph.
+        A filing added again replaces its earlier version.
+        """
+        cik = cik_from_path(path)
+        with self.db:
+            old = [pid for pid, in self.db.execute("SELECT pid FROM paragraphs WHERE path = ?", (path,))]
+            if old:
+                marks = ','.join('?' * len(old))
+                self.db.execute(f"DELETE FROM bands WHERE pid IN ({marks})", old)
+                self.db.execute(f"DELETE FROM paragraphs WHERE pid IN ({marks})", old)
+            results = []
+            for position, text in enumerate(paragraphs):
+                exact, value = exact_hash(text), simhash(text)
+                status, match = self._match(cik, year, text, exact, value, threshold)
+                cursor = self.db.execute(
+                    "INSERT INTO paragraphs (cik, year, form, path, position, exact, simhash, status, match, text) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cik, year, form, path, position, exact, value, status, match, text))
+                self.db.executemany("INSERT INTO bands VALUES (?, ?, ?, ?)",
+                                    [(cik, b, v, cursor.lastrowid) for b, v in enumerate(bands(value))])
+                results.append((status, match))
+        return results
+
+    def _match(self, cik, year, text, exact, value, threshold):
+        # only earlier years: a paragraph must not match its own copies in years diffed before it
+        row = self.db.execute("SELECT pid FROM paragraphs WHERE cik = ? AND exact = ? AND year < ? LIMIT 1",
+                              (cik, exact, year)).fetchone()
+        if row:
+            return "same", row[0]
+        candidates = {}
+        for b, v in enumerate(bands(value)):
+            for pid, other, other_text in self.db.execute(
+                    "SELECT p.pid, p.simhash, p.text FROM bands JOIN paragraphs p USING (pid) "
+                    "WHERE bands.cik = ? AND band = ? AND value = ? AND p.year < ?", (cik, b, v, year)):
+                if hamming(value, other) <= MAX_HAMMING:
+                    candidates[pid] = other_text
+        best = None
+        words = normalize(text).split()
+        for pid, other_text in candidates.items():
+            ratio = difflib.SequenceMatcher(None, words, normalize(other_text).split(), autojunk=False).ratio()
+            if ratio >= threshold and (best is None or ratio > best[0]):
+                best = (ratio, pid)
+        return ("near", best[1]) if best else ("new", None)
+
+    def changes(self, cik, year):
+        """
+        Paragraphs of a company which are new in year, edited (with their earlier text) and
+        those of the year before which are gone
+        """
+        new = pd.read_sql_query(
+            "SELECT path, position, text FROM paragraphs WHERE cik = ? AND year = ? AND status = 'new' "
+            "ORDER BY path, position", self.db, params=(cik, year))
+        edited = pd.read_sql_query(
+            "SELECT p.path, p.position, p.text, q.text AS before FROM paragraphs p JOIN paragraphs q "
+            "ON q.pid = p.match WHERE p.cik = ? AND p.year = ? AND p.status = 'near' "
+            "ORDER BY p.path, p.position", self.db, params=(cik, year))
+        gone = pd.read_sql_query(
+            "SELECT path, position, text FROM paragraphs p WHERE cik = ? AND year = ? AND NOT EXISTS ("
+            "SELECT 1 FROM paragraphs q WHERE q.cik = p.cik AND q.year = ? AND q.match = p.pid) "
+            "AND NOT EXISTS (SELECT 1 FROM paragraphs q WHERE q.cik = p.cik AND q.year = ? AND q.exact = p.exact) "
+            "ORDER BY path, position", self.db, params=(cik, year - 1, year, year))
+        return new, edited, gone
+
+
+class SentenceScores:
+    """
+    Label scores of sentences already scored, by label model and hash of the exact tokens
+    (sentence_key), kept in the paragraph store so that unchanged text is not scored again
+    """
+
+    def __init__(self, store, model):
+        self.db = store.db
+        self.model = model
+
+    def lookup(self, sentences, chunk=500):
+        """dict sentence number -> (label indices, scores) of the sentences already scored"""
+        keys = [sentence_key(s) for s in sentences]
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), chunk):
+            part = unique[start:start + chunk]
+            rows = self.db.execute(
+                f"SELECT sentence, payload FROM sentence_scores WHERE model = ? AND sentence IN ({','.join('?' * len(part))})",
+                [self.model] + part)
+            found.update(rows)
+        out = {}
+        for i, key in enumerate(keys):
+            if key in found:
+                idx, vals = json.loads(found[key])
+                out[i] = (np.array(idx), np.array(vals, dtype=np.float32))
+        return out
+
+    def remember(self, sentences, label_idx, label_scores):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sentence_scores VALUES (?, ?, ?)",
+                ((self.model, sentence_key(s), json.dumps([idx.tolist(), [float(v) for v in vals]]))
+                 for s, idx, vals in zip(sentences, label_idx, label_scores)))
+
+
+def diff_file(store, path, threshold=0.9):
+    """
+    Add the filings of a paragraph file (<form>_<year>.parquet) to the store and write
+    <name>_diff.parquet and <name>_new.parquet next to it
+    """
+    name = os.path.splitext(path)[0]
+    form, year = os.path.basename(name).split('_')[:2]
+    data = pd.read_parquet(path, columns=['path', 'para_keywords'])
+    rows, new_rows = [], []
+    for filing, para_keywords in zip(data['path'], data['para_keywords']):
+        paragraphs = split_paragraphs(para_keywords)
+        results = store.add_filing(filing, int(year), form, paragraphs, threshold)
+        new = []
+        for position, (text, (status, match)) in enumerate(zip(paragraphs, results)):
+            rows.append((filing, position, status, match))
+            if status == "new":
+                new.append(text)
+        new_rows.append((filing, ''.join(p + SEPARATOR for p in new), len(new)))
+    diff = pd.DataFrame(rows, columns=['path', 'position', 'status', 'match'])
+    diff.to_parquet(name + '_diff.parquet', index=False)
+    pd.DataFrame(new_rows, columns=['path', 'para_keywords', 'n_paragraphs']).to_parquet(
+        name + '_new.parquet', index=False)
+    counts = diff['status'].value_counts()
+    print(f"{path}: {len(data)} filings, {len(diff)} paragraphs, "
+          + ", ".join(f"{counts.get(s, 0)} {s}" for s in ("same", "near", "new")))
+    return diff
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Paragraph level diff of filings across years')
+    parser.add_argument('--store', metavar='S', type=str, default='./paragraphs.sqlite', help='fingerprint database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('diff', help='fingerprint paragraph files, oldest year first')
+    p.add_argument('--paragraphs', metavar='P', nargs='+', type=str, required=True, help='<form>_<year>.parquet files')
+    p.add_argument('--threshold', metavar='T', type=float, default=0.9, help='share of unchanged words of a near duplicate')
+    p.add_argument('--rebuild', action='store_true', help='drop the stored paragraphs first (sentence scores are kept)')
+    p = commands.add_parser('changes', help='what changed since the year before')
+    p.add_argument('--cik', metavar='C', type=int, required=True, help='company cik')
+    p.add_argument('--year', metavar='Y', type=int, required=True, help='year, e.g. 2021')
+
+    args = parser.parse_args()
+    store = ParagraphStore(args.store)
+    if args.command == 'diff':
+        if args.rebuild:
+            store.clear()
+        for path in sorted(args.paragraphs, key=lambda p: os.path.basename(p).split('_')[1]):
+            diff_file(store, path, args.threshold)
+    else:
+        new, edited, gone = store.changes(args.cik, args.year)
+        print(f"{len(new)} new paragraphs in {args.year}:")
+        for text in new['text']:
+            print('+ ' + text)
+        print(f"{len(edited)} paragraphs edited:")
+        for text, before in zip(edited['text'], edited['before']):
+            words, old = normalize(text).split(), normalize(before).split()
+            print('~ ' + ' '.join(d for d in difflib.ndiff(old, words) if d[0] in '+-'))
+        print(f"{len(gone)} paragraphs of {args.year - 1} gone:")
+        for text in gone['text']:
+            print('- ' + text)
+    store.close()
@@ -0,0 +1,309 @@
+"""Keyphrase extraction of the Disclosure_Keywords notebook as a batch job.
+
+Usage: python keyphrase_engine.py --paragraphs ../paragraphs/10K_2020.parquet
+    [--seeds seed_phrases.json] [--cache cache/phrase_embeddings.sqlite]
+    [--out ./keyphrases] [--docs-per-batch 200] [--candidates candidates_2020.parquet] [--year 2020]
+For every filing of a year, the n-gram candidates of its COVID paragraphs
+(CountVectorizer, as in the notebook; or the textacy keyterms mined by
+keyword_mining.py with --candidates) are ranked against every seed phrase
+with MMR and max-sum similarity. Candidates of many filings are embedded
+together, in batches of phrases of similar length, and every phrase is kept
+in an on-disk cache, so a phrase repeated across 10-Ks is embedded only once.
+Writes keyphrases_<year>.csv (one row per filing, seed and selected phrase) and
+keyphrases_<year>_summary.csv (every selected phrase with its number of filings);
+the year is taken from the paragraph file name (10K_2020.parquet,
+10K_2020_new.parquet...) unless --year is given."""
+import argparse
+import itertools
+import json
+import os
+import re
+import sqlite3
+import time
+from math import comb
+
+import numpy as np
+import pandas as pd
+
+MODEL = 'sentence-transformers/paraphrase-xlm-r-multilingual-v1'
+
+# cleanup of the notebook before candidates are extracted
+REPLACEMENTS = ['\n', '\xa0', '---------------------------']
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norm == 0, 1, norm)
+
+
+class EmbeddingCache:
+    """Phrase embeddings in sqlite, keyed by model name and phrase text."""
+
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                        'model TEXT, phrase TEXT, vec BLOB, PRIMARY KEY (model, phrase))')
+
+    def get(self, model, phrases, chunk=500):
+        """phrase -> vector of the cached phrases."""
+        found = {}
+        for start in range(0, len(phrases), chunk):
+            part = phrases[start:start + chunk]
+            rows = self.db.execute(
+                'SELECT phrase, vec FROM embeddings WHERE model = ? AND phrase IN (%s)'
+                % ','.join('?' * len(part)), [model] + part)
+            for phrase, vec in rows:
+                found[phrase] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put(self, model, phrases, vectors):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)',
+                                ((model, p, np.asarray(v, dtype=np.float32).tobytes())
+                                 for p, v in zip(phrases, vectors)))
+
+    def close(self):
+        self.db.close()
+
+
+class PhraseEncoder:
+    """Unit length sentence-transformer embeddings of phrases, cached.
+
+    model: a SentenceTransformer (or anything with encode(texts, batch_size=...)),
+        loaded from model_name on first use if None"""
+
+    def __init__(self, cache, model_name=MODEL, model=None, batch_size=256):
+        self.cache = cache
+        self.model_name = model_name
+        self._model = model
+        self.batch_size = batch_size
+        self.encoded = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name, device='cpu')
+        return self._model
+
+    def encode(self, phrases):
+        """(len(phrases), D) matrix; only phrases not in the cache go through
+        the model, sorted by length so batches need little padding."""
+        unique = list(dict.fromkeys(phrases))
+        found = self.cache.get(self.model_name, unique)
+        todo = sorted((p for p in unique if p not in found), key=len)
+        for start in range(0, len(todo), self.batch_size * 16):
+            part = todo[start:start + self.batch_size * 16]
+            vectors = normalize(self.model.encode(part, batch_size=self.batch_size))
+            self.cache.put(self.model_name, part, vectors)
+            found.update(zip(part, vectors))
+            self.encoded += len(part)
+        return np.stack([found[p] for p in phrases]) if phrases else np.zeros((0, 0), np.float32)
+
+
+def mmr(doc_sim, cand_vecs, top_n, diversity):
+    """Maximal marginal relevance, as the notebook's mmr but vectorized and
+    without the (N, N) candidate similarity matrix
+
+    doc_sim: (N,) similarity of every candidate to the document (seed)
+    cand_vecs: (N, D) unit length candidate embeddings
+    returns the indices of the selected candidates, in selection order"""
+    n = len(doc_sim)
+    top_n = min(top_n, n)
+    if not top_n:
+        return []
+    selected = [int(np.argmax(doc_sim))]
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    # highest similarity of every candidate to the selected ones so far
+    redundancy = cand_vecs @ cand_vecs[selected[0]]
+    for _ in range(top_n - 1):
+        scores = (1 - diversity) * doc_sim - diversity * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, cand_vecs @ cand_vecs[best], out=redundancy)
+    return selected
+
+
+def max_sum(doc_sim, cand_vecs, top_n, nr_candidates, max_combinations=200000):
+    """Max sum similarity, as the notebook's max_sum_sim: of the
+    nr_candidates candidates most similar to the document, the top_n whose
+    pairwise similarities have the smallest sum.
+
+    Every combination is scored in one vectorized pass while there are at
+    most max_combinations of them; above that a greedy selection improved by
+    pairwise swaps is used instead of the full enumeration."""
+    nr_candidates = min(nr_candidates, len(doc_sim))
+    top_n = min(top_n, nr_candidates)
+    if not top_n:
+        return []
+    pool = np.argsort(doc_sim, kind='stable')[-nr_candidates:]
+    sim = cand_vecs[pool] @ cand_vecs[pool].T
+    np.fill_diagonal(sim, 0)
+    if comb(nr_candidates, top_n) <= max_combinations:
+        combos = np.array(list(itertools.combinations(range(nr_candidates), top_n)), dtype=np.int64)
+        totals = np.zeros(len(combos), dtype=np.float32)
+        for a in range(top_n):
+            for b in range(a + 1, top_n):
+                totals += sim[combos[:, a], combos[:, b]]
+        chosen = combos[int(np.argmin(totals))]
+    else:
+        chosen = _greedy_min_sum(sim, top_n)
+    return [int(pool[i]) for i in chosen]
+
+
+def _greedy_min_sum(sim, top_n, max_rounds=50):
+    """Subset of top_n rows with a small sum of pairwise similarities: from
+    every start row, greedy growth then swaps of a selected and an unselected
+    row while they lower the sum; the best of all starts is kept."""
+    n = len(sim)
+    best, best_total = None, np.inf
+    for first in range(n):
+        selected = [first]
+        load = sim[first].copy()  # sum of similarities to the selected rows
+        for _ in range(top_n - 1):
+            masked = load.copy()
+            masked[selected] = np.inf
+            nxt = int(np.argmin(masked))
+            selected.append(nxt)
+            load += sim[nxt]
+        for _ in range(max_rounds):
+            inside = np.array(selected)
+            outside = np.setdiff1d(np.arange(n), inside)
+            if not len(outside):
+                break
+            # change of the sum when inside[i] is replaced by outside[j]
+            delta = (load[outside][None, :] - sim[np.ix_(inside, outside)]) - load[inside][:, None]
+            i, j = np.unravel_index(np.argmin(delta), delta.shape)
+            if delta[i, j] >= -1e-9:
+                break
+            load += sim[outside[j]] - sim[inside[i]]
+            selected[i] = int(outside[j])
+        total = load[selected].sum()
+        if total < best_total:
+            best, best_total = selected, total
+    return best
+
+
+def clean(texts):
+    """The notebook's replace() cleanup, vectorized over a Series."""
+    texts = texts.fillna('').astype(str)
+    for old in REPLACEMENTS:
+        texts = texts.str.replace(old, '', regex=False)
+    return texts
+
+
+def ngram_candidates(text, ngram_range=(2, 5), stop_words='english'):
+    """Candidate phrases of one document, as the notebook's CountVectorizer."""
+    from sklearn.feature_extraction.text import CountVectorizer
+    try:
+        count = CountVectorizer(ngram_range=ngram_range, stop_words=stop_words).fit([text])
+    except ValueError:
+        # empty vocabulary, e.g. only stop words
+        return []
+    return list(count.get_feature_names_out())
+
+
+def extract(encoder, seeds, documents, top_n=10, diversity=0.5, max_sum_top_n=6, nr_candidates=15):
+    """Yield (document number, group, seed, method, phrase, similarity)
+
+    seeds: dict, group -> list of seed phrases
+    documents: list of candidate phrase lists"""
+    seed_list = [(group, seed) for group, phrases in seeds.items() for seed in phrases]
+    seed_vecs = encoder.encode([seed for _, seed in seed_list])
+    all_candidates = [p for candidates in documents for p in candidates]
+    cand_vecs = encoder.encode(all_candidates)
+    pos = 0
+    for d, candidates in enumerate(documents):
+        vecs = cand_vecs[pos:pos + len(candidates)]
+        pos += len(candidates)
+        if not candidates:
+            continue
+        doc_sims = seed_vecs @ vecs.T
+        for (group, seed), doc_sim in zip(seed_list, doc_sims):
+            for method, chosen in (('mmr', mmr(doc_sim, vecs, top_n, diversity)),
+                                   ('max_sum', max_sum(doc_sim, vecs, max_sum_top_n, nr_candidates))):
+                for i in chosen:
+                    yield d, group, seed, method, candidates[i], float(doc_sim[i])
+
+
+def main(paragraphs, seeds_path, cache_path, out_dir, docs_per_batch=200, model_name=MODEL,
+         batch_size=256, top_n=10, diversity=0.5, max_sum_top_n=6, nr_candidates=15,
+         candidates=None, year=None):
+    with open(seeds_path, encoding='utf-8') as f:
+        seeds = json.load(f)
+    if paragraphs.endswith('.parquet'):
+        data = pd.read_parquet(paragraphs, columns=['path', 'para_keywords'])
+    else:
+        data = pd.read_excel(paragraphs, index_col=0)
+    data = data.dropna(subset=['para_keywords'])
+    data['para_keywords'] = clean(data['para_keywords'])
+    if year is None:
+        found = re.search(r'(?:19|20)\d\d', os.path.basename(paragraphs))
+        if not found:
+            raise ValueError('no year for %s, use --year' % paragraphs)
+        year = found.group()
+    paths = data['path'].tolist() if 'path' in data else data.index.astype(str).tolist()
+    mined = None
+    if candidates is not None:
+        mined = pd.read_parquet(candidates, columns=['path', 'phrase'])
+        mined = mined.drop_duplicates().groupby('path', sort=False)['phrase'].agg(list).to_dict()
+
+    cache = EmbeddingCache(cache_path)
+    encoder = PhraseEncoder(cache, model_name, batch_size=batch_size)
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, 'keyphrases_%s.csv' % year)
+    columns = ['path', 'group', 'seed', 'method', 'phrase', 'similarity']
+    start = time.time()
+    first = True
+    texts = data['para_keywords'].tolist()
+    for batch in range(0, len(texts), docs_per_batch):
+        if mined is not None:
+            documents = [mined.get(p, []) for p in paths[batch:batch + docs_per_batch]]
+        else:
+            documents = [ngram_candidates(t) for t in texts[batch:batch + docs_per_batch]]
+        rows = [(paths[batch + d],) + tuple(rest) for d, *rest in
+                extract(encoder, seeds, documents, top_n, diversity, max_sum_top_n, nr_candidates)]
+        pd.DataFrame(rows, columns=columns).to_csv(out_path, mode='w' if first else 'a',
+                                                   header=first, index=False)
+        first = False
+        done = min(batch + docs_per_batch, len(texts))
+        print('%d/%d filings, %d phrases embedded, %.0fs' % (done, len(texts), encoder.encoded,
+                                                              time.time() - start))
+    cache.close()
+
+    result = pd.read_csv(out_path)
+    summary = (result.groupby('phrase')
+               .agg(n_filings=('path', 'nunique'), methods=('method', lambda m: ' '.join(sorted(set(m)))),
+                    groups=('group', lambda g: ' '.join(sorted(set(g)))), similarity=('similarity', 'max'))
+               .sort_values('n_filings', ascending=False))
+    summary.to_csv(os.path.join(out_dir, 'keyphrases_%s_summary.csv' % year))
+    print('%d distinct phrases selected' % len(summary))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the keyphrases of a year of filings')
+    parser.add_argument('--paragraphs', required=True, help='paragraph file of a year, .parquet (covid_paragraphs.py) or .xlsx')
+    parser.add_argument('--seeds', default='seed_phrases.json', help='json, group -> seed phrases')
+    parser.add_argument('--cache', default='cache/phrase_embeddings.sqlite', help='phrase embedding cache')
+    parser.add_argument('--out', default='./keyphrases', help='output folder')
+    parser.add_argument('--docs-per-batch', type=int, default=200, help='filings whose candidates are embedded together')
+    parser.add_argument('--model', default=MODEL, help='sentence-transformers model')
+    parser.add_argument('--batch-size', type=int, default=256, help='phrases per model batch')
+    parser.add_argument('--top-n', type=int, default=10, help='phrases selected by MMR per seed')
+    parser.add_argument('--diversity', type=float, default=0.5, help='MMR diversity')
+    parser.add_argument('--max-sum-top-n', type=int, default=6, help='phrases selected by max-sum per seed')
+    parser.add_argument('--nr-candidates', type=int, default=15, help='max-sum candidate pool')
+    parser.add_argument('--candidates', help='candidates Parquet of keyword_mining.py instead of n-grams')
+    parser.add_argument('--year', help='year of the outputs, default the year in the paragraph file name')
+    args = parser.parse_args()
+    main(args.paragraphs, args.seeds, args.cache, args.out, args.docs_per_batch, args.model,
+         args.batch_size, args.top_n, args.diversity, args.max_sum_top_n, args.nr_candidates,
+         args.candidates, args.year)
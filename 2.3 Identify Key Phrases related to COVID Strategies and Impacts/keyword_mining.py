@@ -0,0 +1,145 @@
+"""Keyword mining of the Disclosure_Keywords notebook over a year of filings.
+
+Usage: python keyword_mining.py --paragraphs ../paragraphs/10K_2020.parquet
+    [--out ./keywords] [--cache cache/docbin] [--model en_core_web_sm]
+    [--processes 4] [--methods textrank yake sgrank] [--topn 1000] [--only-new]
+The COVID paragraphs of every filing are cleaned with vectorized string
+operations and written one per line to paragraphs_<year>.txt. Each line is
+parsed once (nlp.pipe over several processes) into the DocBin parse cache of
+docbin_cache.py, and the textacy keyterm rankings run on the cached docs, one
+filing at a time, in parallel. Writes candidates_<year>.parquet (path, method,
+phrase, score) and candidate_df_<year>.csv (phrase, method, number of filings,
+mean score).
+
+--only-new reads <name>_new.parquet, written next to the paragraph file by
+paragraph_diff.py diff, instead: only the paragraphs which are new or changed
+materially since the earlier years of the same company are mined (and go on
+to the CoNLL-U export).
+
+The CoNLL-U export reuses the same parses without running the parser again:
+    python 2spacyconllu.py --cache=<cache> paragraphs_<year>.txt para.conllu"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             '2.4 Strategy and Impact Extraction for Each Company',
+                             'CAT(main codes for this project)'))
+from docbin_cache import ParseCache, readlines
+
+# paragraphs are separated by this line in para_keywords (covid_paragraphs.SEPARATOR)
+SEPARATOR = '\n---------------------------\n'
+
+# components 2spacyconllu.py disables by default, so both share one cache
+DISABLE = ['ner']
+
+# textacy keyterm functions and their arguments (yake as in the notebook)
+METHODS = {
+    'textrank': dict(normalize='lemma', window_size=3),
+    'yake': dict(ngrams=(1, 2, 3, 4, 5), window_size=5, include_pos=None),
+    'sgrank': dict(ngrams=(1, 2, 3, 4, 5), normalize='lemma'),
+}
+
+
+def split_paragraphs(data):
+    """One row per paragraph (path, paragraph), with the notebook's cleanup
+    done as vectorized string operations on the whole column; line breaks
+    and non breaking spaces become spaces so that words stay apart."""
+    paragraphs = data[['path', 'para_keywords']].dropna()
+    paragraphs = paragraphs.assign(paragraph=paragraphs['para_keywords'].str.split(SEPARATOR, regex=False))
+    paragraphs = paragraphs.explode('paragraph')[['path', 'paragraph']]
+    text = paragraphs['paragraph'].str.replace('---------------------------', '', regex=False)
+    text = text.str.replace(r'[\n\r\xa0]+', ' ', regex=True).str.replace(r' {2,}', ' ', regex=True).str.strip()
+    paragraphs['paragraph'] = text
+    return paragraphs[text.str.len() > 0].reset_index(drop=True)
+
+
+_cache = None
+
+
+def _init_worker(cache_dir, model, disable):
+    global _cache
+    _cache = ParseCache(cache_dir, model, disable)
+
+
+def rank_filing(task):
+    """Candidates of one filing: [(path, method, phrase, score)]."""
+    from spacy.tokens import Doc
+    from textacy.extract import keyterms
+    path, lines, methods, topn = task
+    doc = Doc.from_docs(list(_cache.docs(lines)))
+    out = []
+    for method in methods:
+        try:
+            terms = getattr(keyterms, method)(doc, topn=topn, **METHODS[method])
+        except (ValueError, ZeroDivisionError):
+            # too short a document for the method
+            continue
+        out.extend((path, method, phrase, float(score)) for phrase, score in terms)
+    return out
+
+
+def main(paragraphs, out_dir, cache_dir='cache/docbin', model='en_core_web_sm', processes=1,
+         methods=('textrank', 'yake', 'sgrank'), topn=1000, batch_size=1000, only_new=False):
+    # <prefix>_<year>.parquet or <prefix>_<year>_new.parquet
+    year = os.path.splitext(os.path.basename(paragraphs))[0].split('_')[1]
+    if only_new:
+        paragraphs = os.path.splitext(paragraphs)[0] + '_new.parquet'
+        print('new paragraphs only: %s' % paragraphs)
+    data = pd.read_parquet(paragraphs, columns=['path', 'para_keywords'])
+    paragraphs = split_paragraphs(data)
+    os.makedirs(out_dir, exist_ok=True)
+    lines_path = os.path.join(out_dir, 'paragraphs_%s.txt' % year)
+    with open(lines_path, 'w', encoding='utf8') as out:
+        out.writelines(paragraphs['paragraph'] + '\n')
+    print('%d filings, %d paragraphs' % (paragraphs['path'].nunique(), len(paragraphs)))
+
+    start = time.time()
+    cache = ParseCache(cache_dir, model, DISABLE)
+    # the lines exactly as 2spacyconllu.py --cache reads them, so it finds them cached
+    lines = list(readlines(lines_path))
+    n = cache.update(lines, batch_size=batch_size, processes=processes)
+    print('%d new paragraphs parsed in %.0fs' % (n, time.time() - start))
+
+    start = time.time()
+    tasks = [(path, [lines[i] for i in rows], list(methods), topn)
+             for path, rows in paragraphs.groupby('path', sort=False).indices.items()]
+    rows = []
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(cache_dir, model, DISABLE)) as pool:
+        # consecutive filings share DocBin shards, so give workers runs of them
+        for i, found in enumerate(pool.map(rank_filing, tasks, chunksize=16), 1):
+            rows.extend(found)
+            if i % 100 == 0 or i == len(tasks):
+                print('\rranked %d/%d filings' % (i, len(tasks)), end='', flush=True)
+    print(' in %.0fs' % (time.time() - start))
+
+    candidates = pd.DataFrame(rows, columns=['path', 'method', 'phrase', 'score'])
+    candidates.to_parquet(os.path.join(out_dir, 'candidates_%s.parquet' % year), index=False)
+    df = (candidates.groupby(['phrase', 'method'])
+          .agg(n_filings=('path', 'nunique'), score=('score', 'mean'))
+          .reset_index().sort_values(['method', 'n_filings'], ascending=[True, False]))
+    df.to_csv(os.path.join(out_dir, 'candidate_df_%s.csv' % year), index=False)
+    print('%d candidates, %d distinct phrases' % (len(candidates), candidates['phrase'].nunique()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mine candidate keyphrases of a year of filings')
+    parser.add_argument('--paragraphs', required=True, help='paragraph Parquet of a year (covid_paragraphs.py)')
+    parser.add_argument('--out', default='./keywords', help='output folder')
+    parser.add_argument('--cache', default='cache/docbin', help='DocBin parse cache folder')
+    parser.add_argument('--model', default='en_core_web_sm', help='spaCy model')
+    parser.add_argument('--processes', type=int, default=1, help='parser and ranking processes')
+    parser.add_argument('--methods', nargs='+', default=['textrank', 'yake', 'sgrank'], choices=sorted(METHODS),
+                        help='textacy keyterm rankings')
+    parser.add_argument('--topn', type=int, default=1000, help='candidates per filing and method')
+    parser.add_argument('--batch-size', type=int, default=1000, help='nlp.pipe batch size')
+    parser.add_argument('--only-new', action='store_true',
+                        help='mine the <name>_new.parquet of paragraph_diff.py, only new or changed paragraphs')
+    args = parser.parse_args()
+    main(args.paragraphs, args.out, args.cache, args.model, args.processes, args.methods,
+         args.topn, args.batch_size, args.only_new)
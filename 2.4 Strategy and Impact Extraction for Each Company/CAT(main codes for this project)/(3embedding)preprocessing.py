@@ -1,5 +1,6 @@
 """Creating fragments takes a long time so we treat it as a
 pre-processing step."""
+import argparse
 import logging
 import json
 import sys
@@ -8,13 +9,52 @@ from gensim.models import Word2Vec
 from cat.fragments import create_noun_counts
 from cat.utils import conll2text
 from collections import Counter
+from corpus_stream import conllu_pass, log_stage, rank_aspect_words
+from embedding_store import EmbeddingStore
+from ann_index import Neighbours
 
 logging.basicConfig(level=logging.INFO)
 
+WORD2VEC_PARAMS = dict(sg=0,
+                       negative=5,
+                       window=10,
+                       vector_size=200,
+                       min_count=2,
+                       epochs=5,
+                       workers=10)
+
+
+def streaming(paths):
+    """Same outputs as the default path without holding the corpus in
+    memory: one pass over the CoNLL-U files gives the noun counts and the
+    text corpus, which Word2Vec reads from disk (corpus_file, the multi-core
+    fast path)."""
+    with log_stage('conllu pass'):
+        counts = conllu_pass(paths, "data/all_txt.txt", "data/nouns.json")
+    with log_stage('word2vec'):
+        f = Word2Vec(corpus_file="data/all_txt.txt", **WORD2VEC_PARAMS)
+    with log_stage('save embedding'):
+        f.wv.save_word2vec_format("embeddings/my_para_word_vectors.vec")
+        store = EmbeddingStore.from_keyed_vectors(f.wv, "embeddings/my_para_word_vectors",
+                                                  vec_path="embeddings/my_para_word_vectors.vec")
+    with log_stage('neighbour index'):
+        Neighbours.load_or_build(store, "embeddings/my_para_word_vectors")
+    with log_stage('aspect ranking'):
+        nouns = rank_aspect_words(counts, f.wv)
+        json.dump(nouns, open("data/para_aspect_words.json", "w"))
+
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description='Train the word embeddings and rank the aspect words')
+    parser.add_argument('--streaming', action='store_true', help='single pass over the CoNLL-U, corpus not loaded in memory')
+    args = parser.parse_args()
+
     paths = ["data/para.conllu"]
+    if args.streaming:
+        streaming(paths)
+        sys.exit()
+
     create_noun_counts(paths,
                        "data/nouns.json")
     conll2text(paths, "data/all_txt.txt")
@@ -22,17 +62,15 @@ if __name__ == "__main__":
     corpus = [x.lower().strip().split()
               for x in open("data/all_txt.txt", encoding='utf-8')]
     print('loaded text finished')
-    f = Word2Vec(corpus,
-                 sg=0,
-                 negative=5,
-                 window=10,
-                 vector_size=200,
-                 min_count=2,
-                 epochs=5,
-                 workers=10)
+    f = Word2Vec(corpus, **WORD2VEC_PARAMS)
     print('word2vec training finished')
     f.wv.save_word2vec_format("embeddings/my_para_word_vectors.vec")
+    # binary copy, memory mapped by 4run.py instead of parsing the text file
+    store = EmbeddingStore.from_keyed_vectors(f.wv, "embeddings/my_para_word_vectors",
+                                              vec_path="embeddings/my_para_word_vectors.vec")
     print('save embedding finished')
+    # nearest neighbour index for growing the label set (ann_index.py)
+    Neighbours.load_or_build(store, "embeddings/my_para_word_vectors")
     d = json.load(open("data/nouns.json", encoding='utf-8'))
     nouns = Counter()
     for k, v in d.items():
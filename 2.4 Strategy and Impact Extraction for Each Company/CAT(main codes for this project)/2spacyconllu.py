@@ -1,13 +1,26 @@
 """Parse text with Spacy and write output in CoNLL-U format.
 Usage: spacyconllu.py [inputfile] [outputfile] [--model=<name>]
+    [--processes=<n>] [--batch-size=<n>] [--disable=<names>] [--cat-only]
 By default: read stdin, write to stdout, model=en_core_web_sm
 Expects input to contain one document/paragraph/sentence per line of
 *untokenized* text. No line breaks within sentences!
 The input is parsed in batches of 1000 lines at a time.
+--processes=<n>: split the input file into shards at line boundaries and
+    parse them with n processes; the shards are merged into one output with
+    consecutive sent_ids (requires an input and an output file).
+--disable=<names>: comma separated pipeline components to disable
+    (default: ner).
+--cat-only: disable every component CAT does not need (ner, lemmatizer,
+    parser); sentences are split by the senter component instead, CAT only
+    reads the word forms, POS tags and sentence boundaries.
+--cache=<dir>: keep the parses as DocBin shards keyed by the hash of each
+    input line (see docbin_cache.py) and only parse new or changed lines.
 Cf. https://spacy.io/ and http://universaldependencies.org/format.html"""
 import os
 import sys
+import time
 import getopt
+import multiprocessing
 import spacy
 
 # Constants for field numbers:
@@ -65,10 +78,12 @@ def writeconllu(doc, out, sentid, tagmap, prefix=''):
     """Prints parsed sentences in CONLL-U format
     (as used in Universal Dependencies).
     Cf. http://universaldependencies.org/docs/format.html
+    The lines of a document are buffered and written at once.
     """
+    buf = []
     for sent in doc.sents:
-        print('# sent_id = %s' % (prefix + str(sentid)), file=out)
-        print('# text = %s' % str(sent.sent).strip(), file=out)
+        buf.append('# sent_id = %s\n' % (prefix + str(sentid)))
+        buf.append('# text = %s\n' % str(sent.sent).strip())
         conllu = []
         for wordidx, word in enumerate(sent, 1):
             if word.text.isspace():  # skip non-tokens such as '\n'
@@ -91,15 +106,112 @@ def writeconllu(doc, out, sentid, tagmap, prefix=''):
                     '_',                          # 10. MISC
                     ])
         for line in renumber(conllu):
-            print(*line, sep='\t', file=out)
-        print('', file=out)
+            buf.append('\t'.join(map(str, line)) + '\n')
+        buf.append('\n')
         sentid += 1
+    (out or sys.stdout).write(''.join(buf))
     return sentid
 
 
+# components CAT does not use: it reads word forms, POS tags and sentence boundaries
+CAT_DISABLE = ['ner', 'lemmatizer', 'parser']
+
+
+def loadmodel(model, disable, senter=False):
+    """Load a spaCy model without the disabled components, optionally
+    enabling the (much cheaper) senter to split sentences without a parser."""
+    nlp = spacy.load(model, disable=disable)
+    if senter and 'senter' in getattr(nlp, 'disabled', []):
+        nlp.enable_pipe('senter')
+    tagmap = getattr(nlp.Defaults, 'tag_map', None)
+    return nlp, tagmap
+
+
+def shardoffsets(path, nshards):
+    """Split a file into at most nshards byte ranges at line boundaries."""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as inp:
+        for n in range(1, nshards):
+            inp.seek(max(size * n // nshards, offsets[-1]))
+            inp.readline()  # move to the start of the next line
+            pos = min(inp.tell(), size)
+            if pos > offsets[-1]:
+                offsets.append(pos)
+    if offsets[-1] < size or size == 0:
+        offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def readshard(path, start, end):
+    """Yield the lines of a file between two byte offsets."""
+    with open(path, 'rb') as inp:
+        inp.seek(start)
+        while inp.tell() < end:
+            line = inp.readline()
+            if not line:
+                break
+            yield line.decode('utf8')
+
+
+_worker = {}
+
+
+def parseshard(task):
+    """Parse one shard into a temporary CoNLL-U file with sent_ids from 1,
+    runs in a worker process; returns (shard file, #docs, #sentences)."""
+    input_file, start, end, shardfile, model, disable, senter, batchsize = task
+    if 'nlp' not in _worker:
+        _worker['nlp'], _worker['tagmap'] = loadmodel(model, disable, senter)
+    nlp, tagmap = _worker['nlp'], _worker['tagmap']
+    sentid, ndocs = 1, 0
+    with open(shardfile, 'w', encoding='utf8', buffering=1 << 20) as out:
+        for doc in nlp.pipe(readshard(input_file, start, end), batch_size=batchsize):
+            sentid = writeconllu(doc, out, sentid, tagmap, prefix='')
+            ndocs += 1
+    return shardfile, ndocs, sentid - 1
+
+
+def mergeshards(shardfiles, nsents, out, prefix=''):
+    """Concatenate shard files, renumbering sent_ids to be globally consecutive."""
+    offset = 0
+    for shardfile, n in zip(shardfiles, nsents):
+        with open(shardfile, encoding='utf8') as inp:
+            for line in inp:
+                if line.startswith('# sent_id = '):
+                    line = '# sent_id = %s%d\n' % (prefix, offset + int(line[12:]))
+                out.write(line)
+        offset += n
+        os.remove(shardfile)
+
+
+def parallel(input_file, output_file, model, disable, senter, batchsize, processes):
+    """Parse the input file with a pool of processes, see --processes."""
+    # more shards than processes, so a slow shard does not keep the others waiting
+    shards = shardoffsets(input_file, processes * 4)
+    tasks = [(input_file, start, end, '%s.shard%05d' % (output_file, n),
+              model, disable, senter, batchsize)
+             for n, (start, end) in enumerate(shards)]
+    begin = time.perf_counter()
+    results = []
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(parseshard, tasks):
+            results.append(result)
+            ndocs = sum(r[1] for r in results)
+            nsents = sum(r[2] for r in results)
+            elapsed = time.perf_counter() - begin
+            print('\rshards %d/%d, %d docs, %d sentences, %.1f sentences/sec' % (
+                    len(results), len(tasks), ndocs, nsents, nsents / elapsed),
+                  end='', file=sys.stderr, flush=True)
+    print('', file=sys.stderr)
+    with open(output_file, 'w', encoding='utf8', buffering=1 << 20) as out:
+        mergeshards([r[0] for r in results], [r[2] for r in results], out)
+
+
 def main():
     """CLI"""
-    longopts = ['model=', 'help']
+    longopts = ['model=', 'processes=', 'batch-size=', 'disable=', 'cat-only',
+                'cache=', 'help']
     try:
         opts, args = getopt.gnu_getopt(sys.argv[1:], '', longopts)
     except getopt.GetoptError:
@@ -113,19 +225,49 @@ def main():
     if args and not os.path.exists(input_file):
         raise ValueError('%s does not exist!' % input_file)
     model = opts.get('--model', 'en_core_web_sm')
+    processes = int(opts.get('--processes', 1))
+    batchsize = int(opts.get('--batch-size', 1000))
+    senter = '--cat-only' in opts
+    if senter:
+        disable = CAT_DISABLE
+    else:
+        disable = [x for x in opts.get('--disable', 'ner').split(',') if x]
+
+    if '--cache' in opts:
+        if len(args) < 2:
+            raise ValueError('--cache needs an input and an output file')
+        from docbin_cache import ParseCache, export, readlines
+        cache = ParseCache(opts['--cache'], model, disable, senter)
+        cache.update(readlines(input_file), batch_size=batchsize,
+                     processes=processes)
+        export(cache.docs(readlines(input_file)), args[1])
+        return
+
+    if processes > 1:
+        if len(args) < 2:
+            raise ValueError('--processes needs an input and an output file')
+        parallel(input_file, args[1], model, disable, senter, batchsize,
+                 processes)
+        return
 
-    nlp = spacy.load(model)
-    tagmap = nlp.Defaults.tag_map
+    nlp, tagmap = loadmodel(model, disable, senter)
     sentid = 1
-    out = open(args[1], 'w', encoding='utf8') if len(args) > 1 else None
+    out = open(args[1], 'w', encoding='utf8', buffering=1 << 20) if len(args) > 1 else None
+    begin = time.perf_counter()
     try:
         with open(input_file, encoding='utf8') as inp:
-            for idx, doc in enumerate(nlp.pipe(inp, batch_size=1000, disable=['ner'])):
+            for idx, doc in enumerate(nlp.pipe(inp, batch_size=batchsize)):
                 sentid = writeconllu(doc, out, sentid, tagmap, prefix='')
-                print(f'\r{idx}', end='', flush=True)
+                if idx % 1000 == 0:
+                    print('\r%d docs, %.1f sentences/sec' % (
+                            idx, (sentid - 1) / (time.perf_counter() - begin)),
+                          end='', file=sys.stderr, flush=True)
     finally:
         if out is not None:
             out.close()
+    print('\r%d sentences, %.1f sentences/sec' % (
+            sentid - 1, (sentid - 1) / (time.perf_counter() - begin)),
+          file=sys.stderr)
 
 
 if __name__ == "__main__":
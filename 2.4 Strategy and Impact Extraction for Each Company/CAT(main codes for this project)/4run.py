@@ -1,26 +1,41 @@
 import sys
 sys.path.append('.')
-from collections import defaultdict
-from reach import Reach
-from cat.simple import get_scores, rbf_attention
-import json
+from embedding_store import EmbeddingStore
+from cat_scoring import top_k
+from label_model import LabelModel, load_config
+from prediction_table import PredictionWriter, read_mapping
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                             '2.2 Extract COVID-related Paragraphs from 10K.'))
+from paragraph_diff import ParagraphStore, SentenceScores
 import numpy as np
 
-GAMMA = .03
-N_ASPECT_WORDS = 20
-N_TOPICS = 2
-THRESH_HOLD = 0.3
+# gamma, number of aspect words, labels... live in the label config
+config = load_config('config/cat_labels.json')
+GAMMA = config['gamma']
+N_ASPECT_WORDS = config['n_aspect_words']
+N_TOPICS = config['n_topics']
+THRESH_HOLD = config['threshold']
+
+# filing path of every line of sentence.txt (path first, tab separated), optional
+MAPPING_FILE = './10K/prediction_mapping.txt'
+
+# paragraph_diff.py store; if it exists, sentences scored by an earlier run
+# (same label model) keep their scores and are not scored again
+DIFF_STORE = './data/paragraphs.sqlite'
+
+# sentences written to the outputs at once
+WRITE_CHUNK = 1 << 16
 
 if __name__ == "__main__":
 
-    scores = defaultdict(dict)
-    r = Reach.load("embeddings/my_word_vectors_sentence_level.vec",
-                   unk_word="<UNK>")
+    # memory mapped binary copy of the .vec file (converted on first use),
+    # same .vectors/.items/unk_index as Reach.load(..., unk_word="<UNK>")
+    r = EmbeddingStore.load_or_convert("embeddings/my_word_vectors_sentence_level.vec",
+                                       unk_word="<UNK>")
     print('loaded word embedding')
 
-    aspects = [[x]
-               for x in json.load(open("data/aspect_words_sentence_level.json"))]
-    aspects = aspects[:N_ASPECT_WORDS]
+    aspects = config['aspects']
 
     with open('./10K/sentence.txt', 'r', encoding='utf-8') as f:
         instances = f.readlines()
@@ -28,54 +43,53 @@ if __name__ == "__main__":
     print('loaded instances to be predicted')
 
     instances = [x.split() for x in instances]
-    label_set = ['financial flexibility','exit our joint venture investment','stop paying dividends',
-    'maintained cash','additional funding','additional capital','preserve flexibility liquidity',
-
-    'reduce costs','reduce expenses','decrease spending',
-
-    'exited underperforming','focus core service','support services prolonged','deferred arrangements',
-    'provide aftermarket service',
-    'improve profitability','increasing discount rates','advertising cancellations','digital transformation',
-    'experienced increase sales','reduced profitability','reduce operations','adjusting business plan',
-    
-    'remote working','avoid gatherings','impose travel restrictions','store closures',
-
-    'capture new customers','demand variability customers',
-
-    'reduce staffing','hiring reducing','retain key employees','damage employee relations',
-
-    'sell composites','precautionary measure','reduce production', 'stoppage','prolonged work stoppage',
-    'temporarily suspend','closure airframe maintenance','lower productivity','reduce inventory levels',
-    
-    'obtain materials','obtain supplies','find alternate sources','seek alternative suppliers',
-    
-    'increase evaluate sensitivity','assessing impact','relief and stimulus',
-    'negatively impacts demand','economic and market uncertainty',
-    'adversely affect business','impacted stock price','tax deferral',
-    'sell shares','extend credit','disruptions supply','obtain clinical supplies']
-
-    s = get_scores(instances,
-                   aspects,
-                   r,
-                   label_set,
-                   gamma=GAMMA,
-                   remove_oov=False,
-                   attention_func=rbf_attention)
-
-    
-    pred = np.argpartition(s, -N_TOPICS, axis=1)[:, -N_TOPICS:]
-    probability = s[np.argpartition(s, -N_TOPICS, axis=1)[:, -N_TOPICS:]]
-    print('prediction: ')
-    print(pred)
-
-    with open('data/prediction_Sentence(3).txt', 'w', encoding='utf-8') as f:
-        for idx, x in enumerate(pred):
-            inst = ' '.join(instances[idx])
-            target_labels = []
-            
-            for idx, label_index in enumerate(x):
-                if probability[idx][label_index] > THRESH_HOLD:
-                    target_labels.append(label_set[label_index])
-            target_labels = '\t'.join(target_labels)
-
-            print(inst + target_labels + '\n', file=f)
+    paths = read_mapping(MAPPING_FILE) if os.path.exists(MAPPING_FILE) else None
+    if paths is not None and len(paths) != len(instances):
+        raise ValueError('%s has %d lines, sentence.txt %d' % (MAPPING_FILE, len(paths), len(instances)))
+    label_set = config['labels']
+
+    # aspect and label matrices and the word kernel, cached per embeddings
+    # and label set in cache/label_models
+    model = LabelModel.load_or_build(r, aspects, label_set, GAMMA)
+    sentences = [' '.join(x) for x in instances]
+    known, sentence_scores = {}, None
+    if os.path.exists(DIFF_STORE):
+        sentence_scores = SentenceScores(ParagraphStore(DIFF_STORE), '%s/%d' % (model.key, N_TOPICS))
+        known = sentence_scores.lookup(sentences)
+        print('%d of %d sentences scored before' % (len(known), len(sentences)))
+    todo = [i for i in range(len(instances)) if i not in known]
+
+    # rbf attention scores (as cat.simple.get_scores with rbf_attention),
+    # computed in batches over the sentences encoded once into word ids
+    engine = model.engine(r)
+    encoded = engine.encode([instances[i] for i in todo])
+    print('encoded instances')
+
+    # best N_TOPICS labels of every sentence, best first
+    pred = np.zeros((len(instances), N_TOPICS), dtype=np.int64)
+    probability = np.zeros((len(instances), N_TOPICS), dtype=np.float32)
+    for i, (label_indices, label_scores) in known.items():
+        pred[i], probability[i] = label_indices, label_scores
+    for start, s in engine.iter_scores(encoded):
+        rows = todo[start:start + len(s)]
+        pred[rows], probability[rows] = top_k(s, N_TOPICS)
+    if sentence_scores is not None:
+        sentence_scores.remember([sentences[i] for i in todo], pred[todo], probability[todo])
+
+    # typed columnar copy of the predictions, joined to companies by company_join.py
+    table = PredictionWriter('data/prediction_sentence.parquet', label_set, N_TOPICS, THRESH_HOLD,
+                             metadata={'gamma': GAMMA, 'label_model': model.key})
+    with open('data/prediction_Sentence(3).txt', 'w', encoding='utf-8') as f, table:
+        for start in range(0, len(instances), WRITE_CHUNK):
+            end = min(start + WRITE_CHUNK, len(instances))
+            table.write(start, sentences[start:end], pred[start:end], probability[start:end],
+                        paths[start:end] if paths is not None else None)
+            for row, (label_indices, label_scores) in enumerate(zip(pred[start:end], probability[start:end])):
+                inst = sentences[start + row]
+                target_labels = [label_set[label_index]
+                                 for label_index, score in zip(label_indices, label_scores)
+                                 if score > THRESH_HOLD]
+                target_labels = '\t'.join(target_labels)
+
+                print(inst + '\t' + target_labels + '\n', file=f)
+    print('prediction finished')
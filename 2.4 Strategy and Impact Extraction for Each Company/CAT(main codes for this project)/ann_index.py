@@ -0,0 +1,254 @@
+"""Approximate nearest neighbours of words and phrases in the word embeddings.
+
+An IVF (inverted file) index in plain NumPy: the unit length word vectors are
+clustered with spherical k-means, and a query only scans the words of the
+n_probe clusters whose centroids are closest to it, instead of the whole
+vocabulary. The index is saved as <base>.ivf.npz next to the embedding store
+and rebuilt when the embeddings change.
+
+Usage:
+    python ann_index.py [--embeddings file.vec] reduce staffing, supply chain
+        neighbours of each comma separated word or phrase
+    python ann_index.py --batch data/para_aspect_words.json --top 500 --out neighbours.tsv
+        neighbours of the most frequent candidate aspect words
+    python ann_index.py --batch data/para_aspect_words.json --dedup 0.75
+        groups of near duplicate candidates
+    python ann_index.py --recall 1000
+        recall and speed against a brute force scan"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from cat_scoring import ScoringEngine, normalize
+
+
+class IVFIndex:
+    """Inverted file index over unit length vectors, by cosine similarity
+
+    centroids: (C, D) unit length cluster centroids
+    offsets: (C + 1,) the rows of cluster c are data[offsets[c]:offsets[c + 1]]
+    ids: (N,) word row of every row of data
+    data: (N, D) unit length vectors, ordered by cluster"""
+
+    def __init__(self, centroids, offsets, ids, data, meta=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.data = data
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, iterations=10, sample=100000, seed=0, block=65536):
+        """Spherical k-means on (a sample of) the vectors, then every vector
+        is put in the list of its closest centroid."""
+        n = len(vectors)
+        n_lists = n_lists or max(1, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, min(n, sample), replace=False))
+        train = normalize(vectors[rows])
+        train = train[np.linalg.norm(train, axis=1) > 0]
+        n_lists = min(n_lists, len(train))
+        centroids = train[rng.choice(len(train), n_lists, replace=False)]
+        for _ in range(iterations):
+            assign = (train @ centroids.T).argmax(1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            empty = np.bincount(assign, minlength=n_lists) == 0
+            # restart empty clusters on random training vectors
+            sums[empty] = train[rng.choice(len(train), empty.sum())]
+            centroids = normalize(sums)
+
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, block):
+            assign[start:start + block] = (normalize(vectors[start:start + block]) @ centroids.T).argmax(1)
+        ids = np.argsort(assign, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=n_lists))))
+        data = np.empty((n, vectors.shape[1]), dtype=np.float32)
+        for start in range(0, n, block):
+            data[start:start + block] = normalize(vectors[ids[start:start + block]])
+        return cls(centroids, offsets, ids, data)
+
+    def save(self, path):
+        with open(path + '.part', 'wb') as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+                     data=self.data, meta=np.array(json.dumps(self.meta)))
+        os.replace(path + '.part', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['centroids'], f['offsets'], f['ids'], f['data'],
+                       json.loads(str(f['meta'])))
+
+    def search(self, queries, k=10, n_probe=8):
+        """(Q, k) word rows and cosine similarities of the k nearest
+        neighbours of every query vector, best first (-1 / -inf padded)."""
+        queries = normalize(np.atleast_2d(queries))
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        out_sims = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, (query, lists) in enumerate(zip(queries, probes)):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists])
+            sims = self.data[rows] @ query
+            top = min(k, len(rows))
+            if not top:
+                continue
+            best = np.argpartition(-sims, top - 1)[:top]
+            best = best[np.argsort(-sims[best], kind='stable')]
+            out_ids[q, :top] = self.ids[rows[best]]
+            out_sims[q, :top] = sims[best]
+        return out_ids, out_sims
+
+    def brute_force(self, queries, k=10):
+        """Exact answer of search, for measuring its recall."""
+        queries = normalize(np.atleast_2d(queries))
+        sims = queries @ self.data.T
+        best = np.argsort(-sims, axis=1, kind='stable')[:, :k]
+        return self.ids[best], np.take_along_axis(sims, best, axis=1)
+
+
+class Neighbours:
+    """Word and phrase queries over an IVFIndex of embeddings r (an
+    EmbeddingStore, or anything with .vectors and .items)."""
+
+    def __init__(self, r, index, n_probe=8):
+        self.r = r
+        self.index = index
+        self.n_probe = n_probe
+        self.words = [None] * len(r.vectors)
+        for word, i in r.items.items():
+            self.words[i] = word
+
+    @classmethod
+    def load_or_build(cls, r, base, n_lists=None, n_probe=8):
+        """The index saved as <base>.ivf.npz, rebuilt when the embeddings'
+        sha1 (recorded by EmbeddingStore) differs from the one it was built on."""
+        path = base + '.ivf.npz'
+        sha1 = (getattr(r, 'meta', None) or {}).get('sha1')
+        if os.path.exists(path):
+            index = IVFIndex.load(path)
+            if sha1 is not None and index.meta.get('sha1') == sha1:
+                return cls(r, index, n_probe)
+        print('building the neighbour index of %d words...' % len(r.vectors))
+        index = IVFIndex.build(r.vectors, n_lists)
+        index.meta = {'sha1': sha1}
+        index.save(path)
+        return cls(r, index, n_probe)
+
+    def vectors(self, phrases):
+        """Mean word vector of every word or multi-word phrase."""
+        return ScoringEngine.phrase_vectors(self.r.vectors, self.r.items, phrases)
+
+    def query(self, phrases, k=10, exclude_self=True):
+        """List of [(word, similarity)] of every phrase, best first; the
+        words of a phrase are left out of its neighbours. A phrase without
+        any word in the vocabulary has no neighbours (an empty list)."""
+        words = [phrase.split() if isinstance(phrase, str) else phrase for phrase in phrases]
+        known = [i for i, own in enumerate(words) if any(w in self.r.items for w in own)]
+        out = [[] for _ in phrases]
+        if not known:
+            return out
+        ids, sims = self.index.search(self.vectors([phrases[i] for i in known]),
+                                      k + (4 if exclude_self else 0), self.n_probe)
+        for q, row_ids, row_sims in zip(known, ids, sims):
+            own = set(words[q])
+            found = [(self.words[i], float(s)) for i, s in zip(row_ids, row_sims)
+                     if i >= 0 and not (exclude_self and self.words[i] in own)]
+            out[q] = found[:k]
+        return out
+
+    def dedup(self, words, threshold=0.75, k=10):
+        """Group words whose similarity is at least threshold (transitively,
+        with a union-find over the neighbour pairs); groups keep the order
+        of words, so the first word of a group is its most frequent one."""
+        words = [w for w in words if w in self.r.items]
+        position = {w: i for i, w in enumerate(words)}
+        parent = list(range(len(words)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, found in enumerate(self.query(words, k)):
+            for word, sim in found:
+                j = position.get(word)
+                if j is not None and sim >= threshold:
+                    a, b = find(i), find(j)
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+        groups = {}
+        for i, word in enumerate(words):
+            groups.setdefault(find(i), []).append(word)
+        return list(groups.values())
+
+
+def recall(neighbours, n_queries=1000, k=10, seed=0):
+    """Recall@k of the index against brute force, and ms per query of both."""
+    index = neighbours.index
+    rng = np.random.default_rng(seed)
+    n = len(neighbours.r.vectors)
+    rows = rng.choice(n, min(n_queries, n), replace=False)
+    queries = np.asarray(neighbours.r.vectors[np.sort(rows)], dtype=np.float32)
+    queries = queries[np.linalg.norm(queries, axis=1) > 0]
+    start = time.perf_counter()
+    approx, _ = index.search(queries, k, neighbours.n_probe)
+    approx_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    start = time.perf_counter()
+    exact, _ = index.brute_force(queries, k)
+    exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / exact.size, approx_ms, exact_ms
+
+
+if __name__ == '__main__':
+    from embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__.split('Usage:')[1])
+    parser.add_argument('phrases', nargs='*', help='comma separated words or phrases')
+    parser.add_argument('--embeddings', default='embeddings/my_word_vectors_sentence_level.vec',
+                        help='word2vec text file')
+    parser.add_argument('-k', type=int, default=10, help='neighbours per query')
+    parser.add_argument('--lists', type=int, default=None, help='clusters of the index, default 4 * sqrt(words)')
+    parser.add_argument('--probe', type=int, default=8, help='clusters scanned per query')
+    parser.add_argument('--batch', help='json list of candidate words, e.g. data/para_aspect_words.json')
+    parser.add_argument('--top', type=int, default=1000, help='candidates of --batch used')
+    parser.add_argument('--out', help='tsv file of the --batch neighbours, default stdout')
+    parser.add_argument('--dedup', type=float, help='group --batch candidates with this similarity')
+    parser.add_argument('--recall', type=int, help='measure recall and speed with this many queries')
+    args = parser.parse_args()
+
+    r = EmbeddingStore.load_or_convert(args.embeddings, unk_word='<UNK>')
+    neighbours = Neighbours.load_or_build(r, os.path.splitext(args.embeddings)[0], args.lists, args.probe)
+
+    if args.recall:
+        hit_rate, approx_ms, exact_ms = recall(neighbours, args.recall, args.k)
+        print('recall@%d %.3f, %.3f ms/query (brute force %.3f ms/query)' % (
+            args.k, hit_rate, approx_ms, exact_ms))
+    if args.phrases:
+        phrases = [p.strip() for p in ' '.join(args.phrases).split(',') if p.strip()]
+        for phrase, found in zip(phrases, neighbours.query(phrases, args.k)):
+            print('%s: %s' % (phrase, ', '.join('%s %.2f' % x for x in found)))
+    if args.batch:
+        with open(args.batch, encoding='utf-8') as f:
+            candidates = json.load(f)[:args.top]
+        if args.dedup is not None:
+            for group in neighbours.dedup(candidates, args.dedup, args.k):
+                if len(group) > 1:
+                    print('\t'.join(group))
+        else:
+            start = time.perf_counter()
+            found = neighbours.query(candidates, args.k)
+            print('%d queries in %.2fs' % (len(candidates), time.perf_counter() - start))
+            out = open(args.out, 'w', encoding='utf-8') if args.out else None
+            for word, row in zip(candidates, found):
+                print(word + '\t' + '\t'.join('%s:%.3f' % x for x in row), file=out)
+            if out is not None:
+                out.close()
@@ -0,0 +1,102 @@
+"""Benchmark the batched scoring engine against the per-sentence path.
+
+Usage: python benchmark_scoring.py [--sentences N] [--reference N]
+Scores N synthetic sentences with cat_scoring.ScoringEngine and the first
+--reference sentences with the per-sentence loop of 4run.py (cat.simple
+get_scores with rbf_attention when cat and reach are importable, otherwise a
+plain NumPy transcription of it), checks that both give the same scores and
+reports sentences/sec of each."""
+import argparse
+import time
+
+import numpy as np
+
+from cat_scoring import ScoringEngine, normalize, top_k
+
+
+class Embeddings:
+    """Random word vectors with the .vectors/.items interface of Reach."""
+
+    def __init__(self, n_words=50000, dim=200, seed=0):
+        rng = np.random.default_rng(seed)
+        words = ['<UNK>'] + ['w%d' % i for i in range(n_words - 1)]
+        self.vectors = rng.normal(0, 0.3, (n_words, dim)).astype(np.float32)
+        self.vectors[0] = 0
+        self.items = {w: i for i, w in enumerate(words)}
+        self.unk_index = 0
+
+
+def synthetic_sentences(n, n_words, seed=1, mean_length=25):
+    rng = np.random.default_rng(seed)
+    lengths = rng.poisson(mean_length, n) + 1
+    # Zipf-like word frequencies, a few out of vocabulary words
+    ids = np.minimum(rng.zipf(1.2, lengths.sum()), n_words + 10)
+    words = ['w%d' % i for i in ids]
+    out, pos = [], 0
+    for length in lengths:
+        out.append(words[pos:pos + length])
+        pos += length
+    return out
+
+
+def reference_scores(r, sentences, aspects, labels, gamma):
+    """One sentence at a time, as cat.simple.get_scores with rbf_attention."""
+    engine = ScoringEngine.from_reach(r, aspects, labels, gamma)
+    out = []
+    for sentence in sentences:
+        vec = np.stack([r.vectors[r.items.get(w, r.unk_index)] for w in sentence])
+        diff = ((vec[:, None, :] - engine.aspect_vecs[None, :, :]) ** 2).sum(-1)
+        z = np.exp(-gamma * diff).sum(1)
+        att = z / z.sum() if z.sum() else np.ones(len(vec)) / len(vec)
+        out.append(normalize(att[None, :].dot(vec)).dot(engine.label_vecs.T)[0])
+    return np.stack(out)
+
+
+def legacy_scores(r, sentences, aspects, labels, gamma):
+    """The path of 4run.py, needs the cat package and a Reach instance."""
+    from cat.simple import get_scores, rbf_attention
+    return get_scores(sentences, aspects, r, labels, gamma=gamma,
+                      remove_oov=False, attention_func=rbf_attention)
+
+
+def main(n_sentences, n_reference, n_aspects=20, n_labels=55, gamma=.03, k=2):
+    r = Embeddings()
+    aspects = [['w%d' % (i + 1)] for i in range(n_aspects)]
+    labels = ['w%d w%d' % (2 * i + 100, 2 * i + 101) for i in range(n_labels)]
+    sentences = synthetic_sentences(n_sentences, len(r.items))
+
+    start = time.perf_counter()
+    engine = ScoringEngine.from_reach(r, aspects, labels, gamma)
+    encoded = engine.encode(sentences)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    best = [top_k(s, k) for _, s in engine.iter_scores(encoded)]
+    engine_time = time.perf_counter() - start
+    print('engine: %d sentences, encode %.2fs, score + top-%d %.2fs, %.0f sentences/sec' % (
+        n_sentences, encode_time, k, engine_time, n_sentences / (encode_time + engine_time)))
+
+    subset = sentences[:n_reference]
+    try:
+        scorer, name = legacy_scores, 'cat.simple.get_scores'
+        scorer(r, subset[:1], aspects, labels, gamma)
+    except Exception:
+        scorer, name = reference_scores, 'per-sentence NumPy loop'
+    start = time.perf_counter()
+    expected = scorer(r, subset, aspects, labels, gamma)
+    reference_time = time.perf_counter() - start
+    print('%s: %d sentences, %.2fs, %.0f sentences/sec' % (
+        name, len(subset), reference_time, len(subset) / reference_time))
+
+    got = engine.scores(engine.encode(subset))
+    print('max abs difference of the scores: %.2e' % np.abs(got - expected).max())
+    print('speedup: %.1fx' % ((len(subset) / reference_time)
+                              / (n_sentences / (encode_time + engine_time))) ** -1)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sentences', type=int, default=100000, help='sentences scored by the engine, e.g. 1000000')
+    parser.add_argument('--reference', type=int, default=5000, help='sentences scored by the per-sentence path')
+    args = parser.parse_args()
+    main(args.sentences, args.reference)
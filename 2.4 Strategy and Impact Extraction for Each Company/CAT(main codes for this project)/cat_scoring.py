@@ -0,0 +1,185 @@
+"""Batched CAT scoring: RBF attention over the aspect vectors, then cosine
+similarity of the attended sentence vector with every label.
+
+Same computation as cat.simple.get_scores(..., attention_func=rbf_attention)
+but the sentences are encoded once into a CSR array of word ids and scored
+chunk by chunk with matrix operations, so memory is bounded by the chunk size
+instead of the corpus size."""
+import numpy as np
+
+# number of tokens scored at once, memory is about chunk_tokens * dim floats;
+# blocks which stay in the CPU cache are several times faster than large ones
+CHUNK_TOKENS = 1 << 13
+
+
+def normalize(x):
+    """Unit length rows, all-zero rows stay zero."""
+    x = np.asarray(x, dtype=np.float32)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norm == 0, 1, norm)
+
+
+class Encoded:
+    """Sentences as word ids in CSR layout: the ids of sentence i are
+    ids[indptr[i]:indptr[i + 1]]."""
+
+    def __init__(self, ids, indptr):
+        self.ids = ids
+        self.indptr = indptr
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def lengths(self):
+        return np.diff(self.indptr)
+
+
+class ScoringEngine:
+    """Scores sentences against labels with RBF attention over aspect vectors
+
+    vectors: (V, D) array, word vectors (e.g. Reach.vectors, may be memory mapped)
+    items: dict, word -> row of vectors
+    aspect_vecs: (A, D) array, one vector per aspect (mean of its words)
+    label_vecs: (K, D) array, unit length label vectors
+    unk_index: row of out of vocabulary words, None to drop them
+    word_kernel: (V,) precomputed result of word_kernel(), e.g. from a saved
+        label model, None to compute it on first use"""
+
+    def __init__(self, vectors, items, aspect_vecs, label_vecs, gamma,
+                 unk_index=None, chunk_tokens=CHUNK_TOKENS, word_kernel=None):
+        self.vectors = vectors
+        self.items = items
+        self.aspect_vecs = np.asarray(aspect_vecs, dtype=np.float32)
+        self.label_vecs = np.asarray(label_vecs, dtype=np.float32)
+        self.gamma = gamma
+        self.unk_index = unk_index
+        self.chunk_tokens = chunk_tokens
+        self._aspect_sq = (self.aspect_vecs ** 2).sum(1)
+        self._word_kernel = word_kernel
+
+    @staticmethod
+    def phrase_vectors(vectors, items, phrases, unk_index=None):
+        """Mean word vector of every phrase (a string or a list of words)."""
+        out = np.zeros((len(phrases), vectors.shape[1]), dtype=np.float32)
+        for i, phrase in enumerate(phrases):
+            words = phrase.split() if isinstance(phrase, str) else phrase
+            rows = [items.get(w, unk_index) for w in words]
+            rows = [x for x in rows if x is not None]
+            if rows:
+                out[i] = np.asarray(vectors[rows], dtype=np.float32).mean(0)
+        return out
+
+    @classmethod
+    def from_reach(cls, r, aspects, labels, gamma, **kwargs):
+        """Engine over a Reach instance (or anything with .vectors and .items)
+
+        aspects: list of lists of words, e.g. [['covid'], ['supply']]
+        labels: list of label phrases, e.g. ['reduce costs', 'remote working']"""
+        unk_index = getattr(r, 'unk_index', None)
+        if unk_index is None:
+            unk_index = r.items.get('<UNK>')
+        aspect_vecs = cls.phrase_vectors(r.vectors, r.items, aspects, unk_index)
+        label_vecs = normalize(cls.phrase_vectors(r.vectors, r.items, labels, unk_index))
+        return cls(r.vectors, r.items, aspect_vecs, label_vecs, gamma,
+                   unk_index=unk_index, **kwargs)
+
+    def encode(self, sentences):
+        """Encode sentences (strings or token lists) once into word ids."""
+        items, unk = self.items, self.unk_index
+        ids, indptr = [], [0]
+        for sentence in sentences:
+            tokens = sentence.split() if isinstance(sentence, str) else sentence
+            for token in tokens:
+                idx = items.get(token, unk)
+                if idx is not None:
+                    ids.append(idx)
+            indptr.append(len(ids))
+        return Encoded(np.asarray(ids, dtype=np.int64), np.asarray(indptr, dtype=np.int64))
+
+    def chunks(self, encoded):
+        """Split the sentences into ranges of about chunk_tokens tokens."""
+        n = len(encoded)
+        start = 0
+        while start < n:
+            limit = encoded.indptr[start] + self.chunk_tokens
+            end = max(start + 1, int(np.searchsorted(encoded.indptr, limit, side='right')) - 1)
+            end = min(end, n)
+            yield start, end
+            start = end
+
+    def token_block(self, encoded, start, end):
+        """Word vectors of the tokens of sentences start:end, the sentence
+        number (relative to start) of every token and the sentence lengths."""
+        lo, hi = encoded.indptr[start], encoded.indptr[end]
+        vecs = np.asarray(self.vectors[encoded.ids[lo:hi]], dtype=np.float32)
+        lengths = np.diff(encoded.indptr[start:end + 1])
+        segments = np.repeat(np.arange(end - start), lengths)
+        return vecs, segments, lengths
+
+    def sq_distances(self, vecs, aspect_vecs=None, aspect_sq=None):
+        """Squared euclidean distance of every token to every aspect."""
+        if aspect_vecs is None:
+            aspect_vecs, aspect_sq = self.aspect_vecs, self._aspect_sq
+        d = (vecs ** 2).sum(1)[:, None] + aspect_sq[None, :] - 2 * vecs @ aspect_vecs.T
+        return np.maximum(d, 0, out=d)
+
+    def attend(self, vecs, segments, lengths, kernel):
+        """Attention weighted, unit length sentence vectors
+
+        kernel: (T,) summed RBF similarity of every token to the aspects"""
+        nsent = len(lengths)
+        totals = np.bincount(segments, weights=kernel, minlength=nsent)
+        # back off to uniform attention when all similarities vanish
+        uniform = totals[segments] == 0
+        weights = np.where(uniform, 1.0 / np.maximum(lengths, 1)[segments],
+                           kernel / np.where(uniform, 1, totals[segments]))
+        sentence_vecs = np.zeros((nsent, vecs.shape[1]), dtype=np.float32)
+        # tokens of a sentence are contiguous, so a segmented sum gives the weighted mean
+        nonempty = lengths > 0
+        if nonempty.any():
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            # summing along contiguous rows of the transposed block is much faster
+            weighted = np.ascontiguousarray((vecs * weights[:, None].astype(np.float32)).T)
+            sentence_vecs[nonempty] = np.add.reduceat(weighted, offsets[nonempty], axis=1).T
+        return normalize(sentence_vecs)
+
+    def word_kernel(self, block=65536):
+        """Summed RBF similarity of every vocabulary word to the aspects; it
+        only depends on the word, so it is computed once per word instead of
+        once per token."""
+        if self._word_kernel is None:
+            kernel = np.zeros(len(self.vectors), dtype=np.float32)
+            for start in range(0, len(self.vectors), block):
+                vecs = np.asarray(self.vectors[start:start + block], dtype=np.float32)
+                kernel[start:start + block] = np.exp(-self.gamma * self.sq_distances(vecs)).sum(1)
+            self._word_kernel = kernel
+        return self._word_kernel
+
+    def score_chunk(self, encoded, start, end):
+        """(end - start, K) label scores of sentences start:end."""
+        vecs, segments, lengths = self.token_block(encoded, start, end)
+        lo, hi = encoded.indptr[start], encoded.indptr[end]
+        kernel = self.word_kernel()[encoded.ids[lo:hi]]
+        return self.attend(vecs, segments, lengths, kernel) @ self.label_vecs.T
+
+    def iter_scores(self, encoded):
+        """Yield (start, scores) per chunk of sentences."""
+        for start, end in self.chunks(encoded):
+            yield start, self.score_chunk(encoded, start, end)
+
+    def scores(self, encoded):
+        """(N, K) label scores of all sentences."""
+        out = np.zeros((len(encoded), len(self.label_vecs)), dtype=np.float32)
+        for start, s in self.iter_scores(encoded):
+            out[start:start + len(s)] = s
+        return out
+
+
+def top_k(scores, k):
+    """Indices and scores of the k best labels of every row, best first,
+    from a single partition of the score matrix."""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
@@ -0,0 +1,233 @@
+"""Parameter sweep of the CAT scoring of 4run.py.
+
+Usage: python cat_sweep.py [--sentences 10K/sentence.txt] [--sample sample_labels.tsv]
+    [--gamma .01 .03 .1] [--n-aspect-words 10 20 40] [--n-topics 1 2 3]
+    [--threshold .2 .3 .4] [--processes 4] [--out sweep]
+The sentences (and the hand-labelled sample) are encoded once into word ids,
+and the vectors of the words they use, with their squared distances to every
+aspect word, are cached in cache/sweep/<key> as .npy files. A setting of gamma
+and the number of aspect words only needs the RBF kernel of these words and
+one attention pass over the cached token blocks (one process per setting,
+memory mapping the cache); the number of topics and the threshold are applied
+to the top labels of that pass, so they cost nothing extra. Scores are the
+ones 4run.py gives with the same constants.
+
+The sample file has one sentence per line followed by its correct labels, tab
+separated, like prediction_Sentence(3).txt (a sentence without labels has
+none). Writes <out>_summary.csv, one row per setting with the label
+distribution summary and the agreement with the sample (micro precision,
+recall and F1 of the labels, share of exactly right sentences), and
+<out>_labels.csv, the number of sentences of every label per setting."""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from cat_scoring import Encoded, ScoringEngine, top_k
+from label_model import CONFIG, embeddings_hash, load_config
+
+SENTENCES = './10K/sentence.txt'
+EMBEDDINGS = 'embeddings/my_word_vectors_sentence_level.vec'
+CACHE_DIR = 'cache/sweep'
+
+
+def read_sample(path):
+    """(sentences, sets of correct labels) of a hand-labelled sample"""
+    sentences, labels = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0].strip():
+                sentences.append(fields[0])
+                labels.append({x for x in fields[1:] if x})
+    return sentences, labels
+
+
+class SweepCache:
+    """Encoded sentences over the compact vocabulary of the words they use.
+
+    ids, indptr: CSR word ids (rows of vectors) of the corpus sentences, then
+        of the sample sentences
+    vectors: (U, D) vectors of the used words
+    sqdist: (U, A) squared distance of every used word to every aspect
+    aspect_vecs, label_vecs: as in the label model"""
+
+    FILES = ('ids', 'indptr', 'vectors', 'sqdist', 'aspect_vecs', 'label_vecs')
+
+    def __init__(self, folder, meta, **arrays):
+        self.folder = folder
+        self.meta = meta
+        for name in self.FILES:
+            setattr(self, name, arrays[name])
+
+    @property
+    def encoded(self):
+        return Encoded(self.ids, self.indptr)
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(folder, name + '.npy'), mmap_mode='r') for name in cls.FILES}
+        return cls(folder, meta, **arrays)
+
+    @classmethod
+    def build(cls, folder, r, sentences, aspects, labels, n_sample=0):
+        engine = ScoringEngine.from_reach(r, aspects, labels, 0)
+        encoded = engine.encode(sentences)
+        used, ids = np.unique(encoded.ids, return_inverse=True)
+        vectors = np.asarray(r.vectors[used], dtype=np.float32)
+        arrays = {'ids': ids.astype(np.int64), 'indptr': encoded.indptr, 'vectors': vectors,
+                  'sqdist': engine.sq_distances(vectors), 'aspect_vecs': engine.aspect_vecs,
+                  'label_vecs': engine.label_vecs}
+        meta = {'n_sentences': len(sentences) - n_sample, 'n_sample': n_sample, 'n_words': len(used),
+                'aspects': aspects, 'labels': labels}
+        os.makedirs(folder, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(folder, name + '.npy'), array)
+        with open(os.path.join(folder, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return cls.load(folder)
+
+
+def cache_key(r, sentences_path, sample_path, aspects, labels):
+    files = [[p, os.path.getsize(p), os.path.getmtime(p)] for p in (sentences_path, sample_path) if p]
+    signature = json.dumps([embeddings_hash(r), files, aspects, labels])
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+
+
+def evaluate(folder, gamma, n_aspects, n_topics, thresholds):
+    """Label counts and sample predictions of every (n_topics, threshold)
+    setting for one gamma and number of aspect words; runs in a worker."""
+    cache = SweepCache.load(folder)
+    sqdist = np.asarray(cache.sqdist[:, :n_aspects], dtype=np.float32)
+    kernel = np.exp(-gamma * sqdist).sum(1)
+    engine = ScoringEngine(cache.vectors, None, cache.aspect_vecs[:n_aspects], cache.label_vecs, gamma,
+                           word_kernel=kernel)
+    n_labels, n_corpus = len(cache.label_vecs), cache.meta['n_sentences']
+    settings = list(itertools.product(n_topics, thresholds))
+    counts = {s: np.zeros(n_labels, dtype=np.int64) for s in settings}
+    labelled = dict.fromkeys(settings, 0)
+    sample = {s: [] for s in settings}
+    k_max = max(n_topics)
+    start_time = time.perf_counter()
+    for start, scores in engine.iter_scores(cache.encoded):
+        idx, vals = top_k(scores, k_max)
+        # rows of the chunk which belong to the corpus, the rest to the sample
+        n = max(0, min(len(scores), n_corpus - start))
+        for k, threshold in settings:
+            keep = vals[:, :k] > threshold
+            counts[k, threshold] += np.bincount(idx[:n, :k][keep[:n]], minlength=n_labels)
+            labelled[k, threshold] += int(keep[:n].any(1).sum())
+            sample[k, threshold] += [set(i[m].tolist()) for i, m in zip(idx[n:, :k], keep[n:])]
+    seconds = time.perf_counter() - start_time
+    return [{'gamma': gamma, 'n_aspect_words': n_aspects, 'n_topics': k, 'threshold': threshold,
+             'counts': counts[k, threshold], 'labelled': labelled[k, threshold],
+             'sample': sample[k, threshold], 'seconds': seconds} for k, threshold in settings]
+
+
+def agreement(predicted, gold):
+    """Micro precision, recall, F1 and the share of sentences with exactly the right labels"""
+    tp = sum(len(p & g) for p, g in zip(predicted, gold))
+    n_pred, n_gold = sum(len(p) for p in predicted), sum(len(g) for g in gold)
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    exact = float(np.mean([p == g for p, g in zip(predicted, gold)])) if gold else None
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'exact': exact}
+
+
+def sweep(r, config, sentences_path=SENTENCES, sample_path=None, gammas=None, n_aspect_words=None,
+          n_topics=None, thresholds=None, processes=1, cache_dir=CACHE_DIR, all_aspects=None):
+    """Summary and label distribution DataFrames of the grid; the unset
+    dimensions take the value of the config.
+
+    all_aspects: aspect words to choose the first n from, default the aspect
+        word file of the config"""
+    gammas = gammas or [config['gamma']]
+    n_aspect_words = n_aspect_words or [config['n_aspect_words']]
+    n_topics = n_topics or [config['n_topics']]
+    thresholds = thresholds or [config['threshold']]
+    labels = config['labels']
+    if all_aspects is None:
+        with open(config['aspect_words'], encoding='utf-8') as f:
+            all_aspects = [[x] for x in json.load(f)]
+    aspects = all_aspects[:max(n_aspect_words)]
+
+    with open(sentences_path, encoding='utf-8') as f:
+        sentences = [line.split() for line in f]
+    sample_sentences, gold = read_sample(sample_path) if sample_path else ([], [])
+    unknown = {x for g in gold for x in g} - set(labels)
+    if unknown:
+        print('labels of the sample not in the label set: %s' % ', '.join(sorted(unknown)))
+    index = {label: i for i, label in enumerate(labels)}
+    gold_ids = [{index[x] for x in g if x in index} for g in gold]
+
+    folder = os.path.join(cache_dir, cache_key(r, sentences_path, sample_path, aspects, labels))
+    begin = time.perf_counter()
+    if os.path.exists(os.path.join(folder, 'meta.json')):
+        cache = SweepCache.load(folder)
+        print('encoded sentences loaded from %s' % folder)
+    else:
+        cache = SweepCache.build(folder, r, sentences + [s.split() for s in sample_sentences], aspects, labels,
+                                 n_sample=len(sample_sentences))
+        print('encoded %d sentences (%d words) in %.1fs' % (len(sentences), cache.meta['n_words'],
+                                                         time.perf_counter() - begin))
+
+    passes = list(itertools.product(gammas, n_aspect_words))
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(evaluate, folder, gamma, n, n_topics, thresholds) for gamma, n in passes]
+        results = [result for future in futures for result in future.result()]
+    print('%d settings (%d attention passes) in %.1fs' % (len(results), len(passes), time.perf_counter() - begin))
+
+    rows, distribution = [], []
+    n_sentences = cache.meta['n_sentences']
+    for result in results:
+        setting = {key: result[key] for key in ('gamma', 'n_aspect_words', 'n_topics', 'threshold')}
+        counts = result['counts']
+        shares = counts / max(counts.sum(), 1)
+        row = dict(setting, sentences=n_sentences, labelled_share=result['labelled'] / max(n_sentences, 1),
+                   labels_per_sentence=counts.sum() / max(n_sentences, 1), labels_used=int((counts > 0).sum()),
+                   top_label=labels[int(counts.argmax())] if counts.sum() else None,
+                   top_label_share=float(shares.max()),
+                   entropy=float(-(shares[shares > 0] * np.log2(shares[shares > 0])).sum()),
+                   pass_seconds=result['seconds'])
+        if gold:
+            row.update(agreement(result['sample'], gold_ids))
+        rows.append(row)
+        distribution += [dict(setting, label=label, sentences=int(c)) for label, c in zip(labels, counts)]
+    summary = pd.DataFrame(rows)
+    if gold:
+        summary = summary.sort_values(['f1', 'exact'], ascending=False)
+    return summary, pd.DataFrame(distribution)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the CAT scoring constants')
+    parser.add_argument('--config', default=CONFIG, help='label config, the default of every dimension')
+    parser.add_argument('--embeddings', default=EMBEDDINGS, help='word vectors (.vec, converted on first use)')
+    parser.add_argument('--sentences', default=SENTENCES, help='sentences to label, one per line')
+    parser.add_argument('--sample', help='hand-labelled sentences: sentence<TAB>label<TAB>label...')
+    parser.add_argument('--gamma', nargs='+', type=float, help='RBF attention gamma values')
+    parser.add_argument('--n-aspect-words', nargs='+', type=int, help='numbers of aspect words')
+    parser.add_argument('--n-topics', nargs='+', type=int, help='numbers of labels per sentence')
+    parser.add_argument('--threshold', nargs='+', type=float, help='score thresholds')
+    parser.add_argument('--processes', type=int, default=1, help='attention passes run at once')
+    parser.add_argument('--out', default='sweep', help='prefix of the output csv files')
+    args = parser.parse_args()
+
+    from embedding_store import EmbeddingStore
+    r = EmbeddingStore.load_or_convert(args.embeddings, unk_word='<UNK>')
+    summary, distribution = sweep(r, load_config(args.config), args.sentences, args.sample, args.gamma,
+                                  args.n_aspect_words, args.n_topics, args.threshold, args.processes)
+    summary.to_csv(args.out + '_summary.csv', index=False)
+    distribution.to_csv(args.out + '_labels.csv', index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summary.drop(columns=['pass_seconds']).head(20).to_string(index=False))
@@ -0,0 +1,104 @@
+"""Join the sentence predictions of 4run.py to companies and export slices.
+
+Usage:
+    python company_join.py join --predictions data/prediction_sentence.parquet
+        --companies 10K_2020_csv.csv --out data/sentence_company.parquet
+    python company_join.py export --joined data/sentence_company.parquet
+        --company "PEPSICO INC" "COCA COLA CO" "JONES SODA CO" --out ./companies
+--companies is either the 10K_<year>_csv.csv file of the paragraph step
+(path, adsh, company name, sub domain... columns) or a cik_index folder
+(cik_index.py). Filings are matched on the accession number, not on the line
+order of separate files. The joined table is sorted by company name, so an
+export only reads the row groups whose statistics can contain the company."""
+import argparse
+import os
+import re
+import sys
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+
+from prediction_table import accession_from_path
+
+ROW_GROUP_SIZE = 1 << 16
+
+
+def load_companies(source):
+    """Company table, one row per accession, as an Arrow table with an
+    'accession' key column and a 'company name' column."""
+    if os.path.isdir(source):
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '1. Data Collection'))
+        from cik_index import CikIndex
+        frame = CikIndex(source).companies().rename(columns={'name': 'company name'})
+        frame = frame.drop(columns='cik').rename_axis('accession').reset_index()
+    else:
+        frame = pd.read_csv(source, index_col=0)
+        frame = frame.drop(columns=[c for c in ('para_keywords',) if c in frame])
+        if 'adsh' in frame:
+            frame['accession'] = frame['adsh']
+        else:
+            frame['accession'] = frame['path'].map(accession_from_path)
+        # the predictions carry their own path and cik
+        frame = frame.drop(columns=[c for c in ('path', 'adsh', 'cik') if c in frame])
+    frame = frame.drop_duplicates('accession', keep='last')
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    # pandas may give large_string, the key types of a join have to match
+    return table.cast(pa.schema([pa.field(f.name, pa.string()) if pa.types.is_large_string(f.type) else f
+                                 for f in table.schema]))
+
+
+def join(predictions, companies, out):
+    """Left join of the predictions with the companies on the accession
+    (a hash join in Arrow, no conversion to Python rows), written sorted by
+    company name with small row groups."""
+    table = ds.dataset(predictions).to_table()
+    # dictionary columns are not supported as join payload, decode them
+    decoded = [pc.cast(c, c.type.value_type) if pa.types.is_dictionary(c.type) else c
+               for c in table.columns]
+    table = pa.Table.from_arrays(decoded, names=table.column_names)
+    joined = table.join(load_companies(companies), keys='accession', join_type='left outer')
+    joined = joined.sort_by([('company name', 'ascending'), ('sentence_id', 'ascending')])
+    matched = joined.num_rows - joined['company name'].null_count
+    pq.write_table(joined, out, row_group_size=ROW_GROUP_SIZE, compression='zstd',
+                   write_statistics=True)
+    print('%d sentences, %d matched to a company' % (joined.num_rows, matched))
+    return joined
+
+
+def export(joined, companies, out_dir, fmt='csv'):
+    """One file per company name, each read with the company filter pushed
+    down to the Parquet row group statistics."""
+    os.makedirs(out_dir, exist_ok=True)
+    dataset = ds.dataset(joined)
+    for company in companies:
+        table = dataset.to_table(filter=ds.field('company name') == company)
+        name = re.sub(r'\W+', '_', company).strip('_')
+        path = os.path.join(out_dir, '%s.%s' % (name, fmt))
+        if fmt == 'parquet':
+            pq.write_table(table, path)
+        else:
+            table.to_pandas().to_csv(path)
+        print('%s: %d sentences -> %s' % (company, table.num_rows, path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Join sentence predictions to companies')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('join', help='attach the company of every sentence')
+    p.add_argument('--predictions', default='data/prediction_sentence.parquet', help='Parquet written by 4run.py')
+    p.add_argument('--companies', required=True, help='10K_<year>_csv.csv file or cik_index folder')
+    p.add_argument('--out', default='data/sentence_company.parquet', help='joined Parquet file')
+    p = commands.add_parser('export', help='write the sentences of some companies')
+    p.add_argument('--joined', default='data/sentence_company.parquet', help='Parquet written by join')
+    p.add_argument('--company', nargs='+', required=True, help='company names, e.g. "PEPSICO INC"')
+    p.add_argument('--out', default='.', help='output folder')
+    p.add_argument('--format', default='csv', choices=['csv', 'parquet'], help='output format')
+    args = parser.parse_args()
+
+    if args.command == 'join':
+        join(args.predictions, args.companies, args.out)
+    else:
+        export(args.joined, args.company, args.out, args.format)
@@ -0,0 +1,99 @@
+"""Streaming helpers for the embedding preprocessing: one pass over CoNLL-U
+files producing both the plain text corpus and the noun counts, a restartable
+corpus iterator, and the vectorized aspect word ranking."""
+import json
+import logging
+import resource
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# CoNLL-U field numbers, as in 2spacyconllu.py
+ID, FORM, UPOS = 0, 1, 3
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextmanager
+def log_stage(name):
+    """Log the wall time and the peak RSS after a stage."""
+    start = time.perf_counter()
+    yield
+    logger.info('%s: %.1fs, peak RSS %.0f MB', name,
+                time.perf_counter() - start, peak_rss_mb())
+
+
+def iter_conllu(paths):
+    """Yield the (forms, upos tags) of every sentence of CoNLL-U files."""
+    for path in paths:
+        forms, tags = [], []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#'):
+                    continue
+                line = line.rstrip('\n')
+                if not line:
+                    if forms:
+                        yield forms, tags
+                    forms, tags = [], []
+                    continue
+                fields = line.split('\t')
+                # skip multiword token ranges (1-2) and empty nodes (1.1)
+                if '-' in fields[ID] or '.' in fields[ID]:
+                    continue
+                forms.append(fields[FORM])
+                tags.append(fields[UPOS])
+        if forms:
+            yield forms, tags
+
+
+def conllu_pass(paths, text_path, nouns_path=None):
+    """One pass over CoNLL-U files writing the lower cased text corpus (one
+    sentence per line, the gensim corpus_file format) and counting nouns.
+
+    returns the noun counts, also saved as json to nouns_path if given"""
+    counts = Counter()
+    with open(text_path, 'w', encoding='utf-8', buffering=1 << 20) as out:
+        for forms, tags in iter_conllu(paths):
+            out.write(' '.join(forms).lower() + '\n')
+            counts.update(form for form, tag in zip(forms, tags)
+                          if tag == 'NOUN')
+    if nouns_path is not None:
+        with open(nouns_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(counts), f)
+    return counts
+
+
+class LineCorpus:
+    """Restartable iterable over a text corpus of one sentence per line, so
+    Word2Vec can make several passes without the corpus being in memory."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                yield line.lower().split()
+
+
+def rank_aspect_words(counts, wv):
+    """Nouns in the embedding vocabulary sorted by frequency (most frequent
+    first), counts of nouns which only differ in case are summed.
+
+    counts: dict, noun -> count
+    wv: gensim KeyedVectors"""
+    if not counts:
+        return ()
+    counts = pd.Series(counts, dtype='int64')
+    counts.index = counts.index.str.lower()
+    counts = counts.groupby(level=0, sort=False).sum()
+    counts = counts[counts.index.isin(pd.Index(wv.index_to_key))]
+    return tuple(counts.sort_values(ascending=False, kind='stable').index)
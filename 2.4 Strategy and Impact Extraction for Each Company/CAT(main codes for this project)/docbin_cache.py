@@ -0,0 +1,191 @@
+"""Cache spaCy parses of the paragraph corpus as DocBin shards.
+
+Usage: docbin_cache.py inputfile [--cache=<dir>] [--model=<name>] [--cat-only]
+    [--processes=<n>] [--conllu=<file>] [--text=<file>] [--nouns=<file>]
+Every input line (one paragraph) is keyed by the sha1 of its text; only lines
+which are not in the cache yet are parsed. CoNLL-U (as written by
+2spacyconllu.py), the plain text corpus (one lower cased sentence per line, as
+conll2text) and the noun counts (as create_noun_counts) are then all derived
+from the cached parses in one streaming pass, without running the parser."""
+import os
+import sys
+import json
+import getopt
+import hashlib
+import importlib
+from collections import Counter, OrderedDict
+
+import spacy
+from spacy.tokens import DocBin
+
+spacyconllu = importlib.import_module('2spacyconllu')
+
+# token attributes kept in the cache: everything writeconllu needs, plus
+# SENT_START so that sentence boundaries survive without a parser
+ATTRS = ['ORTH', 'TAG', 'HEAD', 'DEP', 'LEMMA', 'MORPH', 'POS', 'SENT_START',
+         'ENT_IOB', 'ENT_TYPE']
+
+
+def linehash(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+class ParseCache:
+    """DocBin shards of parsed lines, keyed by the content hash of each line.
+
+    The cache of every model / disabled components combination lives in its
+    own folder, so parses made with a different pipeline are never mixed."""
+
+    def __init__(self, cache_dir='cache/docbin', model='en_core_web_sm',
+                 disable=('ner',), senter=False, max_loaded=4):
+        self.model = model
+        self.disable = sorted(disable)
+        self.senter = senter
+        signature = json.dumps([os.path.basename(os.path.normpath(model)),
+                                self.disable, senter])
+        self.path = os.path.join(
+                cache_dir, hashlib.sha1(signature.encode()).hexdigest()[:12])
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'pipeline.json'), 'w') as out:
+            out.write(signature)
+        self.indexfile = os.path.join(self.path, 'index.tsv')
+        self.index = {}  # line hash -> (shard number, position in shard)
+        if os.path.exists(self.indexfile):
+            with open(self.indexfile, encoding='utf8') as inp:
+                for line in inp:
+                    key, shard, pos = line.split('\t')
+                    self.index[key] = (int(shard), int(pos))
+        self.nshards = 1 + max((s for s, _ in self.index.values()), default=-1)
+        self._nlp = None
+        self._vocab = None
+        self._loaded = OrderedDict()
+        self.max_loaded = max_loaded
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            self._nlp, _ = spacyconllu.loadmodel(
+                    self.model, self.disable, self.senter)
+        return self._nlp
+
+    @property
+    def vocab(self):
+        # a blank pipeline's vocab is enough to read the cached docs back
+        if self._vocab is None:
+            self._vocab = (self._nlp.vocab if self._nlp is not None
+                           else spacy.blank('en').vocab)
+        return self._vocab
+
+    def __contains__(self, text):
+        return linehash(text) in self.index
+
+    def update(self, texts, batch_size=1000, shard_size=10000, processes=1):
+        """Parse the texts which are not cached yet; returns how many."""
+        todo = OrderedDict()
+        for text in texts:
+            key = linehash(text)
+            if key not in self.index and key not in todo:
+                todo[key] = text
+        if not todo:
+            return 0
+        self._vocab = self.nlp.vocab
+        keys = list(todo)
+        docs = self.nlp.pipe(todo.values(), batch_size=batch_size,
+                             n_process=processes)
+        with open(self.indexfile, 'a', encoding='utf8') as index:
+            for start in range(0, len(keys), shard_size):
+                shard, docbin = self.nshards, DocBin(attrs=ATTRS)
+                for pos, key in enumerate(keys[start:start + shard_size]):
+                    docbin.add(next(docs))
+                    self.index[key] = (shard, pos)
+                    index.write('%s\t%d\t%d\n' % (key, shard, pos))
+                docbin.to_disk(self._shardfile(shard))
+                index.flush()
+                self.nshards += 1
+                print('\rparsed %d/%d new lines' % (
+                        min(start + shard_size, len(keys)), len(keys)),
+                      end='', file=sys.stderr, flush=True)
+        print('', file=sys.stderr)
+        return len(keys)
+
+    def _shardfile(self, shard):
+        return os.path.join(self.path, 'shard%05d.spacy' % shard)
+
+    def _shard(self, shard):
+        """Docs of one shard; the last few shards used are kept in memory."""
+        if shard in self._loaded:
+            self._loaded.move_to_end(shard)
+        else:
+            docbin = DocBin().from_disk(self._shardfile(shard))
+            self._loaded[shard] = list(docbin.get_docs(self.vocab))
+            if len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return self._loaded[shard]
+
+    def docs(self, texts):
+        """Yield the cached parse of every text, in order."""
+        for text in texts:
+            shard, pos = self.index[linehash(text)]
+            yield self._shard(shard)[pos]
+
+
+def readlines(input_file):
+    """Lines as 2spacyconllu.py parses them (with their line break)."""
+    with open(input_file, encoding='utf8') as inp:
+        yield from inp
+
+
+def export(docs, conllu=None, text=None, nouns=None, tagmap=None):
+    """Write CoNLL-U, plain text and noun counts of docs in one pass.
+
+    conllu, text, nouns: output file names, None to skip an output."""
+    outconllu = open(conllu, 'w', encoding='utf8', buffering=1 << 20) if conllu else None
+    outtext = open(text, 'w', encoding='utf8', buffering=1 << 20) if text else None
+    counts = Counter()
+    sentid = 1
+    try:
+        for doc in docs:
+            if outconllu is not None:
+                sentid = spacyconllu.writeconllu(doc, outconllu, sentid, tagmap)
+            for sent in doc.sents:
+                forms = [tok.text for tok in sent if not tok.is_space]
+                if outtext is not None and forms:
+                    outtext.write(' '.join(forms).lower() + '\n')
+                counts.update(tok.text for tok in sent if tok.pos_ == 'NOUN')
+    finally:
+        for out in (outconllu, outtext):
+            if out is not None:
+                out.close()
+    if nouns:
+        with open(nouns, 'w', encoding='utf8') as out:
+            json.dump(dict(counts), out)
+    return counts
+
+
+def main():
+    """CLI"""
+    longopts = ['cache=', 'model=', 'cat-only', 'processes=', 'conllu=',
+                'text=', 'nouns=', 'help']
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], '', longopts)
+    except getopt.GetoptError:
+        print(__doc__)
+        return
+    opts = dict(opts)
+    if '--help' in opts or not args:
+        print(__doc__)
+        return
+    senter = '--cat-only' in opts
+    cache = ParseCache(opts.get('--cache', 'cache/docbin'),
+                       opts.get('--model', 'en_core_web_sm'),
+                       disable=spacyconllu.CAT_DISABLE if senter else ['ner'],
+                       senter=senter)
+    n = cache.update(readlines(args[0]),
+                     processes=int(opts.get('--processes', 1)))
+    print('%d new or changed lines parsed' % n, file=sys.stderr)
+    export(cache.docs(readlines(args[0])), opts.get('--conllu'),
+           opts.get('--text'), opts.get('--nouns'))
+
+
+if __name__ == '__main__':
+    main()
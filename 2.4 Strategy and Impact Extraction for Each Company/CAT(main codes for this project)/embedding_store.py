@@ -0,0 +1,217 @@
+"""Binary, memory-mapped word embedding store.
+
+A text word2vec file (.vec) is converted once into
+    <base>.npy         the (words, dim) float32 or float16 matrix
+    <base>.vocab       one word per line, line n is row n of the matrix
+    <base>.meta.json   dim, dtype, sha1 of the source file...
+The matrix is opened with np.load(mmap_mode='r'), so loading is instant and
+all scoring workers on a machine share one page-cached copy of the vectors.
+The store has the .vectors/.items/.indices/.unk_index attributes of Reach.
+
+Usage: python embedding_store.py embeddings/my_word_vectors_sentence_level.vec
+    [--dtype float16] [--measure]"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def file_sha1(path, block=1 << 24):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """Word vectors in a memory-mapped matrix plus a word -> row index."""
+
+    def __init__(self, vectors, words, unk_word=None, meta=None):
+        self.vectors = vectors
+        self.indices = {i: w for i, w in enumerate(words)}
+        self.items = {w: i for i, w in enumerate(words)}
+        self.unk_index = self.items.get(unk_word) if unk_word is not None else None
+        self.meta = meta or {}
+
+    @property
+    def size(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def paths(base):
+        return base + '.npy', base + '.vocab', base + '.meta.json'
+
+    @classmethod
+    def open(cls, base, unk_word='<UNK>'):
+        """Open a converted store without reading the vectors into memory."""
+        npy, vocab, meta = cls.paths(base)
+        vectors = np.load(npy, mmap_mode='r')
+        with open(vocab, encoding='utf-8') as f:
+            words = f.read().split('\n')[:len(vectors)]
+        with open(meta, encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(vectors, words, unk_word=unk_word, meta=meta)
+
+    @classmethod
+    def write(cls, base, words, fill, dim, dtype='float32', unk_word='<UNK>', meta=None):
+        """Write a store; fill(out) writes the vector of words[i] to out[i].
+
+        As Reach.load does, a zero vector for unk_word is added if the
+        vocabulary does not have it (as the last row, so that the rows of
+        the other words can be written in place)."""
+        words = list(words)
+        add_unk = unk_word is not None and unk_word not in set(words)
+        npy, vocab, meta_path = cls.paths(base)
+        folder = os.path.dirname(base)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        out = np.lib.format.open_memmap(npy + '.part', mode='w+', dtype=dtype,
+                                        shape=(len(words) + add_unk, dim))
+        fill(out)
+        if add_unk:
+            out[-1] = 0
+            words.append(unk_word)
+        out.flush()
+        del out
+        os.replace(npy + '.part', npy)
+        with open(vocab, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(words))
+        meta = dict(meta or {}, dim=dim, dtype=dtype, words=len(words))
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        return cls.open(base, unk_word=unk_word)
+
+    @classmethod
+    def convert_vec(cls, vec_path, base=None, dtype='float32', unk_word='<UNK>'):
+        """Convert a text word2vec file, streaming it line by line."""
+        base = base or os.path.splitext(vec_path)[0]
+        # words first (cheap), so the matrix can be allocated before parsing
+        with open(vec_path, encoding='utf-8') as f:
+            count, dim = map(int, f.readline().split())
+            # the word may itself contain spaces, the numbers never do
+            words = [line.rstrip('\n').rstrip(' ').rsplit(' ', dim)[0] for line in f]
+
+        def fill(out):
+            with open(vec_path, encoding='utf-8') as f:
+                f.readline()
+                for i, line in enumerate(f):
+                    out[i] = line.rstrip('\n').rstrip(' ').rsplit(' ', dim)[1:]
+
+        stat = os.stat(vec_path)
+        return cls.write(base, words, fill, dim, dtype=dtype, unk_word=unk_word,
+                         meta={'source': os.path.abspath(vec_path), 'sha1': file_sha1(vec_path),
+                               'source_size': stat.st_size, 'source_mtime': stat.st_mtime})
+
+    @classmethod
+    def from_keyed_vectors(cls, wv, base, dtype='float32', unk_word='<UNK>', vec_path=None):
+        """Write a store straight from gensim KeyedVectors.
+
+        vec_path: the .vec file saved from the same vectors, if any, so that
+        load_or_convert takes the store as up to date"""
+        meta = {'sha1': hashlib.sha1(np.ascontiguousarray(wv.vectors).tobytes()).hexdigest()}
+        if vec_path is not None:
+            stat = os.stat(vec_path)
+            meta.update(source=os.path.abspath(vec_path), source_size=stat.st_size,
+                        source_mtime=stat.st_mtime)
+
+        def fill(out):
+            out[:len(wv.vectors)] = wv.vectors
+
+        return cls.write(base, wv.index_to_key, fill, wv.vector_size, dtype=dtype,
+                         unk_word=unk_word, meta=meta)
+
+    @classmethod
+    def load_or_convert(cls, vec_path, dtype='float32', unk_word='<UNK>'):
+        """Open the store of a .vec file, converting it the first time (or
+        when the .vec file changed since the conversion)."""
+        base = os.path.splitext(vec_path)[0]
+        meta_path = cls.paths(base)[2]
+        stat = os.stat(vec_path)
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        if (meta.get('source_size'), meta.get('source_mtime')) != (stat.st_size, stat.st_mtime):
+            print('converting %s to a binary store...' % vec_path)
+            return cls.convert_vec(vec_path, base, dtype=dtype, unk_word=unk_word)
+        return cls.open(base, unk_word=unk_word)
+
+
+def drop_page_cache(paths):
+    """Ask the kernel to forget cached pages of the files (cold start)."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _load_once(kind, path):
+    """Load embeddings in this (child) process and print seconds and peak RSS."""
+    start = time.perf_counter()
+    if kind == 'text':
+        try:
+            from reach import Reach
+            r = Reach.load(path, unk_word='<UNK>')
+        except ImportError:
+            # plain text parse, about what Reach.load does
+            with open(path, encoding='utf-8') as f:
+                _, dim = map(int, f.readline().split())
+                r = np.array([line.rstrip().rsplit(' ', dim)[1:] for line in f], dtype=np.float32)
+    else:
+        r = EmbeddingStore.open(path)
+        # touch every page, as scoring a corpus eventually does
+        float(np.asarray(r.vectors, dtype=np.float32).sum())
+    seconds = time.perf_counter() - start
+    print(json.dumps({'seconds': seconds,
+                      'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def measure(vec_path, base):
+    """Cold and warm load time and peak RSS of the text file and the store,
+    each measured in a fresh process."""
+    results = {}
+    for kind, path, files in (('text', vec_path, [vec_path]),
+                              ('store', base, list(EmbeddingStore.paths(base)))):
+        for cache in ('cold', 'warm'):
+            if cache == 'cold':
+                drop_page_cache(files)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--load-once', kind, path],
+                                 capture_output=True, text=True, check=True).stdout
+            results[(kind, cache)] = json.loads(out.strip().splitlines()[-1])
+            print('%5s %4s: %7.2fs, peak RSS %7.0f MB' % (kind, cache, results[(kind, cache)]['seconds'],
+                                                           results[(kind, cache)]['rss_mb']))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a .vec file to a memory-mapped store')
+    parser.add_argument('vec', nargs='?', help='text word2vec file')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'], help='dtype of the stored matrix')
+    parser.add_argument('--measure', action='store_true', help='compare load time and memory with the text file')
+    parser.add_argument('--load-once', nargs=2, metavar=('KIND', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_once:
+        _load_once(*args.load_once)
+        sys.exit()
+    if args.vec is None:
+        parser.error('the .vec file is required')
+
+    base = os.path.splitext(args.vec)[0]
+    store = EmbeddingStore.convert_vec(args.vec, base, dtype=args.dtype)
+    print('%d words, %d dimensions, %s' % (len(store), store.size, args.dtype))
+    if args.measure:
+        measure(args.vec, base)
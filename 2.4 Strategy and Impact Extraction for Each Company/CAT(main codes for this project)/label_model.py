@@ -0,0 +1,140 @@
+"""Saved label model for CAT scoring.
+
+A label model bundles everything 4run.py derives from the embeddings before
+scoring the first sentence: the aspect vectors, the unit length label vectors,
+their cosine similarity, the RBF kernel of every vocabulary word and the
+config (gamma, number of aspect words, labels). It is stored as an .npz file
+under cache/label_models, named by a hash of the embeddings, the aspects, the
+labels and gamma, so a change of any of them builds a new model and every run
+or worker with the same inputs reuses the same file.
+
+Usage: python label_model.py [--config config/cat_labels.json]
+    [--embeddings embeddings/my_word_vectors_sentence_level.vec]"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cat_scoring import ScoringEngine, normalize
+
+CONFIG = 'config/cat_labels.json'
+CACHE_DIR = 'cache/label_models'
+
+
+def load_config(path=CONFIG):
+    """Config dict of the CAT scoring, with the aspect word list loaded.
+
+    aspects: the first n_aspect_words aspect words, each as a one word list"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    with open(config['aspect_words'], encoding='utf-8') as f:
+        config['aspects'] = [[x] for x in json.load(f)][:config['n_aspect_words']]
+    return config
+
+
+def embeddings_hash(r):
+    """Content hash of word embeddings: the sha1 recorded by EmbeddingStore,
+    otherwise a hash of the vectors and the vocabulary."""
+    meta = getattr(r, 'meta', None) or {}
+    if 'sha1' in meta:
+        return meta['sha1']
+    digest = hashlib.sha1(np.ascontiguousarray(r.vectors).tobytes())
+    digest.update('\n'.join(sorted(r.items, key=r.items.get)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def model_key(embedding_hash, aspects, labels, gamma):
+    signature = json.dumps([embedding_hash, aspects, labels, gamma])
+    return hashlib.sha1(signature.encode('utf-8')).hexdigest()[:16]
+
+
+class LabelModel:
+    """Aspect and label matrices of one embedding / label set combination
+
+    aspect_vecs: (A, D) mean vector of every aspect (not normalized, the RBF
+        attention uses the raw distances)
+    label_vecs: (K, D) unit length label vectors
+    similarity: (A, K) cosine similarity of every aspect with every label
+    word_kernel: (V,) summed RBF similarity of every vocabulary word to the aspects"""
+
+    def __init__(self, aspects, labels, gamma, aspect_vecs, label_vecs, similarity,
+                 word_kernel, key=None):
+        self.aspects = aspects
+        self.labels = labels
+        self.gamma = gamma
+        self.aspect_vecs = aspect_vecs
+        self.label_vecs = label_vecs
+        self.similarity = similarity
+        self.word_kernel = word_kernel
+        self.key = key
+
+    @classmethod
+    def build(cls, r, aspects, labels, gamma, key=None):
+        engine = ScoringEngine.from_reach(r, aspects, labels, gamma)
+        similarity = normalize(engine.aspect_vecs) @ engine.label_vecs.T
+        return cls(aspects, labels, gamma, engine.aspect_vecs, engine.label_vecs,
+                   similarity, engine.word_kernel(), key=key)
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        config = json.dumps({'aspects': self.aspects, 'labels': self.labels,
+                             'gamma': self.gamma, 'key': self.key})
+        # write then rename, so a worker never reads a half written model
+        with open(path + '.part', 'wb') as f:
+            np.savez(f, aspect_vecs=self.aspect_vecs, label_vecs=self.label_vecs,
+                     similarity=self.similarity, word_kernel=self.word_kernel,
+                     config=np.array(config))
+        os.replace(path + '.part', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            config = json.loads(str(data['config']))
+            return cls(config['aspects'], config['labels'], config['gamma'],
+                       data['aspect_vecs'], data['label_vecs'], data['similarity'],
+                       data['word_kernel'], key=config['key'])
+
+    @classmethod
+    def load_or_build(cls, r, aspects, labels, gamma, cache_dir=CACHE_DIR):
+        """The cached model of these embeddings and labels, built on first use."""
+        key = model_key(embeddings_hash(r), aspects, labels, gamma)
+        path = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(path):
+            return cls.load(path)
+        print('building label model %s...' % key)
+        model = cls.build(r, aspects, labels, gamma, key=key)
+        model.save(path)
+        return model
+
+    def engine(self, r, **kwargs):
+        """ScoringEngine over the embeddings r, nothing left to precompute."""
+        unk_index = getattr(r, 'unk_index', None)
+        if unk_index is None:
+            unk_index = r.items.get('<UNK>')
+        return ScoringEngine(r.vectors, r.items, self.aspect_vecs, self.label_vecs, self.gamma,
+                             unk_index=unk_index, word_kernel=self.word_kernel, **kwargs)
+
+
+if __name__ == '__main__':
+    from embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description='Build (or show) the cached label model')
+    parser.add_argument('--config', default=CONFIG, help='label config json')
+    parser.add_argument('--embeddings', default='embeddings/my_word_vectors_sentence_level.vec',
+                        help='word2vec text file')
+    parser.add_argument('--cache', default=CACHE_DIR, help='label model folder')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    r = EmbeddingStore.load_or_convert(args.embeddings, unk_word='<UNK>')
+    model = LabelModel.load_or_build(r, config['aspects'], config['labels'],
+                                     config['gamma'], args.cache)
+    print('label model %s: %d aspects, %d labels, %d words' % (
+        model.key, len(model.aspects), len(model.labels), len(model.word_kernel)))
+    best = model.similarity.argmax(0)
+    for label, aspect, sim in zip(model.labels, best, model.similarity.max(0)):
+        print('%-40s %-20s %.3f' % (label, ' '.join(model.aspects[aspect]), sim))
@@ -0,0 +1,81 @@
+"""Typed, columnar output of the CAT scorer.
+
+One Parquet row per sentence:
+    sentence_id   int64, line number of the sentence in the input (from 0)
+    sentence      string
+    path          string, filing the sentence comes from (mapping file)
+    accession     string, accession number (adsh) of the filing
+    cik           int64
+    label_1..k    dictionary string, the k best labels, null below the threshold
+    score_1..k    float32, their scores
+Every row carries its own sentence id and filing, so nothing depends on the
+positional alignment of separate text files."""
+import json
+import os
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '1. Data Collection'))
+from cik_index import accession_from_path, cik_from_path
+
+
+def read_mapping(path):
+    """Filing path of every sentence line, from a mapping file with one
+    line per sentence (the path first, tab separated fields after it)."""
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip('\n').split('\t')[0] for line in f]
+
+
+def schema(k):
+    fields = [pa.field('sentence_id', pa.int64()), pa.field('sentence', pa.string()),
+              pa.field('path', pa.string()), pa.field('accession', pa.string()),
+              pa.field('cik', pa.int64())]
+    fields += [pa.field('label_%d' % (i + 1), pa.dictionary(pa.int16(), pa.string())) for i in range(k)]
+    fields += [pa.field('score_%d' % (i + 1), pa.float32()) for i in range(k)]
+    return pa.schema(fields)
+
+
+class PredictionWriter:
+    """Writes the top-k predictions chunk by chunk into one Parquet file."""
+
+    def __init__(self, path, labels, k, threshold, metadata=None):
+        self.labels = pa.array(labels, pa.string())
+        self.k = k
+        self.threshold = threshold
+        meta = dict(metadata or {}, labels=list(labels), threshold=threshold)
+        self.schema = schema(k).with_metadata({'cat': json.dumps(meta)})
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, start, sentences, label_idx, label_scores, paths=None):
+        """sentences start:start + n with their (n, k) top-k label indices and scores
+
+        paths: filing path of every sentence, None if unknown"""
+        n = len(sentences)
+        paths = paths if paths is not None else [None] * n
+        columns = [pa.array(np.arange(start, start + n, dtype=np.int64)),
+                   pa.array(sentences, pa.string()),
+                   pa.array(paths, pa.string()),
+                   pa.array([accession_from_path(p) if p else None for p in paths], pa.string()),
+                   pa.array([cik_from_path(p) if p else None for p in paths], pa.int64())]
+        below = label_scores <= self.threshold
+        for i in range(self.k):
+            indices = pa.array(label_idx[:, i].astype(np.int16), mask=below[:, i])
+            columns.append(pa.DictionaryArray.from_arrays(indices, self.labels))
+        for i in range(self.k):
+            columns.append(pa.array(label_scores[:, i].astype(np.float32)))
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+"""Load test of scoring_server.py.
+
+Usage: python scoring_loadtest.py [--url http://127.0.0.1:8765] [--sentences 10K/sentence.txt]
+    [--clients 16] [--requests 2000] [--batch 4]
+Every client thread keeps one connection and posts --batch sentences per
+request (lines of the sentence file, or synthetic ones without it) until
+--requests have been sent in total. Reports the client side throughput and
+latency percentiles and the server metrics (batch sizes, server latency)."""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+
+def load_sentences(path, limit=100000):
+    sentences = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                sentences.append(line.strip())
+            if len(sentences) >= limit:
+                break
+    return sentences
+
+
+def synthetic_sentences(n=1000, seed=0):
+    words = ('the company covid pandemic demand supply chain reduce costs remote working employees '
+             'liquidity revenue decline store closures travel restrictions impact operations').split()
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(5, 30))) for _ in range(n)]
+
+
+def get(url, path):
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    connection.request('GET', path)
+    return json.loads(connection.getresponse().read())
+
+
+def client(url, sentences, batch, counter, lock, latencies, errors, seed):
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port)
+    rng = random.Random(seed)
+    while True:
+        with lock:
+            if counter[0] <= 0:
+                break
+            counter[0] -= 1
+        body = json.dumps({'sentences': rng.sample(sentences, batch)})
+        start = time.perf_counter()
+        try:
+            connection.request('POST', '/score', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port)
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(1)
+    connection.close()
+
+
+def run(url, sentences, clients=16, requests=2000, batch=4):
+    counter, lock = [requests], threading.Lock()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(url, sentences, batch, counter, lock, latencies, errors, i))
+               for i in range(clients)]
+    begin = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - begin
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'errors': len(errors), 'seconds': round(elapsed, 2),
+            'requests_per_s': round(len(latencies) / elapsed, 1),
+            'sentences_per_s': round(len(latencies) * batch / elapsed, 1),
+            'latency_ms': {'p%d' % p: round(float(np.percentile(latencies, p)), 2) for p in (50, 90, 95, 99)}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the CAT scoring server')
+    parser.add_argument('--url', default='http://127.0.0.1:8765', help='server address')
+    parser.add_argument('--sentences', help='file with one sentence per line, default synthetic sentences')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='requests in total')
+    parser.add_argument('--batch', type=int, default=4, help='sentences per request')
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.sentences) if args.sentences else synthetic_sentences()
+    print('client:', json.dumps(run(args.url, sentences, args.clients, args.requests, args.batch), indent=2))
+    print('server:', json.dumps(get(args.url, '/metrics'), indent=2))
@@ -0,0 +1,274 @@
+"""Long-running CAT scoring server.
+
+Usage: python scoring_server.py [--port 8765] [--config config/cat_labels.json]
+    [--embeddings embeddings/my_word_vectors_sentence_level.vec]
+    [--max-batch 512] [--max-wait-ms 5]
+The embeddings and the label model are loaded once (the same ones as 4run.py),
+then requests are answered over HTTP on localhost:
+
+    POST /score    {"sentences": ["the pandemic reduced demand", ...]}
+                   -> {"predictions": [{"labels": [...], "scores": [[label, score], ...]}, ...]}
+    GET  /metrics  request latency percentiles, batch sizes, counters
+    GET  /health
+
+Sentences are tokenized like the lines of sentence.txt (split on white space).
+"scores" has the N_TOPICS best labels of a sentence, best first; "labels" only
+those above the threshold, as in prediction_Sentence(3).txt. Concurrent
+requests are coalesced by one scoring thread into a micro-batch, encoded and
+scored together with ScoringEngine: a batch is closed when it has max-batch
+sentences or max-wait-ms after its first request. The load test client is
+scoring_loadtest.py."""
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from cat_scoring import top_k
+from label_model import CONFIG, LabelModel, load_config
+
+EMBEDDINGS = 'embeddings/my_word_vectors_sentence_level.vec'
+
+
+class Metrics:
+    """Latencies and batch sizes of the last `window` requests and batches,
+    and counters since the start."""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sentences = collections.deque(maxlen=window)
+        self.batch_requests = collections.deque(maxlen=window)
+        self.counts = collections.Counter()
+
+    def request(self, seconds, n_sentences, error=False):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.counts['requests'] += 1
+            self.counts['sentences'] += n_sentences
+            self.counts['errors'] += int(error)
+
+    def batch(self, n_requests, n_sentences, seconds):
+        with self.lock:
+            self.batch_requests.append(n_requests)
+            self.batch_sentences.append(n_sentences)
+            self.counts['batches'] += 1
+            self.counts['scoring_seconds'] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            sentences = np.array(self.batch_sentences)
+            requests = np.array(self.batch_requests)
+            counts = dict(self.counts)
+        uptime = time.time() - self.started
+        result = {'uptime_s': round(uptime, 1), 'counts': counts,
+                  'requests_per_s': round(counts.get('requests', 0) / uptime, 2)}
+        if len(latencies):
+            result['latency_ms'] = {'p%d' % p: round(float(np.percentile(latencies, p)), 3)
+                                    for p in (50, 90, 95, 99)}
+            result['latency_ms']['max'] = round(float(latencies.max()), 3)
+        if len(sentences):
+            result['batch_sentences'] = {'mean': round(float(sentences.mean()), 2), 'max': int(sentences.max()),
+                                         'p50': float(np.percentile(sentences, 50))}
+            result['batch_requests'] = {'mean': round(float(requests.mean()), 2), 'max': int(requests.max())}
+        return result
+
+
+class Pending:
+    """A request waiting in the batcher queue."""
+
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Collects the sentences of concurrent requests and scores them together
+    on one thread; score(list of sentences) returns one result per sentence."""
+
+    def __init__(self, score, metrics, max_batch=512, max_wait=0.005):
+        self.score = score
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, sentences):
+        """Results of the sentences, blocks until their batch is scored."""
+        pending = Pending(sentences)
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        size = len(batch[0].sentences)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                pending = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.sentences)
+        return batch
+
+    def run(self, batch):
+        """Score the requests of a batch together; raises if the scoring fails."""
+        sentences = [s for pending in batch for s in pending.sentences]
+        start = time.perf_counter()
+        results = self.score(sentences)
+        self.metrics.batch(len(batch), len(sentences), time.perf_counter() - start)
+        offset = 0
+        for pending in batch:
+            pending.result = results[offset:offset + len(pending.sentences)]
+            offset += len(pending.sentences)
+            pending.done.set()
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.run(batch)
+            except Exception:
+                # one bad request must not fail the others: score them one at a time
+                for pending in batch:
+                    try:
+                        self.run([pending])
+                    except Exception as e:
+                        pending.error = e
+                        pending.done.set()
+
+
+class ScoringService:
+    """The engine of a label model, warm, and the JSON form of its results."""
+
+    def __init__(self, r, model, k, threshold):
+        self.labels = model.labels
+        self.k = k
+        self.threshold = threshold
+        self.key = model.key
+        self.engine = model.engine(r)
+        # computed now rather than by the first request
+        self.engine.word_kernel()
+
+    @classmethod
+    def from_config(cls, config_path=CONFIG, embeddings=EMBEDDINGS):
+        from embedding_store import EmbeddingStore
+        config = load_config(config_path)
+        r = EmbeddingStore.load_or_convert(embeddings, unk_word='<UNK>')
+        model = LabelModel.load_or_build(r, config['aspects'], config['labels'], config['gamma'])
+        return cls(r, model, config['n_topics'], config['threshold'])
+
+    def score(self, sentences):
+        scores = self.engine.scores(self.engine.encode(sentences))
+        idx, vals = top_k(scores, self.k)
+        results = []
+        for label_indices, label_scores in zip(idx, vals):
+            results.append({'labels': [self.labels[i] for i, s in zip(label_indices, label_scores) if s > self.threshold],
+                            'scores': [[self.labels[i], round(float(s), 6)] for i, s in zip(label_indices, label_scores)]})
+        return results
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keep-alive, so a client reuses its connection; without Nagle the
+    # separately written headers and body do not wait for a delayed ack
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    batcher = None
+    metrics = None
+    info = {}
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.reply(200, dict(self.metrics.snapshot(), **self.info))
+        elif self.path == '/health':
+            self.reply(200, {'status': 'ok'})
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self.reply(404, {'error': 'not found'})
+            return
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            sentences = request.get('sentences')
+            if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+                raise ValueError('sentences must be a list of strings')
+        except (ValueError, AttributeError) as e:
+            self.metrics.request(time.perf_counter() - start, 0, error=True)
+            self.reply(400, {'error': str(e)})
+            return
+        try:
+            predictions = self.batcher.submit(sentences) if sentences else []
+        except Exception as e:
+            self.metrics.request(time.perf_counter() - start, len(sentences), error=True)
+            self.reply(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+        self.metrics.request(time.perf_counter() - start, len(sentences))
+        self.reply(200, {'predictions': predictions})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    # socketserver listens with a backlog of 5, which resets connections when
+    # many clients connect at once (scoring_loadtest.py opens 16)
+    request_queue_size = 128
+
+
+def serve(service, host='127.0.0.1', port=8765, max_batch=512, max_wait=0.005):
+    metrics = Metrics()
+    Handler.metrics = metrics
+    Handler.batcher = MicroBatcher(service.score, metrics, max_batch, max_wait)
+    Handler.info = {'label_model': service.key, 'max_batch': max_batch, 'max_wait_ms': max_wait * 1000}
+    server = ScoringHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CAT scoring server')
+    parser.add_argument('--config', default=CONFIG, help='label config')
+    parser.add_argument('--embeddings', default=EMBEDDINGS, help='word vectors (.vec, converted on first use)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--max-batch', type=int, default=512, help='sentences per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=5, help='wait for more requests after the first of a batch')
+    args = parser.parse_args()
+
+    begin = time.perf_counter()
+    service = ScoringService.from_config(args.config, args.embeddings)
+    print('label model %s loaded in %.1fs' % (service.key, time.perf_counter() - begin))
+    server = serve(service, args.host, args.port, args.max_batch, args.max_wait_ms / 1000)
+    print('listening on http://%s:%d' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
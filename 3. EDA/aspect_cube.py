@@ -0,0 +1,179 @@
+"""Pre-aggregated aspect counts for the measures/impacts EDA.
+
+Usage:
+    python aspect_cube.py ingest sentence_company.parquet [more files] [--year 2020]
+    python aspect_cube.py top --category impact [--subdomain "..."] [-n 10]
+    python aspect_cube.py subdomains [-n 6]
+The cube has one row per company x sub-domain x year x aspect, with the number
+of sentences predicted with that aspect; aspects are mapped to their canonical
+name and tagged measure/impact with aspect_taxonomy.json. Every ingested
+prediction file becomes a partial cube in <cube>/parts, keyed by the file name,
+and the parts are summed into <cube>/cube.parquet; ingesting a file again
+replaces its part, so new predictions are added without rescanning the old
+ones. Inputs are the joined Parquet of company_join.py (label_1, label_2...)
+or a sentence_level_cluster csv (aspect1, aspect2...)."""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+TAXONOMY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aspect_taxonomy.json')
+KEYS = ['company name', 'sub-domain', 'year', 'aspect']
+
+
+def load_taxonomy(path=TAXONOMY):
+    """(synonym -> canonical aspect, canonical aspect -> category)"""
+    with open(path, encoding='utf-8') as f:
+        taxonomy = json.load(f)
+    synonyms = taxonomy['synonyms']
+    categories = {}
+    for category, aspects in taxonomy['categories'].items():
+        for aspect in aspects:
+            categories[synonyms.get(aspect, aspect)] = category
+    return synonyms, categories
+
+
+def read_predictions(path):
+    """Sentence level predictions as (company name, sub-domain, year, aspect
+    columns), from Parquet or csv; only the needed columns are read."""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        names = pq.read_schema(path).names
+    else:
+        names = pd.read_csv(path, nrows=0).columns.tolist()
+    aspects = [c for c in names if re.fullmatch(r'(label_|aspect)\d+', c)]
+    subdomain = next((c for c in ('sub-domain', 'sub domain', 'subdomain') if c in names), None)
+    columns = ['company name'] + aspects + [c for c in (subdomain, 'fy') if c and c in names]
+    if path.endswith('.parquet'):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns)
+    return df.rename(columns={subdomain: 'sub-domain'} if subdomain else {}), aspects
+
+
+def partial_cube(path, year=None, taxonomy=TAXONOMY):
+    """Aspect counts of one prediction file."""
+    synonyms, categories = load_taxonomy(taxonomy)
+    df, aspects = read_predictions(path)
+    if year is not None:
+        df['year'] = int(year)
+    elif 'fy' in df:
+        df['year'] = df['fy']
+    else:
+        found = re.search(r'(?:19|20)\d\d', os.path.basename(path))
+        if not found:
+            raise ValueError('no year for %s, use --year' % path)
+        df['year'] = int(found.group())
+    if 'sub-domain' not in df:
+        df['sub-domain'] = None
+    # one long column of aspects instead of concatenating aspect1, aspect2...
+    long = df.melt(id_vars=['company name', 'sub-domain', 'year'], value_vars=aspects,
+                   value_name='aspect').dropna(subset=['aspect'])
+    long['aspect'] = long['aspect'].astype(str).replace(synonyms)
+    cube = (long.groupby(KEYS, dropna=False, observed=True).size().rename('n_sentences').reset_index())
+    cube['category'] = cube['aspect'].map(categories)
+    return cube
+
+
+class AspectCube:
+    """Partial cubes of ingested files, summed into one small table."""
+
+    def __init__(self, folder='./cube', taxonomy=TAXONOMY):
+        self.folder = folder
+        self.taxonomy = taxonomy
+        self.parts = os.path.join(folder, 'parts')
+        os.makedirs(self.parts, exist_ok=True)
+        self.path = os.path.join(folder, 'cube.parquet')
+        self.manifest_path = os.path.join(folder, 'manifest.json')
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+    def _part(self, source):
+        key = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.parts, key + '.parquet')
+
+    def ingest(self, sources, year=None):
+        """Add (or replace) the partial cubes of the source files which are new
+        or changed since they were ingested; returns how many were ingested."""
+        n = 0
+        for source in sources:
+            stat = os.stat(source)
+            signature = [stat.st_size, stat.st_mtime, year]
+            if self.manifest.get(os.path.abspath(source)) == signature:
+                continue
+            part = partial_cube(source, year, self.taxonomy)
+            part.to_parquet(self._part(source), index=False)
+            self.manifest[os.path.abspath(source)] = signature
+            print('%s: %d cube rows' % (source, len(part)))
+            n += 1
+        if n:
+            self.rebuild()
+            with open(self.manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, indent=2)
+        return n
+
+    def rebuild(self):
+        """Sum the partial cubes; they are small, so this is cheap."""
+        parts = [pd.read_parquet(p) for p in sorted(glob.glob(os.path.join(self.parts, '*.parquet')))]
+        cube = pd.concat(parts, ignore_index=True)
+        cube = (cube.groupby(KEYS + ['category'], dropna=False).n_sentences.sum().reset_index())
+        cube.to_parquet(self.path, index=False)
+
+    def table(self, category=None, subdomains=None):
+        filters = []
+        if category is not None:
+            filters.append(('category', '==', category))
+        if subdomains is not None:
+            filters.append(('sub-domain', 'in', list(subdomains)))
+        return pd.read_parquet(self.path, filters=filters or None)
+
+
+def aspect_counts(cube):
+    """Number of companies with each aspect, most frequent first (the
+    notebook's value_counts after drop_duplicates)."""
+    counts = cube.drop_duplicates(['company name', 'sub-domain', 'aspect'])['aspect'].value_counts()
+    return counts.rename_axis('aspect').reset_index(name='counts')
+
+
+def top_subdomains(cube, n=6):
+    """Sub-domains with the most (company, aspect) pairs."""
+    pairs = cube.drop_duplicates(['company name', 'sub-domain', 'aspect'])
+    counts = pairs['sub-domain'].value_counts().rename_axis('subdomain').reset_index(name='counts')
+    return counts.head(n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregated aspect counts of the predictions')
+    parser.add_argument('--cube', default='./cube', help='cube folder')
+    parser.add_argument('--taxonomy', default=TAXONOMY, help='synonym map and category table')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('ingest', help='add prediction files to the cube')
+    p.add_argument('files', nargs='+', help='joined Parquet or sentence_level_cluster csv files')
+    p.add_argument('--year', type=int, help='year of the filings, default fy column or file name')
+    p = commands.add_parser('top', help='most frequent aspects')
+    p.add_argument('--category', choices=['impact', 'measure'], help='aspect category')
+    p.add_argument('--subdomain', nargs='*', help='only these sub-domains')
+    p.add_argument('--year', type=int, help='only this year')
+    p.add_argument('-n', type=int, default=10, help='rows shown')
+    p = commands.add_parser('subdomains', help='sub-domains with the most aspects')
+    p.add_argument('-n', type=int, default=6, help='rows shown')
+    args = parser.parse_args()
+
+    cube = AspectCube(args.cube, args.taxonomy)
+    if args.command == 'ingest':
+        print('%d files ingested' % cube.ingest(args.files, args.year))
+    elif args.command == 'top':
+        table = cube.table(args.category, args.subdomain)
+        if args.year is not None:
+            table = table[table['year'] == args.year]
+        counts = aspect_counts(table)
+        print(counts.head(args.n).to_string(index=False))
+        print('aspect_units:', len(counts))
+    else:
+        print(top_subdomains(cube.table(), args.n).to_string(index=False))
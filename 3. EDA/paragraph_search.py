@@ -0,0 +1,325 @@
+"""Full-text and label search over the extracted paragraphs and sentences.
+
+Usage:
+    python paragraph_search.py ingest ../paragraphs/10K_2020.parquet scrape_results/items
+        ../CAT/data/sentence_company.parquet [--index ./search.sqlite]
+    python paragraph_search.py companies 10K_2020_csv.csv (or a cik_index folder)
+    python paragraph_search.py search "supplier disruption" --year 2020 --section "Item 1A" [-n 20]
+        [--label "disruptions supply"] [--company "PEPSICO INC"] [--subdomain ...] [--out hits.parquet]
+    python paragraph_search.py facets "supplier disruption" --by company --year 2020 --section "Item 1A"
+One SQLite file holds every passage (kind paragraph, section or sentence) with
+its filing, cik, year and section, an FTS5 index of the passages (porter
+stemmed, ranked by BM25), the CAT labels of the sentences and a company table
+(company name, sub-domain) keyed by accession, so searches combine text,
+labels and facets in one query. Inputs are recognized by their columns: the
+paragraph Parquet of covid_paragraphs.py (para_keywords), the item Parquet
+dataset of batch_scrape.py (Item ... columns) and the sentence predictions of
+4run.py / company_join.py (sentence, label_1...). Every file is a source:
+ingesting it again after it changed replaces its passages, unchanged files
+are skipped, so new filings are added without rebuilding the index. Results
+are written as Parquet or csv, not Excel."""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1. Data Collection'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2.2 Extract COVID-related Paragraphs from 10K.'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '2.4 Strategy and Impact Extraction for Each Company',
+                             'CAT(main codes for this project)'))
+from cik_index import accession_from_path, cik_from_path
+from paragraph_diff import split_paragraphs
+
+INDEX = './search.sqlite'
+# longer lines of a scraped section are cut into passages of about this many characters
+PASSAGE_CHARS = 1000
+FTS_OPERATORS = re.compile(r'"|\*|\b(?:AND|OR|NOT|NEAR)\b')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY, source TEXT, kind TEXT, path TEXT, accession TEXT, cik INTEGER,
+    year INTEGER, section TEXT, position INTEGER, text TEXT);
+CREATE INDEX IF NOT EXISTS passages_source ON passages (source);
+CREATE INDEX IF NOT EXISTS passages_facets ON passages (year, section, kind);
+CREATE INDEX IF NOT EXISTS passages_accession ON passages (accession);
+CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5 (
+    text, content='passages', content_rowid='id', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS passages_insert AFTER INSERT ON passages BEGIN
+    INSERT INTO passages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS passages_delete AFTER DELETE ON passages BEGIN
+    INSERT INTO passages_fts (passages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TABLE IF NOT EXISTS labels (passage INTEGER, label TEXT, score REAL, rank INTEGER);
+CREATE INDEX IF NOT EXISTS labels_label ON labels (label, passage);
+CREATE INDEX IF NOT EXISTS labels_passage ON labels (passage);
+CREATE TABLE IF NOT EXISTS companies (accession TEXT PRIMARY KEY, company TEXT, subdomain TEXT);
+CREATE INDEX IF NOT EXISTS companies_company ON companies (company);
+CREATE INDEX IF NOT EXISTS companies_subdomain ON companies (subdomain);
+CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, passages INTEGER);
+"""
+
+
+def year_of(accession):
+    """Filing year of an accession number like 0000320193-20-000096"""
+    try:
+        return 2000 + int(accession.split('-')[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def passages(text, size=PASSAGE_CHARS):
+    """Non-empty lines of a section, long lines cut at sentence ends into
+    passages of about size characters."""
+    for line in text.split('\n'):
+        line = line.strip()
+        if len(line) <= size:
+            if line:
+                yield line
+            continue
+        current = ''
+        for sentence in re.split(r'(?<=[.!?])\s+', line):
+            if current and len(current) + len(sentence) > size:
+                yield current
+                current = ''
+            current = (current + ' ' + sentence).strip()
+        if current:
+            yield current
+
+
+def fts_query(query):
+    """FTS5 query of a search string: kept as it is when it uses the FTS5
+    syntax (quotes, AND/OR/NOT/NEAR, prefix *), otherwise every word is
+    quoted, so words like covid-19 are not read as operators."""
+    if FTS_OPERATORS.search(query):
+        return query
+    return ' '.join('"%s"' % word for word in re.findall(r'\w+', query))
+
+
+def source_files(paths):
+    """Parquet files of the arguments, the files of a dataset folder one by one"""
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, dirs, names in os.walk(path):
+                dirs.sort()
+                yield from (os.path.join(folder, n) for n in sorted(names) if n.endswith('.parquet'))
+        else:
+            yield path
+
+
+def subdomain_column(names):
+    return next((c for c in ('sub-domain', 'sub domain', 'subdomain') if c in names), None)
+
+
+class SearchIndex:
+    """Passages, their FTS5 index, labels and companies in one SQLite file."""
+
+    def __init__(self, path=INDEX):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def _rows(self, path):
+        """(passage rows, labels as (row number, label, score, rank), company rows) of a file"""
+        names = pq.read_schema(path).names
+        rows, labels, companies = [], [], []
+        if 'para_keywords' in names:
+            data = pd.read_parquet(path, columns=['path', 'para_keywords'])
+            for filing, para_keywords in zip(data['path'], data['para_keywords']):
+                accession = accession_from_path(filing)
+                for position, text in enumerate(split_paragraphs(para_keywords)):
+                    rows.append(('paragraph', filing, accession, cik_from_path(filing), year_of(accession),
+                                 'covid', position, text.strip()))
+        elif 'sentence' in names:
+            k = len([c for c in names if re.fullmatch(r'label_\d+', c)])
+            subdomain = subdomain_column(names)
+            columns = [c for c in ['sentence', 'path', 'accession', 'company name', subdomain] if c and c in names]
+            data = pd.read_parquet(path, columns=columns + ['label_%d' % (i + 1) for i in range(k)]
+                                   + ['score_%d' % (i + 1) for i in range(k)])
+            for i in range(k):
+                kept = data['label_%d' % (i + 1)].notna().to_numpy()
+                labels += [(row, str(label), float(score), i + 1) for row, label, score in zip(
+                    kept.nonzero()[0], data['label_%d' % (i + 1)][kept], data['score_%d' % (i + 1)][kept])]
+            filings = data['path'] if 'path' in data else [None] * len(data)
+            accessions = data['accession'] if 'accession' in data else [accession_from_path(p) if p else None
+                                                                          for p in filings]
+            for position, (filing, accession, text) in enumerate(zip(filings, accessions, data['sentence'])):
+                rows.append(('sentence', filing, accession, cik_from_path(filing) if filing else None,
+                             year_of(accession), 'sentence', position, text))
+            if 'company name' in data:
+                frame = pd.DataFrame({'accession': accessions, 'company': data['company name'],
+                                      'subdomain': data[subdomain] if subdomain else None})
+                frame = frame.dropna(subset=['accession', 'company']).drop_duplicates('accession')
+                companies = list(frame.itertuples(index=False, name=None))
+        else:
+            sections = [c for c in names if c.startswith('Item ')]
+            if not sections:
+                raise ValueError('%s has no paragraph, section or sentence columns' % path)
+            data = pd.read_parquet(path, columns=['path', 'accession'] + sections)
+            for filing, accession, *texts in data[['path', 'accession'] + sections].itertuples(index=False):
+                for section, text in zip(sections, texts):
+                    if not isinstance(text, str):
+                        continue
+                    # 'Item 1A to Item 1B' -> 'Item 1A'
+                    name = section.split(' to ')[0]
+                    for position, passage in enumerate(passages(text)):
+                        rows.append(('section', filing, accession, cik_from_path(filing), year_of(accession),
+                                     name, position, passage))
+        return rows, labels, companies
+
+    def ingest(self, paths):
+        """Add (or replace) the passages of the files which are new or changed
+        since they were ingested; returns the number of files ingested."""
+        n = 0
+        for path in source_files(paths):
+            source = os.path.abspath(path)
+            stat = os.stat(path)
+            known = self.db.execute('SELECT size, mtime FROM sources WHERE source = ?', (source,)).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                continue
+            start = time.perf_counter()
+            rows, labels, companies = self._rows(path)
+            with self.db:
+                self.db.execute('DELETE FROM labels WHERE passage IN (SELECT id FROM passages WHERE source = ?)',
+                                (source,))
+                self.db.execute('DELETE FROM passages WHERE source = ?', (source,))
+                first, = self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM passages').fetchone()
+                self.db.executemany(
+                    'INSERT INTO passages (id, source, kind, path, accession, cik, year, section, position, text) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    ((first + i, source) + row for i, row in enumerate(rows)))
+                self.db.executemany('INSERT INTO labels VALUES (?, ?, ?, ?)',
+                                    ((first + int(row), label, score, rank) for row, label, score, rank in labels))
+                self.db.executemany('INSERT OR REPLACE INTO companies VALUES (?, ?, ?)', companies)
+                self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                                (source, stat.st_size, stat.st_mtime, len(rows)))
+            print('%s: %d passages, %d labels (%.1fs)' % (path, len(rows), len(labels), time.perf_counter() - start))
+            n += 1
+        return n
+
+    def add_companies(self, source):
+        """Company name and sub-domain of the filings, from a 10K_<year>_csv.csv
+        file or a cik_index folder (company_join.load_companies)."""
+        from company_join import load_companies
+        frame = load_companies(source).to_pandas()
+        subdomain = subdomain_column(frame.columns)
+        rows = zip(frame['accession'], frame['company name'],
+                   frame[subdomain] if subdomain else [None] * len(frame))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO companies VALUES (?, ?, ?)', rows)
+        return len(frame)
+
+    def optimize(self):
+        with self.db:
+            self.db.execute("INSERT INTO passages_fts (passages_fts) VALUES ('optimize')")
+
+    def _where(self, query=None, labels=None, company=None, subdomain=None, year=None, section=None, kind=None):
+        conditions, params = [], []
+        if query:
+            conditions.append('passages_fts MATCH ?')
+            params.append(fts_query(query))
+        for column, values in (('p.year', year), ('p.section', section), ('p.kind', kind),
+                               ('c.company', company), ('c.subdomain', subdomain)):
+            if values:
+                values = values if isinstance(values, (list, tuple)) else [values]
+                conditions.append('%s IN (%s)' % (column, ','.join('?' * len(values))))
+                params += list(values)
+        if labels:
+            labels = labels if isinstance(labels, (list, tuple)) else [labels]
+            conditions.append('p.id IN (SELECT passage FROM labels WHERE label IN (%s))' % ','.join('?' * len(labels)))
+            params += list(labels)
+        source = ('passages_fts JOIN passages p ON p.id = passages_fts.rowid' if query else 'passages p')
+        source += ' LEFT JOIN companies c ON c.accession = p.accession'
+        return source, ' AND '.join(conditions) or '1', params
+
+    def search(self, query=None, limit=20, **filters):
+        """Best passages of a search, as a DataFrame: BM25 order with a query,
+        index order without one; filters are labels, company, subdomain, year,
+        section and kind, each a value or a list of values."""
+        source, where, params = self._where(query, **filters)
+        if query:
+            columns = "bm25(passages_fts) AS bm25, snippet(passages_fts, 0, '[', ']', '...', 16) AS snippet, "
+            order = 'bm25'
+        else:
+            columns, order = 'NULL AS bm25, substr(p.text, 1, 200) AS snippet, ', 'p.id'
+        sql = ('SELECT p.id, %s p.kind, p.year, p.section, c.company, c.subdomain, p.cik, p.accession, p.path, '
+               "(SELECT group_concat(label, '|') FROM labels WHERE passage = p.id) AS labels, p.text "
+               'FROM %s WHERE %s ORDER BY %s LIMIT ?' % (columns, source, where, order))
+        return pd.read_sql_query(sql, self.db, params=params + [limit])
+
+    def facets(self, query=None, by='company', limit=50, **filters):
+        """Number of matching passages and filings per company, sub-domain,
+        year, section or label."""
+        column = {'company': 'c.company', 'subdomain': 'c.subdomain', 'year': 'p.year',
+                  'section': 'p.section', 'label': 'l.label'}[by]
+        source, where, params = self._where(query, **filters)
+        if by == 'label':
+            source += ' JOIN labels l ON l.passage = p.id'
+        sql = ('SELECT %s AS %s, COUNT(*) AS passages, COUNT(DISTINCT p.accession) AS filings FROM %s '
+               'WHERE %s GROUP BY 1 ORDER BY passages DESC LIMIT ?' % (column, by, source, where))
+        return pd.read_sql_query(sql, self.db, params=params + [limit])
+
+
+def write(frame, path):
+    if path.endswith('.parquet'):
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+    print('%d rows -> %s' % (len(frame), path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search the extracted paragraphs and sentences')
+    parser.add_argument('--index', default=INDEX, help='SQLite index file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('ingest', help='add paragraph, section or sentence files')
+    p.add_argument('files', nargs='+', help='Parquet files or dataset folders')
+    p.add_argument('--optimize', action='store_true', help='merge the FTS5 segments afterwards')
+    p = commands.add_parser('companies', help='load company names and sub-domains')
+    p.add_argument('source', help='10K_<year>_csv.csv file or cik_index folder')
+    for name in ('search', 'facets'):
+        p = commands.add_parser(name, help='matching passages' if name == 'search' else 'counts of the matches')
+        p.add_argument('query', nargs='?', help='words, or an FTS5 query ("supply chain" NEAR disruption)')
+        p.add_argument('--label', nargs='+', help='CAT labels of the sentence')
+        p.add_argument('--company', nargs='+', help='company names')
+        p.add_argument('--subdomain', nargs='+', help='sub-domains')
+        p.add_argument('--year', nargs='+', type=int, help='filing years, e.g. 2020')
+        p.add_argument('--section', nargs='+', help='sections: covid, sentence, "Item 1A", "Item 7"')
+        p.add_argument('--kind', nargs='+', choices=['paragraph', 'section', 'sentence'], help='passage kinds')
+        p.add_argument('-n', type=int, default=20, help='rows returned')
+        p.add_argument('--out', help='write the rows to a .parquet or .csv file')
+        if name == 'facets':
+            p.add_argument('--by', default='company', choices=['company', 'subdomain', 'year', 'section', 'label'])
+    args = parser.parse_args()
+
+    index = SearchIndex(args.index)
+    if args.command == 'ingest':
+        print('%d files ingested' % index.ingest(args.files))
+        if args.optimize:
+            index.optimize()
+    elif args.command == 'companies':
+        print('%d companies loaded' % index.add_companies(args.source))
+    else:
+        filters = dict(labels=args.label, company=args.company, subdomain=args.subdomain, year=args.year,
+                       section=args.section, kind=args.kind)
+        start = time.perf_counter()
+        if args.command == 'search':
+            result = index.search(args.query, args.n, **filters)
+        else:
+            result = index.facets(args.query, args.by, args.n, **filters)
+        elapsed = time.perf_counter() - start
+        if args.out:
+            write(result, args.out)
+        else:
+            shown = result.drop(columns=['text', 'path'], errors='ignore')
+            with pd.option_context('display.max_colwidth', 80, 'display.width', 200):
+                print(shown.to_string(index=False))
+        print('%d rows in %.1f ms' % (len(result), elapsed * 1000))
@@ -0,0 +1,363 @@
+"""End-to-end benchmarks of the pipeline stages on synthetic 10-K filings.
+
+Usage:
+    python run_benchmarks.py [--sizes 20 100 400] [--stages scrape paragraphs ...]
+        [--no-profile] [--repeat 1] [--save-baseline] [--compare [baseline.json]]
+For every corpus size (number of filings, generated by synthetic_corpus.py and
+kept in work/corpus-<size>) the stages run one after the other on the output
+of the stage before:
+
+    scrape      Item 1A and Item 7 of every filing (batch_scrape.scrape_chunk)
+    paragraphs  keyword paragraphs of every filing (covid_paragraphs, cold block cache)
+    conllu      spaCy parse of the paragraphs into CoNLL-U (2spacyconllu.py)
+    embeddings  noun counts, Word2Vec, embedding store, neighbour index and aspect
+                ranking ((3embedding)preprocessing.py --streaming)
+    scoring     CAT label scores of the sentences of the corpus (label model,
+                ScoringEngine, top N_TOPICS labels)
+
+Every stage runs in a fresh process, so its peak resident memory is its own,
+and reports its wall and cpu time, its throughput (items and MB per second)
+and, unless --no-profile, its hot spots from a second run under cProfile (the
+.prof files are kept in work/profiles; cProfile only sees the main thread, the
+Word2Vec worker threads show up as lock waits). Imports are not timed. A stage
+is skipped, with the reason, when a package or model it needs is not installed
+or a stage it depends on did not run; without a spaCy model the embeddings
+stage reads a CoNLL-U written from the generator's lexicon instead. Nothing is
+downloaded.
+
+The results are written to work/results.json; --save-baseline also writes them
+to baseline.json, --compare reports the change of every stage against a
+baseline and exits with status 1 when a stage got slower (or its memory grew)
+by more than --tolerance."""
+import argparse
+import cProfile
+import datetime
+import importlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import pstats
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+COLLECT = os.path.join(ROOT, '1. Data Collection')
+PARAGRAPHS = os.path.join(ROOT, '2.2 Extract COVID-related Paragraphs from 10K.')
+CAT = os.path.join(ROOT, '2.4 Strategy and Impact Extraction for Each Company', 'CAT(main codes for this project)')
+sys.path += [HERE, COLLECT, PARAGRAPHS, CAT]
+
+WORK = os.path.join(HERE, 'work')
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+# as WORD2VEC_PARAMS of (3embedding)preprocessing.py, on all cores of the machine
+WORD2VEC_PARAMS = dict(sg=0, negative=5, window=10, vector_size=200, min_count=2, epochs=5,
+                       workers=os.cpu_count() or 1)
+
+# functions listed per stage in the results
+HOT_SPOTS = 15
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def spacy_model_available(model):
+    if importlib.util.find_spec('spacy') is None:
+        return False
+    import spacy.util
+    return spacy.util.is_package(model) or os.path.isdir(model)
+
+
+def bench_scrape(ctx):
+    from batch_scrape import scrape_chunk
+    from synthetic_corpus import SECTIONS
+
+    records = scrape_chunk(ctx['paths'], SECTIONS)
+    missing = sum(r['error'] is not None for r in records)
+    if missing:
+        raise RuntimeError('%d of %d filings without all sections' % (missing, len(records)))
+    return {'items': len(records), 'unit': 'filings', 'bytes': ctx['bytes']}
+
+
+def bench_paragraphs(ctx):
+    import covid_paragraphs
+
+    cache = tempfile.mkdtemp(dir=ctx['work'])
+    try:
+        covid_paragraphs._init_worker(covid_paragraphs.KEYWORDS, cache)
+        rows = [covid_paragraphs._process(path) for path in ctx['paths']]
+    finally:
+        shutil.rmtree(cache)
+    errors = [row['error'] for row in rows if row['error']]
+    if errors:
+        raise RuntimeError('%d filings failed, e.g. %s' % (len(errors), errors[0]))
+    # one paragraph per line, the input of 2spacyconllu.py
+    n = 0
+    with open(os.path.join(ctx['work'], 'paragraphs.txt'), 'w', encoding='utf-8') as out:
+        for row in rows:
+            for paragraph in row['para_keywords'].split(covid_paragraphs.SEPARATOR):
+                if paragraph.strip():
+                    out.write(paragraph.replace('\n', ' ') + '\n')
+                    n += 1
+    return {'items': len(rows), 'unit': 'filings', 'bytes': ctx['bytes'], 'paragraphs': n}
+
+
+def bench_conllu(ctx):
+    spacyconllu = importlib.import_module('2spacyconllu')
+
+    source = os.path.join(ctx['work'], 'paragraphs.txt')
+    nlp, tagmap = spacyconllu.loadmodel(ctx['model'], ['ner'])
+    sentid = 1
+    with open(source, encoding='utf-8') as inp, \
+            open(os.path.join(ctx['work'], 'para.conllu'), 'w', encoding='utf-8', buffering=1 << 20) as out:
+        for doc in nlp.pipe(inp, batch_size=1000):
+            sentid = spacyconllu.writeconllu(doc, out, sentid, tagmap)
+    return {'items': sentid - 1, 'unit': 'sentences', 'bytes': os.path.getsize(source)}
+
+
+def bench_embeddings(ctx):
+    from gensim.models import Word2Vec
+
+    from ann_index import Neighbours
+    from corpus_stream import conllu_pass, rank_aspect_words
+    from embedding_store import EmbeddingStore
+
+    work = ctx['work']
+    conllu = os.path.join(work, 'para.conllu')
+    folder = os.path.join(work, 'embeddings')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    text = os.path.join(work, 'all_txt.txt')
+    counts = conllu_pass([conllu], text, os.path.join(work, 'nouns.json'))
+    model = Word2Vec(corpus_file=text, **WORD2VEC_PARAMS)
+    base = os.path.join(folder, 'word_vectors')
+    model.wv.save_word2vec_format(base + '.vec')
+    store = EmbeddingStore.from_keyed_vectors(model.wv, base, vec_path=base + '.vec')
+    Neighbours.load_or_build(store, base)
+    with open(os.path.join(work, 'aspect_words.json'), 'w', encoding='utf-8') as f:
+        json.dump(rank_aspect_words(counts, model.wv), f)
+    with open(text, encoding='utf-8') as f:
+        sentences = sum(1 for _ in f)
+    return {'items': sentences, 'unit': 'sentences', 'bytes': os.path.getsize(conllu),
+            'words': len(model.wv.index_to_key)}
+
+
+def bench_scoring(ctx):
+    from cat_scoring import top_k
+    from embedding_store import EmbeddingStore
+    from label_model import LabelModel
+
+    work = ctx['work']
+    with open(os.path.join(CAT, 'config', 'cat_labels.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    with open(os.path.join(work, 'aspect_words.json'), encoding='utf-8') as f:
+        aspects = [[x] for x in json.load(f)][:config['n_aspect_words']]
+    text = os.path.join(work, 'all_txt.txt')
+    with open(text, encoding='utf-8') as f:
+        sentences = [line.split() for line in f]
+
+    r = EmbeddingStore.open(os.path.join(work, 'embeddings', 'word_vectors'))
+    engine = LabelModel.build(r, aspects, config['labels'], config['gamma']).engine(r)
+    labelled = 0
+    for _, scores in engine.iter_scores(engine.encode(sentences)):
+        _, vals = top_k(scores, config['n_topics'])
+        labelled += int((vals > config['threshold']).any(1).sum())
+    return {'items': len(sentences), 'unit': 'sentences', 'bytes': os.path.getsize(text), 'labelled': labelled}
+
+
+# name -> (function, python packages it needs, modules imported before it is timed,
+#          stages whose outputs it reads)
+STAGES = {
+    'scrape': (bench_scrape, ['lxml', 'pandas', 'pyarrow'], ['batch_scrape', 'synthetic_corpus'], []),
+    'paragraphs': (bench_paragraphs, ['lxml', 'pandas'], ['covid_paragraphs'], []),
+    'conllu': (bench_conllu, ['spacy'], ['2spacyconllu'], ['paragraphs']),
+    'embeddings': (bench_embeddings, ['gensim', 'pandas'],
+                   ['gensim.models', 'ann_index', 'corpus_stream', 'embedding_store'], ['paragraphs']),
+    'scoring': (bench_scoring, [], ['cat_scoring', 'embedding_store', 'label_model'], ['embeddings']),
+}
+
+
+def hot_spots(profile, n=HOT_SPOTS):
+    """The n functions with the most own time of a profile, paths relative to the repository"""
+    stats = pstats.Stats(profile)
+    rows = []
+    for (path, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        if path.startswith(ROOT):
+            path = os.path.relpath(path, ROOT)
+        rows.append({'function': '%s:%d(%s)' % (path, line, name), 'calls': ncalls,
+                     'tottime_s': round(tottime, 4), 'cumtime_s': round(cumtime, 4)})
+    rows.sort(key=lambda row: row['tottime_s'], reverse=True)
+    return rows[:n]
+
+
+def run_stage(name, ctx, profile_path=None):
+    """Run one stage, in a fresh process started by measure()"""
+    function, _, modules, _ = STAGES[name]
+    for module in modules:
+        importlib.import_module(module)
+    rss_before = peak_rss_mb()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    if profile_path is None:
+        result = function(ctx)
+    else:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, ctx)
+        profiler.dump_stats(profile_path)
+    wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+    return dict(result, wall_s=wall, cpu_s=cpu, peak_rss_mb=peak_rss_mb(), rss_growth_mb=peak_rss_mb() - rss_before)
+
+
+def measure(name, ctx, repeat=1, profile_path=None):
+    """Best of repeat runs of a stage, each in a new process, then a profiled run"""
+    spawn = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        with spawn.Pool(1) as pool:
+            runs.append(pool.apply(run_stage, (name, ctx)))
+    result = min(runs, key=lambda run: run['wall_s'])
+    result['items_per_s'] = result['items'] / result['wall_s']
+    result['mb_per_s'] = result['bytes'] / 1024 / 1024 / result['wall_s']
+    if profile_path is not None:
+        with spawn.Pool(1) as pool:
+            profiled = pool.apply(run_stage, (name, ctx, profile_path))
+        result['profiled_wall_s'] = profiled['wall_s']
+        result['profile'] = os.path.relpath(profile_path, HERE)
+        result['hot_spots'] = hot_spots(profile_path)
+    return result
+
+
+def skip_reason(name, done, model):
+    _, packages, _, needs = STAGES[name]
+    missing = [p for p in packages if importlib.util.find_spec(p) is None]
+    if missing:
+        return 'missing package %s' % ', '.join(missing)
+    if name == 'conllu' and not spacy_model_available(model):
+        return 'spaCy model %s not installed' % model
+    blocked = [stage for stage in needs if stage not in done]
+    if blocked:
+        return '%s did not run' % ', '.join(blocked)
+    return None
+
+
+def run(sizes, stages, seed=0, repeat=1, profile=True, model='en_core_web_sm', work=WORK):
+    from synthetic_corpus import generate, write_conllu
+
+    results = []
+    for size in sizes:
+        corpus = os.path.join(work, 'corpus-%d' % size)
+        begin = time.perf_counter()
+        manifest = generate(corpus, size, seed)
+        paths = [os.path.join(corpus, f['path']) for f in manifest['filings']]
+        ctx = {'work': os.path.join(work, 'stages-%d' % size), 'paths': paths, 'model': model,
+               'bytes': sum(f['bytes'] for f in manifest['filings'])}
+        os.makedirs(ctx['work'], exist_ok=True)
+        print('%d filings (%.1f MB) ready in %.1fs' % (size, ctx['bytes'] / 1024 / 1024, time.perf_counter() - begin))
+
+        done = set()
+        for name in stages:
+            reason = skip_reason(name, done, model)
+            if name == 'embeddings' and reason is None and 'conllu' not in done:
+                # stand-in for the parse of the conllu stage
+                with open(os.path.join(ctx['work'], 'paragraphs.txt'), encoding='utf-8') as f:
+                    write_conllu(f, os.path.join(ctx['work'], 'para.conllu'))
+            row = {'size': size, 'stage': name}
+            if reason is not None:
+                row.update(status='skipped', reason=reason)
+                print('  %-10s skipped: %s' % (name, reason))
+                results.append(row)
+                continue
+            profile_path = None
+            if profile:
+                os.makedirs(os.path.join(work, 'profiles'), exist_ok=True)
+                profile_path = os.path.join(work, 'profiles', '%s-%d.prof' % (name, size))
+            try:
+                row.update(measure(name, ctx, repeat, profile_path), status='ok')
+            except Exception as e:
+                row.update(status='failed', reason='%s: %s' % (type(e).__name__, e))
+                print('  %-10s failed: %s' % (name, row['reason']))
+                results.append(row)
+                continue
+            if name == 'embeddings' and 'conllu' not in done:
+                row['input'] = 'synthetic CoNLL-U'
+            done.add(name)
+            results.append(row)
+            print('  %-10s %8.2fs %10.1f %s/s %7.2f MB/s  peak %6.0f MB%s' % (
+                name, row['wall_s'], row['items_per_s'], row['unit'], row['mb_per_s'], row['peak_rss_mb'],
+                '  top: %s' % row['hot_spots'][0]['function'] if row.get('hot_spots') else ''))
+    return results
+
+
+def machine():
+    versions = {}
+    for package in ('numpy', 'pandas', 'pyarrow', 'lxml', 'spacy', 'gensim'):
+        try:
+            versions[package] = importlib.import_module(package).__version__
+        except (ImportError, AttributeError):
+            pass
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'packages': versions}
+
+
+def compare(results, baseline, tolerance=0.2, memory_slack_mb=20):
+    """
+    Changes against a baseline, one line per stage and size run in both;
+    returns the regressions: throughput down or peak memory up by more than tolerance
+    """
+    before = {(row['size'], row['stage']): row for row in baseline['results'] if row['status'] == 'ok'}
+    regressions = []
+    print('%-6s %-10s %12s %12s %8s %10s %10s' % ('size', 'stage', 'baseline/s', 'now/s', 'change', 'peak MB', 'was MB'))
+    for row in results:
+        old = before.get((row['size'], row['stage']))
+        if old is None or row['status'] != 'ok':
+            continue
+        change = row['items_per_s'] / old['items_per_s'] - 1
+        slower = change < -tolerance
+        bigger = row['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance) + memory_slack_mb
+        print('%-6d %-10s %12.1f %12.1f %+7.0f%% %10.0f %10.0f%s' % (
+            row['size'], row['stage'], old['items_per_s'], row['items_per_s'], change * 100, row['peak_rss_mb'],
+            old['peak_rss_mb'], '  <- slower' if slower else '  <- more memory' if bigger else ''))
+        if slower or bigger:
+            regressions.append(row)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on synthetic filings')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[20, 100, 400], help='corpus sizes in filings')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES), help='stages to run')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is reported')
+    parser.add_argument('--no-profile', action='store_true', help='skip the cProfile run of every stage')
+    parser.add_argument('--model', default='en_core_web_sm', help='spaCy model of the conllu stage')
+    parser.add_argument('--work', default=WORK, help='folder of the corpora, stage outputs and results')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to baseline.json')
+    parser.add_argument('--compare', nargs='?', const=BASELINE, help='baseline to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change reported as a regression')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        # read first, the baseline may be the results file of the last run
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    stages = [name for name in STAGES if name in args.stages]
+    results = run(args.sizes, stages, args.seed, args.repeat, not args.no_profile, args.model, args.work)
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'machine': machine(),
+              'seed': args.seed, 'sizes': args.sizes, 'results': results}
+    paths = [os.path.join(args.work, 'results.json')] + ([BASELINE] if args.save_baseline else [])
+    for path in paths:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        print('results written to %s' % path)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('%d regression(s)' % len(regressions))
+            sys.exit(1)
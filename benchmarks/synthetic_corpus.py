@@ -0,0 +1,284 @@
+"""Reproducible synthetic 10-K filings for the benchmarks.
+
+Usage: python synthetic_corpus.py --out work/corpus --filings 100 [--seed 0] [--check]
+Writes <out>/10-K/<year>/<cik>/<accession>/filing-details.html, the folder
+layout of the downloader, and <out>/manifest.json. Every filing uses one of
+the heading layouts of the patterns p1 - p13 of TenKScraper (see
+section_index.PATTERNS), in turn, and has a table of contents, all the items
+of a 10-K with paragraphs of generated business text (split by page breaks
+now and then), financial tables and, in the 2020 and 2021 filings, paragraphs
+about the pandemic built from the words of the CAT labels. The same seed and
+number of filings always give the same bytes.
+
+p6 is the same regular expression as p3, so its filings (upper case ITEM
+headings) are extracted by p3. --check reports the first pattern which
+extracts Item 1A and Item 7 from every layout with the original regular
+expressions."""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(ROOT, '1. Data Collection'))
+
+# bump when the generated filings change, so cached corpora are regenerated
+VERSION = '2'
+
+YEARS = ('19', '20', '21')
+
+# the section pairs the benchmarks scrape; their second items are end headings
+SECTIONS = [('Item 1A', 'Item 1B'), ('Item 7', 'Item 7A')]
+
+ITEMS = [
+    ('1', 'Business'), ('1A', 'Risk Factors'), ('1B', 'Unresolved Staff Comments'), ('2', 'Properties'),
+    ('3', 'Legal Proceedings'), ('4', 'Mine Safety Disclosures'),
+    ('5', 'Market for Registrant\'s Common Equity and Related Stockholder Matters'),
+    ('6', 'Selected Financial Data'),
+    ('7', 'Management\'s Discussion and Analysis of Financial Condition and Results of Operations'),
+    ('7A', 'Quantitative and Qualitative Disclosures About Market Risk'),
+    ('8', 'Financial Statements and Supplementary Data'),
+    ('9', 'Changes in and Disagreements with Accountants on Accounting and Financial Disclosure'),
+    ('9A', 'Controls and Procedures'), ('9B', 'Other Information'),
+    ('10', 'Directors, Executive Officers and Corporate Governance'), ('11', 'Executive Compensation'),
+    ('12', 'Security Ownership of Certain Beneficial Owners and Management'),
+    ('13', 'Certain Relationships and Related Transactions'), ('14', 'Principal Accountant Fees and Services'),
+    ('15', 'Exhibits and Financial Statement Schedules'),
+]
+END_ITEMS = {end[len('Item '):] for _, end in SECTIONS}
+
+ARIAL = '<font style="font-family:Arial;font-size:10pt;">'
+UNDERLINE = '<font style="font-family:Arial;text-decoration:underline;">'
+
+# (start heading, end heading) of every layout, p1 - p13; {n} is the item number, {t} its title
+LAYOUTS = [
+    ('<p style="margin-top:12pt;font-weight:bold;">Item {n}. {t}</p>',) * 2,
+    ('<p><b>Item {n}. {t}</b></p>',) * 2,
+    ('<p><b><a name="item{n}"></a>Item {n}.</b> {t}</p>',) * 2,
+    ('<p><b><a name="item{n}"></a>Item {n}. {t}.</b></p>',) * 2,
+    ('<p><b>' + ARIAL + 'Item {n}. {t}</font></b></p>',) * 2,
+    ('<p><b><a name="item{n}"></a>ITEM {n}.</b> {T}</p>',) * 2,
+    ('<p>' + UNDERLINE + 'Item {n}</font> {t}</p>', '<p>' + UNDERLINE + 'Item {n}.</font> {t}</p>'),
+    ('<p>' + UNDERLINE + 'Item {n}.</font> {t}</p>',) * 2,
+    ('<p>' + ARIAL + 'Item {n}: {t}</font></p>',) * 2,
+    ('<p>' + ARIAL + 'Item {n}.</font> {t}</p>',) * 2,
+    ('<p>Item {n}. {t}</p>', '<p>' + ARIAL + 'Item {n}.</font> {t}</p>'),
+    ('<p><b>' + ARIAL + 'Item {n} {t}</font></b></p>', '<p><b>' + ARIAL + 'Item {n}</font></b> {t}</p>'),
+    ('<p><b><a name="item{n}"></a>Item {n}. {t}.</b></p>', '<p><b>Item {n}.</b> {t}</p>'),
+]
+
+PARAGRAPH = '<div style="margin-top:6pt;text-align:justify;"><font style="font-family:Times New Roman;font-size:10pt;">{}</font></div>\n'
+PAGE_BREAK = '<hr style="page-break-after:always"/>\n<p style="text-align:center;">{}</p>\n'
+
+# the generator's lexicon, also the part of speech of the synthetic CoNLL-U
+WORDS = {
+    'DET': 'the our its this each any such these'.split(),
+    'ADJ': ('significant additional certain future adverse global financial operational material '
+            'substantial competitive regulatory economic strategic new current').split(),
+    'NOUN': ('company business revenue customers products services operations results costs market '
+             'demand supply growth segment margin investments liquidity capital debt facilities '
+             'employees suppliers contracts inventory sales expenses cash assets technology risk '
+             'agreements shareholders quarter period management brand distribution').split(),
+    'VERB': ('affect increase reduce expect depend require maintain generate provide continue '
+             'operate manage invest develop acquire impact limit improve').split(),
+    'ADP': 'in of for with from during under across through'.split(),
+    'AUX': 'may could will would'.split(),
+}
+KEYWORD_PHRASES = ['the COVID-19 pandemic', 'the coronavirus outbreak', 'the pandemic', 'the COVID-19 epidemic']
+
+
+def label_words():
+    """Words of the CAT labels, so the label vectors of the scoring benchmark are not empty"""
+    path = os.path.join(ROOT, '2.4 Strategy and Impact Extraction for Each Company',
+                        'CAT(main codes for this project)', 'config', 'cat_labels.json')
+    with open(path, encoding='utf-8') as f:
+        return [label.split() for label in json.load(f)['labels']]
+
+
+class TextGenerator:
+    """Sentences and paragraphs of 10-K style text from a seeded random generator"""
+
+    def __init__(self, rng, labels):
+        self.rng = rng
+        self.labels = labels
+
+    def words(self, tag, n=1):
+        return [self.rng.choice(WORDS[tag]) for _ in range(n)]
+
+    def sentence(self):
+        r = self.rng
+        words = self.words('DET') + self.words('ADJ', r.randint(0, 2)) + self.words('NOUN')
+        words += self.words('AUX') + self.words('VERB') + self.words('DET') + self.words('NOUN')
+        for _ in range(r.randint(0, 3)):
+            words += self.words('ADP') + self.words('DET') + self.words('ADJ', r.randint(0, 1)) + self.words('NOUN')
+        text = ' '.join(words)
+        return text[0].upper() + text[1:] + '.'
+
+    def covid_sentence(self):
+        r = self.rng
+        label = ' '.join(r.choice(self.labels))
+        text = '%s %s %s %s and %s' % (r.choice(['As a result of', 'Due to', 'In response to', 'During']),
+                                       r.choice(KEYWORD_PHRASES), ' '.join(self.words('DET') + self.words('NOUN')),
+                                       ' '.join(self.words('AUX') + self.words('VERB')), label)
+        return text + ' ' + ' '.join(self.words('ADP') + self.words('DET') + self.words('NOUN')) + '.'
+
+    def paragraph(self, covid_share):
+        sentences = [self.sentence() for _ in range(self.rng.randint(3, 8))]
+        if self.rng.random() < covid_share:
+            sentences.insert(self.rng.randrange(len(sentences) + 1), self.covid_sentence())
+        return ' '.join(sentences)
+
+
+def heading(layout, number, title):
+    template = LAYOUTS[layout][1 if number in END_ITEMS else 0]
+    return template.format(n=number, t=title, T=title.upper()) + '\n'
+
+
+def financial_table(rng, rows):
+    cells = '<td style="padding:0 4pt;"><font style="font-family:Times New Roman;font-size:8pt;">{}</font></td>'
+    out = ['<table style="width:100%;border-collapse:collapse;">\n']
+    for _ in range(rows):
+        name = '%s %s' % (rng.choice(WORDS['ADJ']).capitalize(), rng.choice(WORDS['NOUN']))
+        values = ''.join(cells.format('$') + cells.format('{:,}'.format(rng.randint(100, 9999999))) for _ in range(3))
+        out.append('<tr>' + cells.format(name) + values + '</tr>\n')
+    out.append('</table>\n')
+    return ''.join(out)
+
+
+def filing_html(rng, layout, year, company, labels, paragraphs=6, table_rows=40):
+    """The html of one filing as bytes"""
+    text = TextGenerator(rng, labels)
+    covid_share = 0.0 if year == '19' else 0.3
+    out = ['<html><head><title>10-K</title></head><body>\n',
+           '<p style="text-align:center;">UNITED STATES SECURITIES AND EXCHANGE COMMISSION</p>\n',
+           '<p style="text-align:center;">FORM 10-K</p>\n<p style="text-align:center;">%s</p>\n' % company,
+           '<table>\n']
+    out += ['<tr><td>Item %s</td><td>%s</td><td>%d</td></tr>\n' % (n, t, i + 3) for i, (n, t) in enumerate(ITEMS)]
+    out.append('</table>\n')
+    page = 1
+    for number, title in ITEMS:
+        out.append(heading(layout, number, title))
+        for _ in range(rng.randint(max(1, paragraphs // 2), paragraphs * 3 // 2 + 1)):
+            paragraph = text.paragraph(covid_share)
+            if rng.random() < 0.1:
+                # a page break in the middle of a sentence, the next block starts in lower case
+                words = paragraph.split(' ')
+                cut = rng.randint(len(words) // 3, 2 * len(words) // 3)
+                while cut < len(words) - 1 and not words[cut][0].islower():
+                    cut += 1
+                out.append(PARAGRAPH.format(' '.join(words[:cut])))
+                out.append(PAGE_BREAK.format(page))
+                page += 1
+                paragraph = ' '.join(words[cut:])
+            out.append(PARAGRAPH.format(paragraph))
+        if number in ('7', '8'):
+            out.append(financial_table(rng, table_rows))
+    out.append('</body></html>\n')
+    return ''.join(out).encode('utf-8')
+
+
+def generate(out, n_filings, seed=0, paragraphs=6, table_rows=40):
+    """
+    Write n_filings filings under out, or reuse them if a manifest with the same
+    parameters exists; returns the manifest (parameters and one entry per filing)
+    """
+    params = {'version': VERSION, 'filings': n_filings, 'seed': seed, 'paragraphs': paragraphs,
+              'table_rows': table_rows}
+    manifest_path = os.path.join(out, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            return manifest
+
+    labels = label_words()
+    filings = []
+    for i in range(n_filings):
+        rng = random.Random('%d-%d' % (seed, i))
+        layout = i % len(LAYOUTS)
+        year = YEARS[i % len(YEARS)]
+        cik = str(1000000 + seed * 100000 + i)
+        accession = '%010d-%s-%06d' % (int(cik), year, i + 1)
+        folder = os.path.join(out, '10-K', year, cik, accession)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, 'filing-details.html')
+        html = filing_html(rng, layout, year, 'Synthetic Company %d Inc.' % i, labels, paragraphs, table_rows)
+        with open(path, 'wb') as f:
+            f.write(html)
+        filings.append({'path': os.path.relpath(path, out), 'layout': 'p%d' % (layout + 1), 'year': year,
+                        'cik': cik, 'accession': accession, 'bytes': len(html)})
+    manifest = {'params': params, 'filings': filings}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def check(out, manifest):
+    """First pattern (original regular expressions) extracting every section pair, per layout"""
+    from section_index import PATTERNS, legacy_pattern, normalize_page
+
+    found = {}
+    for filing in manifest['filings']:
+        if filing['layout'] in found:
+            continue
+        with open(os.path.join(out, filing['path']), 'rb') as f:
+            page = normalize_page(f.read())
+        matched = []
+        for section, next_section in SECTIONS:
+            pattern = next((i for i in range(len(PATTERNS))
+                            if re.search(legacy_pattern(i, section, next_section), page, flags=re.IGNORECASE)), None)
+            matched.append('p%d' % (pattern + 1) if pattern is not None else None)
+        found[filing['layout']] = matched
+    return found
+
+
+# punctuation split off the words by the synthetic CoNLL-U tokenizer
+PUNCT = re.compile(r"([.,;:()'\"])")
+
+
+def write_conllu(lines, path):
+    """
+    CoNLL-U of text lines tagged with the generator's lexicon (words outside it are PROPN),
+    split into sentences at full stops; a stand-in for 2spacyconllu.py without a spaCy model
+    """
+    tags = {word: tag for tag, words in WORDS.items() for word in words}
+    sentence_id = 1
+    with open(path, 'w', encoding='utf-8', buffering=1 << 20) as out:
+        for line in lines:
+            tokens = PUNCT.sub(r' \1 ', line).split()
+            while tokens:
+                end = tokens.index('.') + 1 if '.' in tokens else len(tokens)
+                sentence, tokens = tokens[:end], tokens[end:]
+                out.write('# sent_id = %d\n# text = %s\n' % (sentence_id, ' '.join(sentence)))
+                for i, token in enumerate(sentence, 1):
+                    if PUNCT.fullmatch(token):
+                        tag = 'PUNCT'
+                    elif token[0].isdigit():
+                        tag = 'NUM'
+                    else:
+                        tag = tags.get(token.lower(), 'NOUN' if token.islower() else 'PROPN')
+                    out.write('%d\t%s\t%s\t%s\t_\t_\t%d\t%s\t_\t_\n' % (i, token, token.lower(), tag, 0 if i == 1 else 1,
+                                                                        'root' if i == 1 else 'dep'))
+                out.write('\n')
+                sentence_id += 1
+    return sentence_id - 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic 10-K filings')
+    parser.add_argument('--out', default='work/corpus', help='folder of the filings')
+    parser.add_argument('--filings', type=int, default=100, help='number of filings')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--paragraphs', type=int, default=6, help='mean number of paragraphs per item')
+    parser.add_argument('--table-rows', type=int, default=40, help='rows of the financial tables')
+    parser.add_argument('--check', action='store_true', help='report the pattern extracting every layout')
+    args = parser.parse_args()
+
+    manifest = generate(args.out, args.filings, args.seed, args.paragraphs, args.table_rows)
+    size = sum(f['bytes'] for f in manifest['filings'])
+    print('%d filings, %.1f MB in %s' % (len(manifest['filings']), size / 1024 / 1024, args.out))
+    if args.check:
+        for layout, patterns in check(args.out, manifest).items():
+            print('%s: %s' % (layout, ', '.join('%s by %s' % (s[0], p) for s, p in zip(SECTIONS, patterns))))
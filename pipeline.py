@@ -0,0 +1,408 @@
+"""Runs the scripts of the project as one pipeline.
+
+Usage:
+    python pipeline.py run [stage ...] [--jobs 4] [--force stage ...]
+    python pipeline.py status [stage ...]
+    python pipeline.py log [--run RUN_ID]
+The stages are declared in pipeline.json: the command of every stage, the
+folder it runs in, its input and output paths (relative to that folder, an
+input starting with ? is optional) and its parameters, which fill the {name}
+placeholders of the command and paths. A stage depends on the stages whose
+outputs are, contain or are inside its inputs; the stages it names in "after"
+only run before it when both are selected, and their failure does not block
+it. A stage with "partitions" runs once per partition (e.g. per year),
+with {partition} filled in. Inputs made outside the pipeline (by hand or by
+the notebooks) are listed under "external" instead: no stage may write them,
+and any other input which no stage writes is reported as a warning, so a
+missing link between two stages does not go unnoticed. "note" is shown by
+the status command.
+
+A stage is skipped when the hash of its command, parameters, scripts and the
+content of its inputs is the hash of its last successful run and its outputs
+exist, so after a change only the stages downstream of it run again, and only
+if their inputs really changed. Files are hashed again only when their size or
+modification time changed. Ready stages run in parallel (--jobs), every one
+logging to .pipeline/logs/<stage>.log. Each finished stage appends a line to
+.pipeline/runs.jsonl with its wall and cpu time, the peak memory of its
+largest process and the number of items (Parquet rows, lines or files) of its
+outputs. Everything runs locally; only the download stage uses the network."""
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG = os.path.join(ROOT, 'pipeline.json')
+STATE_DIR = os.path.join(ROOT, '.pipeline')
+# outputs counted in lines
+LINE_FILES = ('.txt', '.csv', '.tsv', '.conllu', '.jsonl', '.vec', '.vocab')
+
+
+def substitute(value, variables):
+    """Fill the {name} placeholders of a string or list of strings; unknown
+    names are left as they are."""
+    if isinstance(value, list):
+        return [substitute(v, variables) for v in value]
+    return re.sub(r'\{(\w+)\}', lambda m: str(variables.get(m.group(1), m.group(0))), value)
+
+
+def count_items(path):
+    """Rows of a Parquet file or folder of Parquet files, lines of a text
+    file, files of another folder, None for anything else."""
+    if os.path.isdir(path):
+        files = [os.path.join(folder, name) for folder, _, names in os.walk(path) for name in names]
+        parquet = [f for f in files if f.endswith('.parquet')]
+        if parquet:
+            return sum(count_items(f) for f in parquet)
+        return len(files)
+    if not os.path.exists(path):
+        return None
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    if path.endswith(LINE_FILES):
+        n = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                n += block.count(b'\n')
+        return n
+    return None
+
+
+class Hasher:
+    """Content hashes of files and folders. The hash of a file is kept with
+    its size and modification time and only computed again when they change."""
+
+    def __init__(self, memo):
+        self.memo = memo
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        stat = os.stat(path)
+        with self.lock:
+            known = self.memo.get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        with self.lock:
+            self.memo[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def path(self, path):
+        """sha1 of a file, of the names and hashes of all files of a folder,
+        None if the path does not exist"""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha1()
+        for folder, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                full = os.path.join(folder, name)
+                digest.update(('%s\t%s\n' % (os.path.relpath(full, path), self.file(full))).encode('utf-8'))
+        return digest.hexdigest()
+
+
+class Stage:
+    """One run of a declared stage, or of one partition of it."""
+
+    def __init__(self, spec, variables, partition=None):
+        self.group = spec['name']
+        self.name = self.group if partition is None else '%s[%s]' % (self.group, partition)
+        self.params = dict(spec.get('params', {}))
+        variables = dict(variables, **self.params)
+        if partition is not None:
+            variables['partition'] = partition
+        self.cwd = os.path.normpath(os.path.join(ROOT, substitute(spec.get('cwd', '.'), variables)))
+        self.command = substitute(spec['cmd'], variables)
+        self.inputs, self.optional = [], set()
+        for path in substitute(spec.get('inputs', []), variables):
+            if path.startswith('?'):
+                path = self.resolve(path[1:])
+                self.optional.add(path)
+            else:
+                path = self.resolve(path)
+            self.inputs.append(path)
+        # made outside the pipeline, no stage writes them
+        self.external = [self.resolve(p) for p in substitute(spec.get('external', []), variables)]
+        self.inputs += [p for p in self.external if p not in self.inputs]
+        self.note = spec.get('note')
+        # the scripts run by the command are inputs too
+        scripts = [self.resolve(c) for c in self.command[1:] if c.endswith('.py')]
+        self.inputs += [p for p in scripts if os.path.isfile(p) and p not in self.inputs]
+        self.outputs = [self.resolve(p) for p in substitute(spec.get('outputs', []), variables)]
+        self.after = spec.get('after', [])
+        self.deps, self.ordering = set(), set()
+
+    def resolve(self, path):
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def key(self, hasher):
+        """Hash of everything the outputs of the stage depend on, paths
+        relative to the repository so that it can be moved."""
+        inputs = [[os.path.relpath(p, ROOT), hasher.path(p)] for p in self.inputs]
+        missing = [p for p, (_, digest) in zip(self.inputs, inputs) if digest is None and p not in self.optional]
+        if missing:
+            kind = 'external input' if missing[0] in self.external else 'input'
+            raise FileNotFoundError('missing %s %s' % (kind, missing[0]))
+        description = [self.command, os.path.relpath(self.cwd, ROOT), sorted(self.params.items()), inputs]
+        return hashlib.sha1(json.dumps(description).encode('utf-8')).hexdigest()
+
+    def execute(self, log_path):
+        """Run the command; (exit code, wall seconds, resource usage)"""
+        os.makedirs(self.cwd, exist_ok=True)
+        for path in self.outputs:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        command = [sys.executable if c == 'python' else c for c in self.command]
+        start = time.perf_counter()
+        with open(log_path, 'w', encoding='utf-8') as log:
+            process = subprocess.Popen(command, cwd=self.cwd, stdout=log, stderr=subprocess.STDOUT)
+            # wait4 gives the rusage of this child alone (its maximum resident
+            # set covers its own children as well), unlike RUSAGE_CHILDREN
+            _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, time.perf_counter() - start, usage
+
+
+class Pipeline:
+    """The stages of pipeline.json, their dependencies and the state of
+    their last successful runs."""
+
+    def __init__(self, config=CONFIG, state_dir=STATE_DIR):
+        with open(config, encoding='utf-8') as f:
+            spec = json.load(f)
+        variables = {'root': ROOT}
+        # variables may refer to the ones before them
+        for name, value in spec.get('vars', {}).items():
+            variables[name] = substitute(value, variables)
+        self.stages = {}
+        for stage in spec['stages']:
+            for partition in stage.get('partitions', [None]):
+                s = Stage(stage, variables, partition)
+                self.stages[s.name] = s
+        self.link()
+        self.order = self.topological_order()
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, 'state.json')
+        self.state = {'stages': {}, 'hashes': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        self.hasher = Hasher(self.state['hashes'])
+        self.lock = threading.Lock()
+
+    def link(self):
+        def overlaps(a, b):
+            return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+        for stage in self.stages.values():
+            for other in self.stages.values():
+                if other is stage:
+                    continue
+                if any(overlaps(i, o) for i in stage.external for o in other.outputs):
+                    raise ValueError('%s: external input written by %s' % (stage.name, other.name))
+                if any(overlaps(i, o) for i in stage.inputs for o in other.outputs):
+                    stage.deps.add(other.name)
+                elif other.group in stage.after:
+                    stage.ordering.add(other.name)
+        outputs = [o for other in self.stages.values() for o in other.outputs]
+        for stage in self.stages.values():
+            for path in stage.inputs:
+                if (path in stage.external or path in stage.optional or path.endswith('.py')
+                        or any(overlaps(path, o) for o in outputs)):
+                    continue
+                print('warning: %s reads %s, which no stage writes and is not declared external' % (
+                    stage.name, os.path.relpath(path, ROOT)), file=sys.stderr)
+
+    def topological_order(self):
+        order, visiting = [], set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError('dependency cycle through %s' % name)
+            visiting.add(name)
+            for dep in sorted(self.stages[name].deps | self.stages[name].ordering):
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def select(self, targets=None):
+        """Stages to run for some stage (or partition) names, with everything
+        upstream of them, in dependency order; all stages by default."""
+        if not targets:
+            return list(self.order)
+        unknown = [t for t in targets if not any(t in (s.name, s.group) for s in self.stages.values())]
+        if unknown:
+            raise ValueError('unknown stage %s' % unknown[0])
+        selected = set()
+        todo = [s.name for s in self.stages.values() if s.name in targets or s.group in targets]
+        while todo:
+            name = todo.pop()
+            if name not in selected:
+                selected.add(name)
+                todo.extend(self.stages[name].deps)
+        return [name for name in self.order if name in selected]
+
+    def fresh(self, stage, key):
+        last = self.state['stages'].get(stage.name)
+        return last is not None and last['key'] == key and all(os.path.exists(p) for p in stage.outputs)
+
+    def save_state(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with self.lock:
+            data = json.dumps(self.state)
+        with open(self.state_path + '.part', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(self.state_path + '.part', self.state_path)
+
+    def process(self, stage, run_id, force=False):
+        """Run a stage unless it is fresh; returns its run log record"""
+        record = {'run': run_id, 'stage': stage.name, 'started': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        start = time.perf_counter()
+        try:
+            key = stage.key(self.hasher)
+        except FileNotFoundError as e:
+            return dict(record, status='failed', error=str(e), wall_s=round(time.perf_counter() - start, 3))
+        record['key'] = key
+        if not force and self.fresh(stage, key):
+            last = self.state['stages'][stage.name]
+            return dict(record, status='skipped', wall_s=round(time.perf_counter() - start, 3),
+                        items=last.get('items', {}))
+        log_path = os.path.join(self.state_dir, 'logs', stage.name + '.log')
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        code, wall, usage = stage.execute(log_path)
+        record.update(wall_s=round(wall, 3), user_s=round(usage.ru_utime, 3), sys_s=round(usage.ru_stime, 3),
+                      max_rss_mb=round(usage.ru_maxrss / 1024, 1), returncode=code, log=os.path.relpath(log_path, ROOT))
+        if code != 0:
+            return dict(record, status='failed', error='exit code %d' % code)
+        missing = [p for p in stage.outputs if not os.path.exists(p)]
+        if missing:
+            return dict(record, status='failed', error='output %s not written' % os.path.relpath(missing[0], ROOT))
+        record['items'] = {os.path.relpath(p, stage.cwd): count_items(p) for p in stage.outputs}
+        with self.lock:
+            self.state['stages'][stage.name] = {'key': key, 'finished': record['started'], 'items': record['items']}
+        return dict(record, status='ran')
+
+    def run(self, targets=None, jobs=1, force=()):
+        """Run the selected stages, as many at once as jobs and dependencies
+        allow; returns the run log records"""
+        pending = self.select(targets)
+        run_id = '%s-%d' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        os.makedirs(self.state_dir, exist_ok=True)
+        records, status, running = [], {}, {}
+        with ThreadPoolExecutor(max_workers=jobs) as pool, \
+                open(os.path.join(self.state_dir, 'runs.jsonl'), 'a', encoding='utf-8') as log:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if any(d in pending or d in running.values() for d in stage.deps | stage.ordering):
+                        continue
+                    pending.remove(name)
+                    failed = [d for d in stage.deps if status.get(d) in ('failed', 'blocked')]
+                    if failed:
+                        record = {'run': run_id, 'stage': name, 'status': 'blocked', 'error': 'after %s' % failed[0]}
+                        status[name] = 'blocked'
+                        records.append(record)
+                        log.write(json.dumps(record) + '\n')
+                        print('%-24s blocked by %s' % (name, failed[0]))
+                        continue
+                    forced = name in force or stage.group in force
+                    running[pool.submit(self.process, stage, run_id, forced)] = name
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    record = future.result()
+                    status[name] = record['status']
+                    records.append(record)
+                    log.write(json.dumps(record) + '\n')
+                    log.flush()
+                    self.save_state()
+                    print(describe(record))
+        self.save_state()
+        return records
+
+    def status(self, targets=None):
+        """(stage, fresh/stale/missing input) as of now; a stage is stale
+        as well when a stage upstream of it is"""
+        result = {}
+        for name in self.select(targets):
+            stage = self.stages[name]
+            try:
+                fresh = self.fresh(stage, stage.key(self.hasher))
+                result[name] = 'fresh' if fresh and all(result[d] == 'fresh' for d in stage.deps) else 'stale'
+            except FileNotFoundError as e:
+                # inputs an upstream stage has not written yet
+                result[name] = 'stale' if any(result[d] != 'fresh' for d in stage.deps) else str(e)
+        self.save_state()
+        return result
+
+
+def describe(record):
+    items = ', '.join('%s %s' % (n, path) for path, n in record.get('items', {}).items() if n is not None)
+    line = '%-24s %-8s %8.1fs' % (record['stage'], record['status'], record.get('wall_s', 0))
+    if 'max_rss_mb' in record:
+        line += ' %8.0f MB' % record['max_rss_mb']
+    if record.get('error'):
+        line += '  ' + record['error']
+    return line + ('  ' + items if items else '')
+
+
+def read_log(path, run_id=None):
+    """Records of one run of the run log, the last one by default"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if run_id is None and records:
+        run_id = records[-1]['run']
+    return [r for r in records if r['run'] == run_id]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the pipeline stages declared in pipeline.json')
+    parser.add_argument('--config', default=CONFIG, help='stage declarations')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='run stages whose inputs changed')
+    p.add_argument('stages', nargs='*', help='stages or partitions like paragraphs[20], with their upstream stages')
+    p.add_argument('--jobs', type=int, default=os.cpu_count(), help='stages run at once')
+    p.add_argument('--force', nargs='+', default=[], help='stages run even if fresh')
+    p = commands.add_parser('status', help='which stages would run')
+    p.add_argument('stages', nargs='*', help='stages or partitions, with their upstream stages')
+    p = commands.add_parser('log', help='records of a run')
+    p.add_argument('--run', help='run id, default the last run')
+    args = parser.parse_args()
+
+    if args.command == 'log':
+        for record in read_log(os.path.join(STATE_DIR, 'runs.jsonl'), args.run):
+            print(describe(record))
+        sys.exit()
+    pipeline = Pipeline(args.config)
+    if args.command == 'status':
+        for name, state in pipeline.status(args.stages).items():
+            note = pipeline.stages[name].note
+            print('%-24s %s' % (name, state) + ('  (%s)' % note if note else ''))
+    else:
+        records = pipeline.run(args.stages, args.jobs, args.force)
+        failed = [r['stage'] for r in records if r['status'] in ('failed', 'blocked')]
+        print('%d stages, %d ran, %d skipped, %d failed or blocked' % (
+            len(records), sum(r['status'] == 'ran' for r in records),
+            sum(r['status'] == 'skipped' for r in records), len(failed)))
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             '2.2 Extract COVID-related Paragraphs from 10K.'))
+from paragraph_diff import SEPARATOR, ParagraphStore, diff_file
+
+PARAGRAPHS = {
+    'a': 'The pandemic closed our stores in March and most employees worked from home for months.',
+    'b': 'We expect the supply chain disruptions caused by COVID to continue into the next fiscal year.',
+    'c': 'Government relief programs reduced our payroll costs and helped us keep all of our staff.',
+}
+
+
+def write_years(folder):
+    """Paragraph files of one company for three years with the paragraphs a / a, b / a, b, c"""
+    paths = []
+    for year, keys in ((2019, 'a'), (2020, 'ab'), (2021, 'abc')):
+        filing = os.path.join('data', '10-K', str(year)[2:], '320193', f'0000320193-{year % 100}-000001',
+                              'filing-details.html')
+        path = os.path.join(folder, f'10K_{year}.parquet')
+        para_keywords = ''.join(PARAGRAPHS[k] + SEPARATOR for k in keys)
+        pd.DataFrame({'path': [filing], 'para_keywords': [para_keywords]}).to_parquet(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def run_diff(store_path, paths):
+    store = ParagraphStore(store_path)
+    counts = [int((diff_file(store, path)['status'] == 'new').sum()) for path in paths]
+    store.close()
+    new = [pd.read_parquet(path[:-len('.parquet')] + '_new.parquet')['para_keywords'].tolist() for path in paths]
+    return counts, new
+
+
+def test_diff_twice_is_stable(tmp_path):
+    paths = write_years(str(tmp_path))
+    store_path = str(tmp_path / 'paragraphs.sqlite')
+
+    first = run_diff(store_path, paths)
+    assert first[0] == [1, 1, 1]
+    assert run_diff(store_path, paths) == first
+    # a single year diffed again over the full store keeps its new paragraphs
+    assert run_diff(store_path, paths[:1]) == ([1], first[1][:1])